@@ -0,0 +1,109 @@
+"""Frames per second through discord.py's PCMVolumeTransformer and the
+GainTransformer that replaced it, and the largest jump between two
+samples when the volume changes.
+
+    python scripts/bench_gain.py [frames]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import discord
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from audio.gain import GainTransformer  # noqa: E402
+
+
+FRAME_SIZE = discord.opus.Encoder.FRAME_SIZE
+
+# Frames applied at once by a batching reader, a second of audio
+BATCH = 50
+
+
+class PCMSource(discord.AudioSource):
+    """Hands out the same PCM frame a number of times"""
+
+    def __init__(self, frame:bytes, count:int):
+        self.frame = frame
+        self.count = count
+
+    def read(self) -> bytes:
+        if self.count <= 0:
+            return b""
+
+        self.count -= 1
+        return self.frame
+
+
+def noise() -> bytes:
+    rng = np.random.default_rng(1)
+    return rng.integers(-20000, 20000, FRAME_SIZE // 2, dtype=np.int16).tobytes()
+
+def frames_per_second(transformer, frames:int) -> float:
+    started = time.perf_counter()
+    while transformer.read():
+        pass
+
+    return frames / (time.perf_counter() - started)
+
+def batched_per_second(gain:GainTransformer, frame:bytes, frames:int) -> float:
+    data = frame * BATCH
+    started = time.perf_counter()
+    for _ in range(frames // BATCH):
+        gain.apply(data)
+
+    return frames // BATCH * BATCH / (time.perf_counter() - started)
+
+def ramping(frames:int) -> GainTransformer:
+    """Returns a transformer that is always part way through a ramp"""
+
+    class Ramping(GainTransformer):
+        def read(self):
+            self.volume = 0.2 if self.volume > 0.5 else 0.8
+            return super().read()
+
+    return Ramping(PCMSource(noise(), frames), 0.5)
+
+def largest_step(transformer, change) -> int:
+    """Returns the largest difference between two neighbouring samples
+    of a steady signal, when the volume changes half way through"""
+
+    samples = []
+    for i in range(20):
+        if i == 10:
+            change(transformer)
+        samples.append(np.frombuffer(transformer.read(), dtype=np.int16))
+
+    left = np.concatenate(samples).reshape(-1, 2)[:, 0].astype(np.int32)
+    return int(np.abs(np.diff(left)).max())
+
+
+def main(frames:int=50_000) -> None:
+    frame = noise()
+
+    results = {
+        "PCMVolumeTransformer": frames_per_second(discord.PCMVolumeTransformer(PCMSource(frame, frames), 0.5), frames),
+        "GainTransformer": frames_per_second(GainTransformer(PCMSource(frame, frames), 0.5), frames),
+        "GainTransformer ramping": frames_per_second(ramping(frames), frames),
+        f"GainTransformer x{BATCH}": batched_per_second(GainTransformer(PCMSource(frame, 0), 0.5), frame, frames),
+    }
+
+    print(f"{frames} frames of 20ms")
+    for name, speed in results.items():
+        print(f"  {name:26}{speed:12,.0f} frames/s")
+
+    steady = np.full(FRAME_SIZE // 2, 16000, dtype=np.int16).tobytes()
+
+    def change(transformer):
+        transformer.volume = 0.2
+
+    print("largest step between samples when going from 1.0 to 0.2")
+    print(f"  {'PCMVolumeTransformer':26}{largest_step(discord.PCMVolumeTransformer(PCMSource(steady, 20)), change):12}")
+    print(f"  {'GainTransformer':26}{largest_step(GainTransformer(PCMSource(steady, 20), 1.0), change):12}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,151 @@
+"""What idle guilds cost the event loop, a task per guild waiting on
+its queue inside a timeout against one timer wheel entry per guild.
+
+Then real VoiceStates are joined to a fake voice channel with nothing
+queued, and left to time out and disconnect.
+
+    python scripts/bench_idle.py [guilds]
+"""
+
+import gc
+import sys
+import time
+import types
+import asyncio
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from async_timeout import timeout
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import ext.music as music  # noqa: E402
+from audio import TimerWheel, QueueJournal  # noqa: E402
+
+
+# Seconds the real guilds wait before leaving
+IDLE_SECONDS = 1.0
+
+
+async def old_idle(queue:asyncio.Queue) -> None:
+    """How the player task used to wait for the next song"""
+
+    try:
+        async with timeout(180):
+            await queue.get()
+    except asyncio.TimeoutError:
+        pass
+
+async def loop_iteration() -> float:
+    """Returns the microseconds one pass of the event loop takes"""
+
+    started = time.perf_counter()
+    for _ in range(1000):
+        await asyncio.sleep(0)
+
+    return (time.perf_counter() - started) / 1000 * 1e6
+
+async def idle_cost(guilds:int, start) -> dict:
+    """Measure what start leaves behind for a number of guilds, start
+    returns what has to be kept alive and a way to undo it"""
+
+    loop = asyncio.get_running_loop()
+    gc.collect()
+
+    tracemalloc.start()
+    kept, undo = start(guilds)
+    await asyncio.sleep(0)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    result = {
+        "bytes per guild": memory // guilds,
+        "tasks": len(asyncio.all_tasks()) - 1,
+        "loop timer handles": len(loop._scheduled),
+        "loop iteration": f"{await loop_iteration():.1f}us",
+    }
+
+    await undo(kept)
+    return result
+
+def start_tasks(guilds:int):
+    loop = asyncio.get_running_loop()
+    tasks = [loop.create_task(old_idle(asyncio.Queue())) for _ in range(guilds)]
+
+    async def undo(tasks):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return tasks, undo
+
+def start_timers(guilds:int):
+    wheel = TimerWheel()
+    timers = [wheel.schedule(180, lambda: None) for _ in range(guilds)]
+
+    async def undo(timers):
+        wheel.close()
+
+    return timers, undo
+
+
+class FakeVoice:
+    disconnected = 0
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def disconnect(self) -> None:
+        FakeVoice.disconnected += 1
+
+async def idle_guilds(guilds:int, journal:QueueJournal) -> None:
+    """Join real voice states to a channel and wait for them to leave"""
+
+    loop = asyncio.get_running_loop()
+    bot = types.SimpleNamespace(loop=loop)
+    music.VoiceState.journal = journal
+    music.VoiceState.timers = TimerWheel()
+    music.MUSIC_IDLE_DISCONNECT_SECONDS = IDLE_SECONDS
+
+    states = []
+    for guild_id in range(guilds):
+        guild = types.SimpleNamespace(id=guild_id, me=None, get_channel=lambda i: None, get_member=lambda i: None)
+        states.append(music.VoiceState(bot, guild))
+
+    await asyncio.gather(*(state.rehydrated for state in states))
+
+    joined = time.perf_counter()
+    for state in states:
+        state.voice = FakeVoice()
+
+    await asyncio.sleep(0)
+    print(f"{guilds} real guilds joined with nothing queued")
+    print(f"  tasks {len(asyncio.all_tasks()) - 1}, idle timers {len(music.VoiceState.timers)}, loop timer handles {len(loop._scheduled)}")
+
+    while FakeVoice.disconnected < guilds and time.perf_counter() - joined < IDLE_SECONDS * 5:
+        await asyncio.sleep(0.01)
+
+    print(f"  {FakeVoice.disconnected} left after {time.perf_counter() - joined:.2f}s, the idle deadline was {IDLE_SECONDS:.2f}s")
+    print(f"  {music.VoiceState.timers.stats()}")
+    music.VoiceState.timers.close()
+
+
+async def main(guilds:int=10_000) -> None:
+    results = {
+        "task and timeout": await idle_cost(guilds, start_tasks),
+        "timer wheel": await idle_cost(guilds, start_timers),
+    }
+
+    print(f"{guilds} idle guilds, empty loop iteration {await loop_iteration():.1f}us")
+    for name, result in results.items():
+        print(f"  {name:18}" + ", ".join(f"{key} {value}" for key, value in result.items()))
+
+    with tempfile.TemporaryDirectory() as directory:
+        journal = QueueJournal(directory)
+        await idle_guilds(guilds, journal)
+        journal.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,180 @@
+"""CPU used per guild to play a track, Opus packets passed through the
+bot untouched against the old path of decoding to PCM in ffmpeg,
+applying the volume in the bot and encoding it again to send.
+
+Without a file, a synthetic stream is read through OpusSource and
+through YTDLSource with an encoder, which times the bot's own work per
+frame. Encoding needs libopus. Given a file and ffmpeg, the whole
+pipeline is run for each path, and ffmpeg's CPU time is counted too.
+
+    python scripts/bench_opus.py [--frames N] [--volume V] [--file track.webm] [--ffmpeg PATH]
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+from pathlib import Path
+
+import numpy as np
+import discord
+
+# Only unix can count the CPU time of ffmpeg once it has exited
+try:
+    import resource
+except ImportError:
+    resource = None
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from audio import OpusSource  # noqa: E402
+from ext.music import YTDLSource  # noqa: E402
+from constants import MUSIC_DEFAULT_VOLUME, FFMPEG_EXECUTABLE  # noqa: E402
+
+
+FRAME_SIZE = discord.opus.Encoder.FRAME_SIZE
+SAMPLES_PER_FRAME = discord.opus.Encoder.SAMPLES_PER_FRAME
+
+# One 20ms frame, the time budget of a guild's every read
+FRAME_MICROSECONDS = discord.opus.Encoder.FRAME_LENGTH * 1000
+
+
+class Frames(discord.AudioSource):
+    """Hands out the same frame a number of times"""
+
+    def __init__(self, frame:bytes, count:int, *, opus:bool):
+        self.frame = frame
+        self.count = count
+        self.opus = opus
+
+    def is_opus(self) -> bool:
+        return self.opus
+
+    def read(self) -> bytes:
+        if self.count <= 0:
+            return b""
+
+        self.count -= 1
+        return self.frame
+
+
+def load_opus() -> bool:
+    try:
+        discord.opus._load_default()
+    except Exception:
+        pass
+
+    return discord.opus.is_loaded()
+
+def play(source:discord.AudioSource, encoder:discord.opus.Encoder=None) -> int:
+    """Read a source to the end like the sender does, encoding PCM
+    frames. Returns how many frames were read."""
+
+    frames = 0
+    while data := source.read():
+        if encoder is not None and not source.is_opus():
+            encoder.encode(data, SAMPLES_PER_FRAME)
+        frames += 1
+
+    source.cleanup()
+    return frames
+
+def report(name:str, microseconds:float) -> None:
+    print(
+        f"  {name:34}{microseconds:9.1f}us per frame"
+        f"{microseconds / FRAME_MICROSECONDS * 100:8.2f}% of a core per guild"
+    )
+
+
+def synthetic(frames:int, volume:float) -> None:
+    """Time the bot's own work per frame on a made up stream"""
+
+    packet = b"\xfc" + os.urandom(160)
+    pcm = np.random.default_rng(1).integers(-20000, 20000, FRAME_SIZE // 2, dtype=np.int16).tobytes()
+
+    def timed(source, encoder=None) -> float:
+        started = time.thread_time()
+        read = play(source, encoder)
+        return (time.thread_time() - started) / read * 1e6
+
+    print(f"synthetic stream, {frames} frames, the bot's CPU only")
+    report("Opus passthrough", timed(OpusSource(None, Frames(packet, frames, opus=True), "synthetic")))
+
+    gain = timed(YTDLSource(None, Frames(pcm, frames, opus=False), volume=volume))
+    if not load_opus():
+        report(f"PCM + gain at {volume:.0%}", gain)
+        print("  libopus couldn't be loaded, the PCM path was timed without encoding")
+        return
+
+    report(f"PCM + gain at {volume:.0%} + encode", timed(
+        YTDLSource(None, Frames(pcm, frames, opus=False), volume=volume),
+        discord.opus.Encoder()
+    ))
+
+def children_cpu() -> float:
+    """Returns the CPU seconds used by exited child processes"""
+
+    if resource is None:
+        return 0.0
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def pipelines(path:str, executable:str, volume:float) -> None:
+    """Play a file through ffmpeg on each path, counting the CPU of
+    both the bot and ffmpeg"""
+
+    options = YTDLSource.FFMPEG_OPTIONS["options"]
+    encoder = discord.opus.Encoder() if load_opus() else None
+
+    paths = {
+        "Opus passthrough": lambda: discord.FFmpegOpusAudio(
+            path, codec="opus", executable=executable, options=options
+        ),
+        f"Opus with ffmpeg volume at {volume:.0%}": lambda: discord.FFmpegOpusAudio(
+            path, executable=executable, options=f"{options} -af volume={volume:.3f}"
+        ),
+        f"PCM + gain at {volume:.0%} + encode": lambda: YTDLSource(
+            None, discord.FFmpegPCMAudio(path, executable=executable, options=options), volume=volume
+        ),
+    }
+
+    print(f"{path} through {executable}, the bot's and ffmpeg's CPU")
+    for name, create in paths.items():
+        children = children_cpu()
+        started = time.process_time()
+
+        read = play(create(), encoder)
+
+        used = time.process_time() - started + children_cpu() - children
+        report(name, used / read * 1e6)
+
+    if resource is None:
+        print("  ffmpeg's CPU can't be counted on this platform, only the bot's was")
+    if encoder is None:
+        print("  libopus couldn't be loaded, the PCM path was timed without encoding")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=50_000)
+    parser.add_argument("--volume", type=float, default=MUSIC_DEFAULT_VOLUME)
+    parser.add_argument("--file", help="a recorded track to play through ffmpeg")
+    parser.add_argument("--ffmpeg", default=shutil.which("ffmpeg") or FFMPEG_EXECUTABLE)
+    args = parser.parse_args()
+
+    synthetic(args.frames, args.volume)
+
+    if args.file is None:
+        return
+
+    if shutil.which(args.ffmpeg) is None:
+        print(f"ffmpeg wasn't found at {args.ffmpeg}, skipping {args.file}")
+        return
+
+    pipelines(args.file, args.ffmpeg, args.volume)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Positional queue operations at 10k and 100k songs, the deque backed
+SongQueue the bot used to have against the IndexedSequence backed one.
+
+    python scripts/bench_queue.py [sizes...]
+"""
+
+import sys
+import time
+import random
+import asyncio
+import itertools
+import types
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from audio.track import TrackInfo  # noqa: E402
+from ext.music import Song, SongQueue  # noqa: E402
+
+
+class DequeQueue(asyncio.Queue):
+    """The SongQueue from before, over asyncio.Queue's own deque"""
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return list(itertools.islice(self._queue, item.start, item.stop, item.step))
+
+        return self._queue[item]
+
+    def __len__(self) -> int:
+        return self.qsize()
+
+    def index(self, song:Song) -> int:
+        return self._queue.index(song)
+
+    def move(self, source:int, destination:int) -> None:
+        song = self._queue[source]
+        del self._queue[source]
+        self._queue.insert(destination, song)
+
+    def shuffle(self) -> None:
+        random.shuffle(self._queue)
+
+    def remove(self, index:int) -> None:
+        del self._queue[index]
+
+
+REQUESTER = types.SimpleNamespace(id=1)
+CHANNEL = types.SimpleNamespace(id=2, guild=types.SimpleNamespace(id=3))
+
+PAGE = 10
+
+def songs(count:int) -> list[Song]:
+    return [
+        Song.restore(REQUESTER, CHANNEL, TrackInfo(f"Song {i}", f"https://youtu.be/{i:011d}", duration=200))
+        for i in range(count)
+    ]
+
+def timed(repeat:int, operation) -> float:
+    """Returns the average microseconds per call"""
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        operation()
+
+    return (time.perf_counter() - started) / repeat * 1e6
+
+def run(queue, items:list[Song]) -> dict:
+    for song in items:
+        queue.put_nowait(song)
+
+    size = len(items)
+    middle = size // 2
+    rng = random.Random(1)
+
+    def remove():
+        # Put back at the end so the queue keeps its size
+        song = queue[middle]
+        queue.remove(middle)
+        queue.put_nowait(song)
+
+    return {
+        "index": timed(200, lambda: queue.index(items[rng.randrange(size)])),
+        "getitem": timed(200, lambda: queue[rng.randrange(size)]),
+        "page": timed(200, lambda: queue[middle:middle + PAGE]),
+        "move": timed(200, lambda: queue.move(rng.randrange(size), rng.randrange(size))),
+        "remove": timed(200, remove),
+        "shuffle": timed(2, queue.shuffle),
+    }
+
+
+def main(*sizes:int) -> None:
+    for size in sizes or (10_000, 100_000):
+        items = songs(size)
+        before = run(DequeQueue(), items)
+        after = run(SongQueue(), items)
+
+        print(f"{size} songs, microseconds per operation")
+        print(f"  {'':10}{'deque':>12}{'indexed':>12}")
+        for name in before:
+            print(f"  {name:10}{before[name]:12.1f}{after[name]:12.1f}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,146 @@
+"""Memory held per queued song, the full youtube_dl info dict against
+the TrackInfo kept in its place.
+
+The info dicts are built to look like youtube_dl's output for a
+typical video: a couple of dozen formats with their signed urls and
+http headers, the thumbnails, captions and a description.
+
+    python scripts/bench_track_info.py [songs]
+"""
+
+import gc
+import sys
+import random
+import string
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from audio.track import TrackInfo  # noqa: E402
+
+
+def token(length:int) -> str:
+    return "".join(random.choices(string.ascii_letters + string.digits + "-_", k=length))
+
+def stream_url(video_id:str, itag:int) -> str:
+    return (
+        f"https://rr{random.randint(1, 9)}---sn-{token(8)}.googlevideo.com/videoplayback"
+        f"?expire=1700000000&ei={token(22)}&ip=203.0.113.7&id=o-{token(44)}&itag={itag}"
+        f"&source=youtube&requiressl=yes&mime=audio%2Fwebm&dur=212.061&lmt=1600000000000000"
+        f"&sig={token(70)}&lsparams=mh%2Cmm%2Cmn%2Cms%2Cmv&lsig={token(60)}&v={video_id}"
+    )
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/90.0 Safari/537.36",
+    "Accept-Charset": "ISO-8859-1,utf-8;q=0.7,*;q=0.7",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Encoding": "gzip, deflate",
+    "Accept-Language": "en-us,en;q=0.5",
+}
+
+def info_dict(index:int) -> dict:
+    """Returns an info dict shaped like youtube_dl's for one video"""
+
+    video_id = f"{index:011d}"
+    formats = []
+    for itag in (139, 140, 249, 250, 251, 160, 133, 134, 135, 136, 137, 278, 242, 243, 244, 247, 248, 18, 22):
+        formats.append({
+            "format_id": str(itag),
+            "url": stream_url(video_id, itag),
+            "player_url": None,
+            "ext": random.choice(("webm", "m4a", "mp4")),
+            "format_note": random.choice(("tiny", "144p", "360p", "720p")),
+            "acodec": "opus",
+            "vcodec": random.choice(("none", "vp9", "avc1.4d401e")),
+            "abr": random.uniform(40, 160),
+            "asr": 48000,
+            "filesize": random.randint(1_000_000, 50_000_000),
+            "fps": random.choice((None, 30)),
+            "height": random.choice((None, 360, 720)),
+            "width": random.choice((None, 640, 1280)),
+            "tbr": random.uniform(40, 2000),
+            "downloader_options": {"http_chunk_size": 10485760},
+            "protocol": "https",
+            "http_headers": dict(HEADERS),
+            "format": f"{itag} - audio only (tiny)",
+        })
+
+    thumbnails = [
+        {"url": f"https://i.ytimg.com/vi/{video_id}/{name}.jpg?sqp={token(40)}", "height": h, "width": w, "id": str(i), "resolution": f"{w}x{h}"}
+        for i, (name, w, h) in enumerate((("default", 120, 90), ("mqdefault", 320, 180), ("hqdefault", 480, 360), ("sddefault", 640, 480), ("maxresdefault", 1280, 720)))
+    ]
+
+    captions = {
+        language: [{"ext": ext, "url": f"https://www.youtube.com/api/timedtext?v={video_id}&lang={language}&fmt={ext}&sig={token(40)}"} for ext in ("srv1", "srv2", "srv3", "ttml", "vtt")]
+        for language in ("en", "de", "fr", "es", "ja", "pt", "ru", "ko")
+    }
+
+    best = formats[4]
+    return {
+        "id": video_id,
+        "title": f"Artist - Song Title {index} (Official Video)",
+        "formats": formats,
+        "thumbnails": thumbnails,
+        "thumbnail": thumbnails[-1]["url"],
+        "description": " ".join(token(random.randint(3, 10)) for _ in range(250)),
+        "upload_date": "20200101",
+        "uploader": "ArtistVEVO",
+        "uploader_id": "ArtistVEVO",
+        "uploader_url": "http://www.youtube.com/user/ArtistVEVO",
+        "channel_id": f"UC{token(22)}",
+        "channel_url": f"http://www.youtube.com/channel/UC{token(22)}",
+        "duration": 212,
+        "view_count": random.randint(1000, 10**9),
+        "average_rating": 4.9,
+        "age_limit": 0,
+        "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+        "categories": ["Music"],
+        "tags": [token(8) for _ in range(20)],
+        "is_live": None,
+        "automatic_captions": captions,
+        "subtitles": {},
+        "like_count": random.randint(1000, 10**7),
+        "track": f"Song Title {index}",
+        "artist": "Artist",
+        "extractor": "youtube",
+        "webpage_url_basename": "watch",
+        "extractor_key": "Youtube",
+        "display_id": video_id,
+        "requested_subtitles": None,
+        "format_id": best["format_id"],
+        "url": best["url"],
+        "ext": best["ext"],
+        "acodec": best["acodec"],
+        "abr": best["abr"],
+        "http_headers": dict(HEADERS),
+        "fulltitle": f"Artist - Song Title {index} (Official Video)",
+    }
+
+
+def measure(build) -> int:
+    """Returns the bytes still allocated by what build returns"""
+
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    del kept
+    return size
+
+
+def main(songs:int=500) -> None:
+    random.seed(1)
+    before = measure(lambda: [info_dict(i) for i in range(songs)])
+    after = measure(lambda: [TrackInfo.from_data(info_dict(i)) for i in range(songs)])
+
+    print(f"{songs} queued songs")
+    print(f"  info dict:  {before / songs / 1024:8.1f} KiB per song")
+    print(f"  TrackInfo:  {after / songs / 1024:8.1f} KiB per song")
+    print(f"  {before / after:.0f}x smaller")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
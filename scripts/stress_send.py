@@ -0,0 +1,147 @@
+"""Stress test of sending audio to hundreds of fake voice clients, with
+a discord.py AudioPlayer thread per guild or on the SendScheduler.
+
+Every client plays eight seconds of Opus frames and records when each
+frame was sent. Sending a packet spins for a moment like the real
+encrypt and socket write would. The spread of the gaps between frames
+around 20ms is the jitter a listener would hear. The fake send holds
+the GIL while it spins, so here shards mostly wait on each other.
+
+    python scripts/stress_send.py players 300
+    python scripts/stress_send.py shared 300 --shards 2
+    python scripts/stress_send.py shared 300 --buffered
+"""
+
+import sys
+import time
+import types
+import asyncio
+import argparse
+import threading
+import statistics
+from pathlib import Path
+
+import discord
+from discord.player import AudioPlayer
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from audio import SendScheduler, BufferedSource  # noqa: E402
+from constants import MUSIC_SEND_SHARDS  # noqa: E402
+
+
+# How long sending one packet takes
+SEND_COST = 4e-5
+
+
+class FakeWebSocket:
+    async def speak(self, state) -> None:
+        pass
+
+class FakeVoice:
+    """Has what AudioPlayer and ScheduledPlayer use of a VoiceClient"""
+
+    def __init__(self, guild_id:int, loop:asyncio.AbstractEventLoop):
+        self.guild = types.SimpleNamespace(id=guild_id)
+        self.client = types.SimpleNamespace(loop=loop)
+        self.ws = FakeWebSocket()
+        self.encoder = None
+        self.sent: list[float] = []
+
+        self._player = None
+        self._connected = threading.Event()
+        self._connected.set()
+
+    def is_connected(self) -> bool:
+        return True
+
+    def is_playing(self) -> bool:
+        return self._player is not None and self._player.is_playing()
+
+    def send_audio_packet(self, data:bytes, *, encode:bool=True) -> None:
+        started = time.perf_counter()
+        while time.perf_counter() - started < SEND_COST:
+            pass
+
+        self.sent.append(started)
+
+class OpusFrames(discord.AudioSource):
+    """Hands out a number of Opus silence frames"""
+
+    def __init__(self, count:int):
+        self.count = count
+
+    def is_opus(self) -> bool:
+        return True
+
+    def read(self) -> bytes:
+        if self.count <= 0:
+            return b""
+
+        self.count -= 1
+        return b"\xf8\xff\xfe"
+
+
+def jitter(voices:list[FakeVoice]) -> list[float]:
+    """Returns how far each gap between frames was from 20ms, sorted"""
+
+    deviations = []
+    for voice in voices:
+        gaps = [(b - a) * 1000 for a, b in zip(voice.sent, voice.sent[1:])]
+        deviations.extend(abs(gap - 20) for gap in gaps)
+
+    return sorted(deviations)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("mode", choices=("players", "shared"))
+    parser.add_argument("guilds", type=int)
+    parser.add_argument("--shards", type=int, default=MUSIC_SEND_SHARDS)
+    parser.add_argument("--seconds", type=float, default=8)
+    parser.add_argument("--buffered", action="store_true", help="read each source through a BufferedSource like the bot does")
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    frames = int(args.seconds * 50)
+    voices = [FakeVoice(i, loop) for i in range(args.guilds)]
+    done = threading.Semaphore(0)
+    scheduler = SendScheduler(args.shards)
+
+    def source() -> discord.AudioSource:
+        frames_source = OpusFrames(frames)
+        return BufferedSource(frames_source, prebuffer=0) if args.buffered else frames_source
+
+    for voice in voices:
+        if args.mode == "shared":
+            scheduler.play(voice, source(), after=lambda error: done.release())
+        else:
+            player = voice._player = AudioPlayer(source(), voice, after=lambda error: done.release())
+            player.start()
+
+    # A buffered source's reader waits while its buffer is full, so
+    # with tracks longer than the buffer every reader stays alive
+    threads = threading.active_count()
+    for _ in voices:
+        while not done.acquire(timeout=0.1):
+            threads = max(threads, threading.active_count())
+
+    deviations = jitter(voices)
+    print(
+        f"{args.mode} guilds={args.guilds} threads={threads} "
+        f"mean |gap - 20ms|={statistics.mean(deviations):.2f}ms "
+        f"p99={deviations[int(len(deviations) * 0.99)]:.2f}ms max={deviations[-1]:.1f}ms"
+    )
+
+    if args.mode == "shared":
+        print(scheduler.stats())
+        print("guild 0:", scheduler.guild_stats(0))
+        scheduler.shutdown()
+
+    loop.call_soon_threadsafe(loop.stop)
+
+
+if __name__ == "__main__":
+    main()
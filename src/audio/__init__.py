@@ -0,0 +1,24 @@
+"""Init the audio package"""
+
+from .cache import MetadataCache, canonical_query
+from .resolver import ResolverPool
+from .prefetch import Prefetcher
+from .factory import FFmpegFactory
+from .opus import OpusSource
+from .buffer import BufferedSource
+from .gain import GainTransformer
+from .track import TrackInfo, format_duration, parse_duration
+from .sequence import IndexedSequence
+from .disk_cache import AudioCache
+from .pinned import PinnedRegistry
+from .broadcast import BroadcastManager
+from .scheduler import SendScheduler
+from .mixer import Mixer
+from .resume import ResumePoint, ResumeStore
+from .journal import QueueJournal
+from .states import GuildStates
+from .timers import TimerWheel, Timer
+from .singleflight import SingleFlight
+from .backends import Backend, ResolverRegistry
+from .spotify import SpotifyClient, SpotifyMatcher, MatchCache, spotify_link
+from .timings import StageTimings
@@ -0,0 +1,261 @@
+"""Resolving a query with more than one backend.
+
+Every query used to be resolved one way, and a slow extraction held
+up /play for as long as it took. Queries are now resolved through a
+registry of backends, each running on a resolver pool of its own with
+its own timeout. The first backend is tried first. If it hasn't
+answered by the time it usually would have, its p95 latency, the same
+query is also sent to the next backend with an idle worker and
+whichever answers first wins. Slow resolves are the rare ones, so
+hedging after the p95 only adds about 5% more work.
+
+A blocking extraction can't be interrupted, so the loser's worker stays
+busy until its extraction returns. The backend counts as unavailable
+for hedging until then, its pool knows when the thread is done.
+
+A backend that fails or times out hands over to the next one. Errors
+that mean the query itself can't be resolved are raised straight away
+instead, another backend wouldn't do any better.
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Callable
+
+from .resolver import ResolverPool
+from exceptions import ResolverTimeout
+from constants import (
+    MUSIC_HEDGE_MIN_DELAY,
+    MUSIC_HEDGE_DEFAULT_DELAY,
+    MUSIC_HEDGE_MIN_SAMPLES
+)
+
+
+log = logging.getLogger(__name__)
+
+
+class Backend:
+    """A way of resolving queries.
+
+    Args:
+        name (str): Shown in the stats
+        pool (ResolverPool): The workers the backend runs on, which
+            limit how many resolves it runs at once
+        func (Callable): Blocking function that resolves a query, run
+            on the pool with the arguments given to the registry after
+            the guild id
+        timeout (float): Seconds before a resolve is given up on
+        samples (int): How many recent latencies the p95 is taken from
+    """
+
+    __slots__ = (
+        "name",
+        "pool",
+        "func",
+        "timeout",
+        "_latencies",
+        "calls",
+        "errors",
+        "timeouts",
+        "wins"
+    )
+
+    def __init__(
+        self,
+        name:str,
+        pool:ResolverPool,
+        func:Callable,
+        *,
+        timeout:float,
+        samples:int=200
+    ):
+        self.name = name
+        self.pool = pool
+        self.func = func
+        self.timeout = timeout
+
+        self._latencies = deque(maxlen=samples)
+
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.wins = 0
+
+    @property
+    def available(self) -> bool:
+        """Returns True if a resolve can start without waiting"""
+
+        return self.pool.idle
+
+    def percentile(self, fraction:float) -> float | None:
+        """Returns a percentile of the recent latencies in seconds, or
+        None if there are too few of them to go by"""
+
+        if len(self._latencies) < MUSIC_HEDGE_MIN_SAMPLES:
+            return None
+
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+    async def __call__(self, guild_id:int, *args):
+        """Resolve on the backend's pool, the time spent waiting for a
+        worker counts towards the timeout
+
+        Raises:
+            ResolverTimeout: The resolve took longer than the timeout
+            ResolverBusy: The pool's queue is full
+        """
+
+        self.calls += 1
+        started = time.perf_counter()
+
+        try:
+            result = await asyncio.wait_for(
+                self.pool.submit(guild_id, self.func, *args), self.timeout
+            )
+        except asyncio.TimeoutError as error:
+            self.timeouts += 1
+            raise ResolverTimeout(
+                f"{self.name} took more than {self.timeout}s"
+            ) from error
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+
+        self._latencies.append(time.perf_counter() - started)
+        return result
+
+
+class ResolverRegistry:
+    """Backends tried in the order they were registered, with hedged
+    requests to the next backend when one is slow.
+
+    Args:
+        definitive (tuple): Exceptions that are raised straight away
+            instead of trying the next backend
+    """
+
+    __slots__ = ("definitive", "_backends", "hedges", "hedge_wins", "failovers")
+
+    def __init__(self, *, definitive:tuple[type[Exception], ...]=()):
+        self.definitive = definitive
+        self._backends: list[Backend] = []
+
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def register(self, backend:Backend) -> None:
+        """Add a backend, after the ones already registered"""
+
+        self._backends.append(backend)
+
+    def hedge_delay(self, backend:Backend) -> float:
+        """Seconds to wait on a backend before hedging, its p95"""
+
+        p95 = backend.percentile(0.95)
+        if p95 is None:
+            return MUSIC_HEDGE_DEFAULT_DELAY
+
+        return max(MUSIC_HEDGE_MIN_DELAY, p95)
+
+    async def resolve(self, *args):
+        """Resolve with the first backend, hedging with the next ones
+
+        Raises:
+            The first backend's error if every backend failed, or a
+            definitive error as soon as any backend raises one
+        """
+
+        untried = list(self._backends)
+        primary = untried.pop(0)
+        running: dict[asyncio.Task, Backend] = {}
+        hedge = None
+        errors = []
+
+        def start(backend:Backend) -> None:
+            task = asyncio.get_running_loop().create_task(backend(*args))
+            task.add_done_callback(_retrieve)
+            running[task] = backend
+
+        start(primary)
+
+        try:
+            done, _ = await asyncio.wait(running, timeout=self.hedge_delay(primary))
+
+            # Still waiting, hedge with the next backend that has room
+            if not done:
+                hedge = next((backend for backend in untried if backend.available), None)
+                if hedge is not None:
+                    log.debug("Hedging a slow %s resolve with %s", primary.name, hedge.name)
+                    untried.remove(hedge)
+                    start(hedge)
+                    self.hedges += 1
+
+            while running:
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    backend = running.pop(task)
+                    error = task.exception()
+
+                    if error is None:
+                        backend.wins += 1
+                        if backend is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+
+                    if isinstance(error, self.definitive):
+                        raise error
+
+                    log.debug("Resolving with %s failed: %s", backend.name, error)
+                    errors.append(error)
+
+                # Everything running has failed, move on to the next
+                if not running and untried:
+                    self.failovers += 1
+                    start(untried.pop(0))
+
+            raise errors[0]
+
+        finally:
+            for task in running:
+                task.cancel()
+
+    def shutdown(self) -> None:
+        """Stop the pools of every backend"""
+
+        for backend in self._backends:
+            backend.pool.shutdown()
+
+    def stats(self) -> dict:
+        """Returns the counters and latencies of every backend"""
+
+        stats = {
+            "hedges": self.hedges,
+            "hedge wins": self.hedge_wins,
+            "failovers": self.failovers,
+        }
+
+        for backend in self._backends:
+            p50, p95 = backend.percentile(0.5), backend.percentile(0.95)
+            stats[backend.name] = (
+                f"{backend.wins}/{backend.calls} won, "
+                f"{backend.errors} errors, {backend.timeouts} timeouts, "
+                f"p50 {f'{p50 * 1000:.0f}ms' if p50 is not None else 'n/a'}, "
+                f"p95 {f'{p95 * 1000:.0f}ms' if p95 is not None else 'n/a'}"
+            )
+
+        return stats
+
+
+def _retrieve(task:asyncio.Task) -> None:
+    """Mark a backend's error as seen, a losing backend's error is
+    otherwise never looked at"""
+
+    if not task.cancelled():
+        task.exception()
@@ -0,0 +1,295 @@
+"""Sharing one ffmpeg process between guilds playing the same track.
+
+When several guilds start the same track at about the same time, each
+would normally spawn its own ffmpeg and encode the same Opus frames.
+Instead, one ffmpeg process is opened per track and start offset and
+its frames are kept in a ring buffer that every guild reads from at
+its own cursor. Whichever guild is furthest ahead pulls the next frame
+from ffmpeg. A guild can join while the start of the track is still in
+the buffer, and the process is closed when the last guild leaves.
+"""
+
+import threading
+import logging
+from collections import Counter
+
+import discord
+
+from .opus import FRAME_LENGTH
+from constants import MUSIC_BROADCAST_BUFFER_SECONDS
+
+
+log = logging.getLogger(__name__)
+
+
+class Broadcast:
+    """A ring buffer of Opus frames read from one ffmpeg source.
+
+    Args:
+        key (tuple): The track id and start offset
+        original (discord.FFmpegOpusAudio): The shared ffmpeg source
+        capacity (int): How many frames the buffer holds
+    """
+
+    __slots__ = (
+        "key",
+        "original",
+        "capacity",
+        "guilds",
+        "served",
+        "skipped",
+        "_frames",
+        "_head",
+        "_ended",
+        "_lock"
+    )
+
+    def __init__(self, key:tuple, original:discord.FFmpegOpusAudio, capacity:int):
+        self.key = key
+        self.original = original
+        self.capacity = capacity
+
+        # The subscribers of each guild reading from the broadcast
+        self.guilds: Counter[int] = Counter()
+
+        # Frames handed out, compared to frames read to see the savings
+        self.served = 0
+
+        # Frames missed by subscribers that fell too far behind
+        self.skipped = 0
+
+        self._frames: list[bytes] = [None] * capacity
+        self._head = 0  # index of the next frame to read from ffmpeg
+        self._ended = False
+        self._lock = threading.Lock()
+
+    @property
+    def subscribers(self) -> int:
+        """How many subscribers are reading from the broadcast"""
+
+        return self.guilds.total()
+
+    @property
+    def oldest(self) -> int:
+        """The index of the oldest frame still in the buffer"""
+
+        return max(0, self._head - self.capacity)
+
+    @property
+    def decoded(self) -> int:
+        """How many frames have been read from ffmpeg"""
+
+        return self._head
+
+    @property
+    def joinable(self) -> bool:
+        """Returns True if a new subscriber can start from the first
+        frame"""
+
+        return self.oldest == 0 and not self._ended
+
+    def buffering(self, cursor:int) -> bool:
+        """Returns True if a subscriber at the cursor has caught up and
+        the shared source is refilling its buffer"""
+
+        return cursor >= self._head and getattr(self.original, "buffering", False)
+
+    def read(self, cursor:int) -> tuple[bytes, int]:
+        """Returns the frame at a cursor and the cursor of the frame
+        after it. A cursor that has fallen out of the buffer skips
+        ahead to the oldest frame still held."""
+
+        with self._lock:
+            if cursor < self.oldest:
+                self.skipped += self.oldest - cursor
+                cursor = self.oldest
+
+            if cursor == self._head:
+                if self._ended:
+                    return b"", cursor
+
+                data = self.original.read()
+                if not data:
+                    self._ended = True
+                    return b"", cursor
+
+                self._frames[self._head % self.capacity] = data
+                self._head += 1
+
+            self.served += 1
+            return self._frames[cursor % self.capacity], cursor + 1
+
+    def close(self) -> None:
+        """Close the shared ffmpeg source"""
+
+        with self._lock:
+            self._ended = True
+            self._frames = [None] * self.capacity
+
+        self.original.cleanup()
+
+
+class BroadcastSubscriber(discord.AudioSource):
+    """One guild's view of a broadcast, with its own cursor"""
+
+    def __init__(self, manager, broadcast:Broadcast, guild_id:int):
+        self._manager = manager
+        self._broadcast = broadcast
+        self._guild_id = guild_id
+        self._cursor = 0
+        self._closed = False
+
+    @property
+    def buffering(self) -> bool:
+        return self._broadcast.buffering(self._cursor)
+
+    def is_opus(self) -> bool:
+        return True
+
+    def read(self) -> bytes:
+        data, self._cursor = self._broadcast.read(self._cursor)
+        return data
+
+    def cleanup(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._manager.unsubscribe(self._broadcast, self._guild_id)
+
+
+class BroadcastManager:
+    """Hands out subscriptions to shared ffmpeg sources, keyed by
+    track id and start offset.
+
+    Args:
+        factory (FFmpegFactory): Creates the shared ffmpeg sources
+        buffer_seconds (float): How much audio each broadcast buffers,
+            which is also how late a guild can join one
+    """
+
+    __slots__ = (
+        "factory",
+        "capacity",
+        "_joinable",
+        "_live",
+        "_lock",
+        "created",
+        "joined",
+        "shared",
+        "skipped"
+    )
+
+    def __init__(self, factory, *, buffer_seconds:float=MUSIC_BROADCAST_BUFFER_SECONDS):
+        self.factory = factory
+        self.capacity = max(1, int(buffer_seconds / FRAME_LENGTH))
+
+        # Broadcasts that can still be joined from the start
+        self._joinable: dict[tuple, Broadcast] = {}
+
+        # Every broadcast with at least one subscriber
+        self._live: set[Broadcast] = set()
+
+        # Subscribers leave from the audio player threads
+        self._lock = threading.Lock()
+
+        self.created = 0
+        self.joined = 0
+
+        # Totals from broadcasts that have closed
+        self.shared = 0
+        self.skipped = 0
+
+    def subscribe(
+        self,
+        guild_id:int,
+        track_id:str,
+        location:str,
+        *,
+        start:float=0.0,
+        transcode:bool=False,
+        tee=None
+    ) -> BroadcastSubscriber:
+        """Subscribe to the broadcast of a track, starting one if there
+        isn't a joinable one already.
+
+        Args:
+            guild_id (int): The guild that is going to play it, which
+                the factory counts the shared source towards
+            track_id (str): Identifies the track, such as the video id
+            location (str): The stream url or file to open if a new
+                broadcast is needed
+            start (float): The position in seconds to start at
+            transcode (bool): Encode the audio, for non Opus streams
+            tee (Callable): Wraps the ffmpeg source of a new broadcast
+        """
+
+        key = (track_id, round(start, 2))
+
+        with self._lock:
+            broadcast = self._joinable.get(key)
+
+            if broadcast is not None and broadcast.joinable:
+                broadcast.guilds[guild_id] += 1
+                self.factory.listen(guild_id)
+                self.joined += 1
+                log.debug("Guild %s joined broadcast of %s", guild_id, key)
+                return BroadcastSubscriber(self, broadcast, guild_id)
+
+        original = self.factory.opus(
+            None, location, start=start, transcode=transcode, tee=tee
+        )
+        broadcast = Broadcast(key, original, self.capacity)
+        broadcast.guilds[guild_id] += 1
+
+        with self._lock:
+            self._joinable[key] = broadcast
+            self._live.add(broadcast)
+            self.factory.listen(guild_id)
+            self.created += 1
+
+        log.debug("Guild %s started broadcast of %s", guild_id, key)
+        return BroadcastSubscriber(self, broadcast, guild_id)
+
+    def unsubscribe(self, broadcast:Broadcast, guild_id:int) -> None:
+        """Drop a guild's subscriber, closing the broadcast if it was
+        the last"""
+
+        with self._lock:
+            broadcast.guilds[guild_id] -= 1
+            if broadcast.guilds[guild_id] <= 0:
+                del broadcast.guilds[guild_id]
+
+            self.factory.unlisten(guild_id)
+            if broadcast.guilds:
+                return
+
+            if self._joinable.get(broadcast.key) is broadcast:
+                del self._joinable[broadcast.key]
+
+            self._live.discard(broadcast)
+            self.shared += broadcast.served - broadcast.decoded
+            self.skipped += broadcast.skipped
+
+        log.debug("Closing broadcast of %s", broadcast.key)
+        broadcast.close()
+
+    def stats(self) -> dict:
+        """Returns the broadcast counters"""
+
+        with self._lock:
+            live = list(self._live)
+            listeners = sum(broadcast.subscribers for broadcast in live)
+            guilds = set().union(*(broadcast.guilds for broadcast in live))
+
+        return {
+            "live broadcasts": len(live),
+            "listeners": listeners,
+            "guilds listening": len(guilds),
+            "started": self.created,
+            "joined": self.joined,
+            "frames shared": self.shared + sum(
+                broadcast.served - broadcast.decoded for broadcast in live
+            ),
+            "frames skipped": self.skipped + sum(
+                broadcast.skipped for broadcast in live
+            ),
+        }
@@ -0,0 +1,150 @@
+"""Read-ahead buffering between ffmpeg and the voice sender.
+
+A short network stall makes ffmpeg's output stop for a moment, and the
+sender either stutters or mistakes the gap for the end of the track. A
+buffered source reads ffmpeg's frames on a background thread into a
+bounded buffer. When the buffer is full the thread stops reading, so
+ffmpeg's pipe fills up and it waits as well. Playback only starts once
+a few seconds are buffered. If the buffer ever runs dry before the end
+of the track, the source reports that it is buffering and the sender
+pauses until it has refilled, instead of ending the track.
+"""
+
+import logging
+import threading
+from collections import deque
+
+import discord
+
+from constants import (
+    MUSIC_BUFFER_SECONDS,
+    MUSIC_PREBUFFER_SECONDS,
+    MUSIC_BUFFER_REFILL_SECONDS
+)
+
+
+log = logging.getLogger(__name__)
+
+_FRAMES_PER_SECOND = 1000 // discord.opus.Encoder.FRAME_LENGTH
+
+OPUS_SILENCE = b"\xf8\xff\xfe"
+PCM_SILENCE = b"\x00" * discord.opus.Encoder.FRAME_SIZE
+
+
+class BufferedSource(discord.AudioSource):
+    """Reads another source ahead of time on a background thread.
+
+    Args:
+        original (discord.AudioSource): The source to read from
+        seconds (float): How much audio the buffer holds
+        prebuffer (float): How much audio to buffer before playing
+        refill (float): How much audio to buffer after an underrun
+        on_underrun (Callable): Called with no arguments whenever the
+            buffer runs dry
+    """
+
+    def __init__(
+        self,
+        original:discord.AudioSource,
+        *,
+        seconds:float=MUSIC_BUFFER_SECONDS,
+        prebuffer:float=MUSIC_PREBUFFER_SECONDS,
+        refill:float=MUSIC_BUFFER_REFILL_SECONDS,
+        on_underrun=None
+    ):
+        self.original = original
+        self.capacity = max(1, int(seconds * _FRAMES_PER_SECOND))
+        self.refill = min(self.capacity, int(refill * _FRAMES_PER_SECOND))
+        self.on_underrun = on_underrun
+        self.underruns = 0
+
+        self._silence = OPUS_SILENCE if original.is_opus() else PCM_SILENCE
+        self._frames = deque()
+        self._space = threading.Condition()
+        self._eof = False
+        self._closed = False
+
+        # Frames needed before playing, until then the source is buffering
+        self._fill_to = min(self.capacity, int(prebuffer * _FRAMES_PER_SECOND))
+
+        self._thread = threading.Thread(
+            target=self._run, name="audio-buffer", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        """Read frames until the end of the source or cleanup"""
+
+        try:
+            while True:
+                with self._space:
+                    while len(self._frames) >= self.capacity and not self._closed:
+                        self._space.wait()
+
+                if self._closed:
+                    return
+
+                data = self.original.read()
+                if not data:
+                    return
+
+                self._frames.append(data)
+
+        except Exception:
+            if not self._closed:
+                log.exception("Reading the audio source failed")
+
+        finally:
+            self._eof = True
+
+    @property
+    def buffering(self) -> bool:
+        """Returns True while the buffer is filling, either before the
+        start or after an underrun. Don't read until it is False."""
+
+        if self._fill_to and not self._eof and len(self._frames) < self._fill_to:
+            return True
+
+        self._fill_to = 0
+        return False
+
+    @property
+    def buffered(self) -> float:
+        """How many seconds of audio are buffered"""
+
+        return len(self._frames) / _FRAMES_PER_SECOND
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    def read(self) -> bytes:
+        try:
+            data = self._frames.popleft()
+        except IndexError:
+            if self._eof:
+                return b""
+
+            # Ran dry before the end, refill before playing on. Silence
+            # is returned in case the caller doesn't check buffering.
+            if not self._fill_to:
+                self.underruns += 1
+                self._fill_to = self.refill
+                log.debug("Audio buffer underrun, refilling")
+
+                if self.on_underrun is not None:
+                    self.on_underrun()
+
+            return self._silence
+
+        with self._space:
+            self._space.notify()
+
+        return data
+
+    def cleanup(self) -> None:
+        with self._space:
+            self._closed = True
+            self._space.notify()
+
+        self._frames.clear()
+        self.original.cleanup()
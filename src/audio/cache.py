@@ -0,0 +1,368 @@
+"""Two tier cache for resolved track metadata.
+
+Resolving a query through youtube_dl takes seconds, so the results are
+kept in a small in-memory LRU backed by an SQLite database on disk.
+The stable metadata (title, uploader, duration...) and the stream url
+expire separately, the stream url is only valid for a few hours. The
+database is only used from worker threads, a memory hit doesn't leave
+the event loop.
+"""
+
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+from constants import (
+    DATA,
+    MUSIC_CACHE_FILENAME,
+    MUSIC_CACHE_MEMORY_ENTRIES,
+    MUSIC_CACHE_METADATA_TTL,
+    MUSIC_CACHE_STREAM_TTL
+)
+
+
+log = logging.getLogger(__name__)
+
+# The fields of a youtube_dl info dict that are worth keeping
+CACHED_FIELDS = (
+    "id",
+    "title",
+    "uploader",
+    "uploader_url",
+    "upload_date",
+    "thumbnail",
+    "duration",
+    "webpage_url",
+    "view_count",
+    "like_count",
+    "acodec",
+)
+
+_VIDEO_ID = re.compile(r"^[A-Za-z0-9_-]{11}$")
+_YOUTUBE_HOSTS = {
+    "youtube.com",
+    "www.youtube.com",
+    "m.youtube.com",
+    "music.youtube.com",
+}
+
+# Don't hand out a stream url that is about to expire
+_STREAM_EXPIRY_MARGIN = 60
+
+
+def youtube_video_id(query:str) -> str | None:
+    """Returns the video id of a youtube url, or None if the query
+    is not a youtube video url.
+
+    Handles `watch?v=`, `youtu.be/`, `/shorts/`, `/embed/` and `/live/`
+    urls, any extra parameters such as `&t=` are ignored.
+    """
+
+    try:
+        url = urlparse(query.strip())
+    except ValueError:
+        return None
+
+    host = (url.hostname or "").lower()
+    parts = [part for part in url.path.split("/") if part]
+
+    video_id = None
+    if host in ("youtu.be", "www.youtu.be") and parts:
+        video_id = parts[0]
+    elif host in _YOUTUBE_HOSTS:
+        if url.path == "/watch":
+            video_id = parse_qs(url.query).get("v", [None])[0]
+        elif len(parts) >= 2 and parts[0] in ("shorts", "embed", "live", "v"):
+            video_id = parts[1]
+
+    if video_id and _VIDEO_ID.match(video_id):
+        return video_id
+
+    return None
+
+def youtube_playlist_id(query:str) -> str | None:
+    """Returns the playlist id of a youtube playlist url, or None if
+    the query is not one. Video urls that happen to carry a `list`
+    parameter are treated as videos."""
+
+    try:
+        url = urlparse(query.strip())
+    except ValueError:
+        return None
+
+    if (url.hostname or "").lower() not in _YOUTUBE_HOSTS:
+        return None
+
+    if url.path != "/playlist":
+        return None
+
+    return parse_qs(url.query).get("list", [None])[0]
+
+def canonical_query(query:str) -> str:
+    """Returns the cache key for a query.
+
+    Youtube urls are reduced to their video id so that every variant
+    of the same link shares one entry, other urls lose their fragment
+    and search terms are case and whitespace normalized.
+    """
+
+    video_id = youtube_video_id(query)
+    if video_id:
+        return f"youtube:{video_id}"
+
+    query = query.strip()
+    url = urlparse(query)
+    if url.scheme in ("http", "https") and url.netloc:
+        url = url._replace(
+            scheme=url.scheme.lower(),
+            netloc=url.netloc.lower(),
+            fragment=""
+        )
+        return f"url:{url.geturl()}"
+
+    return "search:" + " ".join(query.lower().split())
+
+def stream_url_expiry(stream_url:str|None, ttl:float, now:float) -> float:
+    """Returns the time at which a stream url should be considered
+    expired. Youtube stream urls carry their own `expire` parameter,
+    which is used when it comes before the ttl. A missing stream url
+    is always expired.
+    """
+
+    if not stream_url:
+        return 0.0
+
+    expires = now + ttl
+
+    try:
+        expire_param = parse_qs(urlparse(stream_url).query).get("expire")
+        if expire_param:
+            expires = min(expires, float(expire_param[0]))
+    except ValueError:
+        pass
+
+    return expires - _STREAM_EXPIRY_MARGIN
+
+
+class _Entry:
+    """A cached resolution result"""
+
+    __slots__ = ("data", "stored_at", "stream_url", "stream_expires")
+
+    def __init__(self, data:dict, stored_at:float, stream_url:str|None, stream_expires:float):
+        self.data = data
+        self.stored_at = stored_at
+        self.stream_url = stream_url
+        self.stream_expires = stream_expires
+
+
+class MetadataCache:
+    """In-memory LRU of resolved tracks over an SQLite table.
+
+    Lookups return a copy of the cached info dict. The `url` (stream
+    url) field is only present while it is still fresh, callers should
+    re-resolve the `webpage_url` when it is missing.
+    """
+
+    __slots__ = (
+        "path",
+        "capacity",
+        "metadata_ttl",
+        "stream_ttl",
+        "_memory",
+        "_db",
+        "_lock",
+        "hits",
+        "disk_hits",
+        "misses",
+        "stale_streams"
+    )
+
+    def __init__(
+        self,
+        path:str=f"{DATA}{MUSIC_CACHE_FILENAME}",
+        *,
+        capacity:int=MUSIC_CACHE_MEMORY_ENTRIES,
+        metadata_ttl:float=MUSIC_CACHE_METADATA_TTL,
+        stream_ttl:float=MUSIC_CACHE_STREAM_TTL
+    ):
+        self.path = path
+        self.capacity = capacity
+        self.metadata_ttl = metadata_ttl
+        self.stream_ttl = stream_ttl
+
+        self._memory: OrderedDict[str, _Entry] = OrderedDict()
+        self._db: sqlite3.Connection = None
+
+        # Worker threads take turns with the connection
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stale_streams = 0
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        """The database connection, opened on first use. Only use it
+        while holding the lock."""
+
+        if self._db is None:
+            if self.path != ":memory:":
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tracks ("
+                "key TEXT PRIMARY KEY, data TEXT NOT NULL, "
+                "stored_at REAL NOT NULL, stream_url TEXT, "
+                "stream_expires REAL NOT NULL)"
+            )
+            self._db.commit()
+
+        return self._db
+
+    async def get(self, key:str) -> dict | None:
+        """Returns the cached info dict for a key or None on a miss"""
+
+        entry = self._memory.get(key)
+        in_memory = entry is not None
+
+        if not in_memory:
+            entry = await asyncio.to_thread(self._load, key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        now = time.time()
+        if now - entry.stored_at > self.metadata_ttl:
+            log.debug("Cached metadata for %s has expired", key)
+            await self.invalidate(key)
+            self.misses += 1
+            return None
+
+        if in_memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+        else:
+            self._remember(key, entry)
+            self.disk_hits += 1
+
+        data = dict(entry.data)
+        if entry.stream_url and now < entry.stream_expires:
+            data["url"] = entry.stream_url
+        else:
+            self.stale_streams += 1
+
+        return data
+
+    async def put(self, key:str, data:dict) -> None:
+        """Cache a youtube_dl info dict under a key.
+
+        The entry is also stored under the canonical key of the video
+        itself so that searches and urls for the same video share it.
+        """
+
+        now = time.time()
+        stream_url = data.get("url")
+        entry = _Entry(
+            data={field: data.get(field) for field in CACHED_FIELDS},
+            stored_at=now,
+            stream_url=stream_url,
+            stream_expires=stream_url_expiry(stream_url, self.stream_ttl, now)
+        )
+
+        keys = {key}
+        if data.get("webpage_url"):
+            keys.add(canonical_query(data["webpage_url"]))
+
+        for _key in keys:
+            self._remember(_key, entry)
+
+        await asyncio.to_thread(self._store, [
+            (
+                _key,
+                json.dumps(entry.data),
+                entry.stored_at,
+                entry.stream_url,
+                entry.stream_expires
+            )
+            for _key in keys
+        ])
+
+    async def invalidate(self, key:str) -> None:
+        """Remove a key from both tiers of the cache"""
+
+        self._memory.pop(key, None)
+        await asyncio.to_thread(self._delete, key)
+
+    def stats(self) -> dict:
+        """Returns the hit/miss counters of the cache"""
+
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "memory hits": self.hits,
+            "disk hits": self.disk_hits,
+            "misses": self.misses,
+            "stale stream urls": self.stale_streams,
+            "hit rate": f"{(self.hits + self.disk_hits) / lookups:.1%}"
+                if lookups else "n/a",
+            "memory entries": len(self._memory),
+        }
+
+    def close(self) -> None:
+        """Close the database connection"""
+
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _remember(self, key:str, entry:_Entry) -> None:
+        """Add an entry to the memory tier, evicting the oldest"""
+
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    def _store(self, rows:list[tuple]) -> None:
+        """Write entries to the disk tier, this blocks"""
+
+        with self._lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self.db.commit()
+
+    def _delete(self, key:str) -> None:
+        """Remove an entry from the disk tier, this blocks"""
+
+        with self._lock:
+            self.db.execute("DELETE FROM tracks WHERE key = ?", (key,))
+            self.db.commit()
+
+    def _load(self, key:str) -> _Entry | None:
+        """Load an entry from the disk tier, this blocks"""
+
+        with self._lock:
+            row = self.db.execute(
+                "SELECT data, stored_at, stream_url, stream_expires "
+                "FROM tracks WHERE key = ?",
+                (key,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        data, stored_at, stream_url, stream_expires = row
+        return _Entry(json.loads(data), stored_at, stream_url, stream_expires)
@@ -0,0 +1,568 @@
+"""Local cache of played tracks, stored as Opus in an Ogg container.
+
+While a track plays from the start, the frames read from its ffmpeg
+process are also written to disk, so that the next time anyone plays
+it, it starts from a local file instead of youtube. PCM frames are
+encoded to Opus first. Tracks that aren't being played, such as the
+pinned tracks, are saved by a background ffmpeg job instead. Files are
+written to a temporary name and renamed into place once complete, and
+their size and SHA-256 are checked before they are used. The cache is
+kept within a byte budget by evicting the least recently or least
+frequently used files.
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+
+import discord
+
+from .ogg import OggOpusWriter, SAMPLE_RATE
+from constants import (
+    DATA,
+    FFMPEG_EXECUTABLE,
+    FFMPEG_RECONNECT_OPTIONS,
+    MUSIC_AUDIO_CACHE_DIRNAME,
+    MUSIC_AUDIO_CACHE_BYTES,
+    MUSIC_AUDIO_CACHE_POLICY,
+    MUSIC_AUDIO_CACHE_JOBS
+)
+
+
+log = logging.getLogger(__name__)
+
+_OGG_MAGIC = b"OggS"
+
+
+def _sha256(path:Path) -> str:
+    """Returns the SHA-256 of a file, this blocks"""
+
+    digest = hashlib.sha256()
+    with path.open("rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class AudioCache:
+    """Size bounded cache of Ogg/Opus files keyed by video id.
+
+    The index is kept in memory as well, so checking whether a track
+    is cached doesn't touch the disk. The database and the files are
+    only used from worker threads, taking turns through a lock.
+
+    Args:
+        directory (str): Where the files are stored
+        max_bytes (int): The byte budget of the cache
+        policy (str): Either "lru" or "lfu"
+        jobs (int): How many tracks can be saved at once
+        executable (str): The ffmpeg executable to run
+    """
+
+    __slots__ = (
+        "directory",
+        "max_bytes",
+        "policy",
+        "executable",
+        "_db",
+        "_sizes",
+        "_lock",
+        "_jobs",
+        "_storing",
+        "_verified",
+        "hits",
+        "misses",
+        "stored",
+        "corrupt",
+        "evicted"
+    )
+
+    def __init__(
+        self,
+        directory:str=f"{DATA}{MUSIC_AUDIO_CACHE_DIRNAME}",
+        *,
+        max_bytes:int=MUSIC_AUDIO_CACHE_BYTES,
+        policy:str=MUSIC_AUDIO_CACHE_POLICY,
+        jobs:int=MUSIC_AUDIO_CACHE_JOBS,
+        executable:str=FFMPEG_EXECUTABLE
+    ):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"Unknown eviction policy: {policy}")
+
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.executable = executable
+
+        self._db: sqlite3.Connection = None
+        self._lock = threading.Lock()
+        self._jobs = asyncio.Semaphore(jobs)
+        self._storing: set[str] = set()
+
+        # The size of every indexed file, filled in when the database
+        # is opened
+        self._sizes: dict[str, int] = {}
+
+        # Files whose hash has been checked since startup
+        self._verified: set[str] = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.corrupt = 0
+        self.evicted = 0
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        """The index database, opened on first use. Index rows whose
+        files have gone and files that were never indexed, such as
+        unfinished writes, are cleaned up when it is opened. Only use
+        it while holding the lock."""
+
+        if self._db is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+            self._db = sqlite3.connect(
+                self.directory / "index.sqlite3", check_same_thread=False
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "video_id TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                "sha256 TEXT NOT NULL, last_used REAL NOT NULL, "
+                "uses INTEGER NOT NULL)"
+            )
+            self._db.commit()
+            self._sizes = dict(self._db.execute("SELECT video_id, size FROM files"))
+            self._reconcile()
+
+        return self._db
+
+    async def open(self) -> None:
+        """Open the index database on a worker thread, the cache looks
+        empty until it is"""
+
+        if self._db is None:
+            await asyncio.to_thread(self._open)
+
+    def _open(self) -> None:
+        with self._lock:
+            self.db
+
+    def _file(self, video_id:str) -> Path:
+        return self.directory / f"{video_id}.ogg"
+
+    def _partial(self, video_id:str) -> Path:
+        return self.directory / f"{video_id}.ogg.partial"
+
+    def _reconcile(self) -> None:
+        """Make the index and the directory agree with each other"""
+
+        for path in self.directory.glob("*.ogg*"):
+            # Still being written
+            if path.name.split(".", 1)[0] in self._storing:
+                continue
+
+            if path.suffix != ".ogg" or path.stem not in self._sizes:
+                log.debug("Removing unindexed cache file %s", path.name)
+                path.unlink(missing_ok=True)
+
+        for video_id in list(self._sizes):
+            if not self._file(video_id).exists():
+                self._remove(video_id)
+
+    @property
+    def size(self) -> int:
+        """The total size of the cached files in bytes"""
+
+        return sum(self._sizes.values())
+
+    async def path(self, video_id:str) -> str | None:
+        """Returns the path of a cached track, or None if it is not
+        cached or its file fails the quick integrity check."""
+
+        if not video_id:
+            return None
+
+        await self.open()
+
+        path = None
+        if video_id in self:
+            path = await asyncio.to_thread(self._check, video_id)
+
+        if path is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return path
+
+    def _check(self, video_id:str) -> str | None:
+        """Check a cached file's header and size and mark it as used,
+        this blocks"""
+
+        path = self._file(video_id)
+        size = self._sizes.get(video_id)
+
+        try:
+            with path.open("rb") as file:
+                intact = file.read(4) == _OGG_MAGIC
+            intact = intact and path.stat().st_size == size
+        except OSError:
+            intact = False
+
+        with self._lock:
+            if not intact:
+                log.warning("Cached audio for %s is corrupt, removing it", video_id)
+                self.corrupt += 1
+                self._remove(video_id)
+                return None
+
+            self.db.execute(
+                "UPDATE files SET last_used = ?, uses = uses + 1 WHERE video_id = ?",
+                (time.time(), video_id)
+            )
+            self.db.commit()
+
+        return str(path)
+
+    def __contains__(self, video_id:str) -> bool:
+        return bool(video_id) and video_id in self._sizes
+
+    async def verify(self, video_id:str) -> bool:
+        """Check a cached file's hash, once per run, removing it if it
+        doesn't match.
+
+        Returns:
+            bool: True if the file is cached and intact
+        """
+
+        await self.open()
+
+        if video_id in self._verified or video_id not in self:
+            return video_id in self
+
+        return await asyncio.to_thread(self._verify, video_id)
+
+    def _verify(self, video_id:str) -> bool:
+        """Check a cached file's hash, this blocks"""
+
+        with self._lock:
+            row = self.db.execute(
+                "SELECT sha256 FROM files WHERE video_id = ?", (video_id,)
+            ).fetchone()
+
+        if row is None:
+            return False
+
+        try:
+            digest = _sha256(self._file(video_id))
+        except OSError:
+            digest = None
+
+        if digest != row[0]:
+            log.warning("Cached audio for %s failed its hash check", video_id)
+
+            with self._lock:
+                self.corrupt += 1
+                self._remove(video_id)
+
+            return False
+
+        self._verified.add(video_id)
+        return True
+
+    async def store(self, video_id:str, stream_url:str, codec:str=None) -> bool:
+        """Save a track to the cache. Opus streams are copied as they
+        are, anything else is transcoded.
+
+        Args:
+            video_id (str): The id of the video
+            stream_url (str): The audio stream url
+            codec (str): The codec of the stream, if known
+
+        Returns:
+            bool: True if the track was saved
+        """
+
+        await self.open()
+
+        if not video_id or video_id in self._storing or video_id in self:
+            return False
+
+        self._storing.add(video_id)
+        partial = self._partial(video_id)
+
+        encode = ("-c:a", "copy") if codec == "opus" else ("-c:a", "libopus", "-b:a", "128k")
+
+        try:
+            async with self._jobs:
+                log.debug("Saving %s to the audio cache", video_id)
+
+                process = await asyncio.create_subprocess_exec(
+                    self.executable, "-y", "-loglevel", "error",
+                    *FFMPEG_RECONNECT_OPTIONS.split(),
+                    "-i", stream_url,
+                    "-vn", "-map_metadata", "-1", *encode,
+                    "-f", "ogg", str(partial),
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                _, stderr = await process.communicate()
+
+                if process.returncode != 0:
+                    log.warning(
+                        "ffmpeg failed to save %s: %s",
+                        video_id, stderr.decode(errors="replace").strip()
+                    )
+                    return False
+
+                await asyncio.to_thread(self._add, video_id, partial)
+                return True
+
+        except OSError:
+            log.exception("Failed to save %s to the audio cache", video_id)
+            return False
+
+        finally:
+            partial.unlink(missing_ok=True)
+            self._storing.discard(video_id)
+
+    def tee(self, video_id:str, duration:float, original:discord.AudioSource) -> discord.AudioSource:
+        """Save a track to the cache from the frames of its source as
+        they are read. The source must start at the beginning of the
+        track and be unaffected by the volume.
+
+        Args:
+            video_id (str): The id of the video
+            duration (float): The track's length in seconds, a source
+                that ends well short of it isn't saved
+            original (discord.AudioSource): The ffmpeg source
+
+        Returns:
+            discord.AudioSource: The source to read instead, or the
+                original if the track is cached or already being saved
+        """
+
+        if not video_id or video_id in self._storing or video_id in self:
+            return original
+
+        self._storing.add(video_id)
+        return CacheTee(self, video_id, duration, original, asyncio.get_running_loop())
+
+    async def _save(self, video_id:str, partial:Path) -> None:
+        """Add a file written by a tee to the cache"""
+
+        try:
+            await asyncio.to_thread(self._add, video_id, partial)
+        except OSError:
+            log.exception("Failed to save %s to the audio cache", video_id)
+        finally:
+            partial.unlink(missing_ok=True)
+            self._storing.discard(video_id)
+
+    def _add(self, video_id:str, partial:Path) -> None:
+        """Hash a finished file, move it into place and index it, this
+        blocks"""
+
+        size = partial.stat().st_size
+        digest = _sha256(partial)
+
+        # The rename is atomic, a reader sees all or nothing
+        os.replace(partial, self._file(video_id))
+
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, 0)",
+                (video_id, size, digest, time.time())
+            )
+            self.db.commit()
+            self._sizes[video_id] = size
+            self._verified.add(video_id)
+            self.stored += 1
+
+            self._evict()
+
+    def _evict(self) -> None:
+        """Remove files until the cache is within its byte budget, with
+        the lock held"""
+
+        order = "last_used" if self.policy == "lru" else "uses, last_used"
+        size = self.size
+
+        for video_id, file_size in self.db.execute(
+            f"SELECT video_id, size FROM files ORDER BY {order}"
+        ).fetchall():
+            if size <= self.max_bytes:
+                return
+
+            log.debug("Evicting %s from the audio cache", video_id)
+            self._remove(video_id)
+            size -= file_size
+            self.evicted += 1
+
+    def _remove(self, video_id:str) -> None:
+        """Remove a file and its index row, with the lock held"""
+
+        self._file(video_id).unlink(missing_ok=True)
+        self._sizes.pop(video_id, None)
+        self._verified.discard(video_id)
+        self.db.execute("DELETE FROM files WHERE video_id = ?", (video_id,))
+        self.db.commit()
+
+    def stats(self) -> dict:
+        """Returns the cache counters"""
+
+        return {
+            "files": len(self._sizes),
+            "size": f"{self.size / (1 << 20):.1f} / {self.max_bytes / (1 << 20):.0f} MiB",
+            "hits": self.hits,
+            "misses": self.misses,
+            "saved": self.stored,
+            "corrupt": self.corrupt,
+            "evicted": self.evicted,
+        }
+
+    def close(self) -> None:
+        """Close the index database"""
+
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class CacheTee(discord.AudioSource):
+    """Passes on the frames of an ffmpeg source, writing them to the
+    audio cache as well. Reads happen on the buffer thread, the file is
+    handed back to the event loop once the source has ended.
+
+    Args:
+        cache (AudioCache): The cache to save the track to
+        video_id (str): The id of the video
+        duration (float): The track's length in seconds
+        original (discord.AudioSource): The ffmpeg source
+        loop (asyncio.AbstractEventLoop): The loop the cache runs on
+    """
+
+    # Tracks are listed in whole seconds, a shorter file was cut off
+    TOLERANCE = 1.5
+
+    def __init__(
+        self,
+        cache:AudioCache,
+        video_id:str,
+        duration:float,
+        original:discord.AudioSource,
+        loop:asyncio.AbstractEventLoop
+    ):
+        self.cache = cache
+        self.video_id = video_id
+        self.duration = duration
+        self.original = original
+        self.loop = loop
+
+        self._partial = cache._partial(video_id)
+        self._file = None
+        self._writer: OggOpusWriter = None
+        self._encoder: discord.opus.Encoder = None
+        self._done = False
+        self._lock = threading.Lock()
+
+    @property
+    def buffering(self) -> bool:
+        return getattr(self.original, "buffering", False)
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    def read(self) -> bytes:
+        data = self.original.read()
+
+        with self._lock:
+            if self._done:
+                return data
+
+            try:
+                if data:
+                    self._write(data)
+                else:
+                    self._finish()
+            except (OSError, discord.opus.OpusError, discord.opus.OpusNotLoaded) as error:
+                log.warning("Couldn't save %s to the audio cache: %s", self.video_id, error)
+                self._abort()
+
+        return data
+
+    def _write(self, data:bytes) -> None:
+        if self._writer is None:
+            if not self.original.is_opus():
+                self._encoder = discord.opus.Encoder()
+                self._encoder.set_fec(False)
+                self._encoder.set_expected_packet_loss_percent(0)
+
+            self._file = self._partial.open("wb")
+            self._writer = OggOpusWriter(self._file)
+
+        if self._encoder is not None:
+            data = self._encoder.encode(data, self._encoder.SAMPLES_PER_FRAME)
+
+        self._writer.write(data)
+
+    def _finish(self) -> None:
+        """Close the file and have the cache add it, unless the stream
+        was cut off"""
+
+        if self._writer is None:
+            self._abort()
+            return
+
+        self._writer.close()
+        self._file.close()
+        self._done = True
+
+        seconds = self._writer.samples / SAMPLE_RATE
+        if seconds < self.duration - self.TOLERANCE:
+            log.warning(
+                "Not saving %s, it ended at %.1fs of %ss",
+                self.video_id, seconds, self.duration
+            )
+            self._abort()
+            return
+
+        try:
+            self.loop.call_soon_threadsafe(
+                self.loop.create_task,
+                self.cache._save(self.video_id, self._partial)
+            )
+        except RuntimeError:
+            # The loop has closed
+            self._abort()
+
+    def _abort(self) -> None:
+        """Drop the unfinished file"""
+
+        self._done = True
+
+        if self._file is not None:
+            self._file.close()
+        self._partial.unlink(missing_ok=True)
+
+        try:
+            self.loop.call_soon_threadsafe(self.cache._storing.discard, self.video_id)
+        except RuntimeError:
+            self.cache._storing.discard(self.video_id)
+
+    def cleanup(self) -> None:
+        # Cleaned up before the end, such as by a skip or a seek
+        with self._lock:
+            if not self._done:
+                self._abort()
+
+        self.original.cleanup()
@@ -0,0 +1,250 @@
+"""Creation and bookkeeping of ffmpeg audio sources.
+
+Creating an ffmpeg audio source spawns an ffmpeg subprocess straight
+away, so sources are only created right before they are played. The
+factory keeps track of every source it has handed out until it is
+cleaned up, which makes leaked processes easy to spot. Processes shared
+between guilds belong to no guild, each guild reading from one counts
+it as one of its own. Every source is
+read ahead through a BufferedSource, and ffmpeg is told to reconnect
+when a stream url drops.
+"""
+
+import logging
+
+import discord
+
+from .buffer import BufferedSource
+from constants import FFMPEG_EXECUTABLE, FFMPEG_RECONNECT_OPTIONS
+
+
+log = logging.getLogger(__name__)
+
+
+class _Tracked:
+    """Mixin for ffmpeg sources that tell their factory when they are
+    cleaned up"""
+
+    def __init__(self, factory, guild_id:int, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._factory = factory
+        self._guild_id = guild_id
+
+    def cleanup(self) -> None:
+        super().cleanup()
+        self._factory.release(self._guild_id, self)
+
+
+class TrackedFFmpegPCMAudio(_Tracked, discord.FFmpegPCMAudio):
+    """An ffmpeg PCM source tracked by a factory"""
+
+
+class TrackedFFmpegOpusAudio(_Tracked, discord.FFmpegOpusAudio):
+    """An ffmpeg Opus source tracked by a factory"""
+
+
+class FFmpegFactory:
+    """Creates ffmpeg audio sources and tracks the live ones per guild
+
+    Args:
+        options (dict): Keyword arguments passed to every ffmpeg source
+        executable (str): The ffmpeg executable to run
+    """
+
+    __slots__ = (
+        "options",
+        "executable",
+        "_live",
+        "_shared",
+        "_listening",
+        "created",
+        "passthrough",
+        "peak",
+        "underruns"
+    )
+
+    def __init__(self, options:dict, *, executable:str=FFMPEG_EXECUTABLE):
+        self.options = options
+        self.executable = executable
+
+        self._live: dict[int, set] = {}
+
+        # Processes shared between guilds, and how many of them each
+        # guild is reading from
+        self._shared = set()
+        self._listening: dict[int, int] = {}
+
+        self.created = 0
+        self.passthrough = 0
+
+        # The most processes a single guild has had at once
+        self.peak = 0
+
+        self.underruns = 0
+
+    def _before_options(self, location:str, start:float=0.0) -> str | None:
+        """Returns the input options for a stream url or file. A start
+        position seeks the input, which ffmpeg does by jumping close to
+        it in the container. When the packets are copied, playback
+        starts from the packet boundary before the position, when they
+        are decoded ffmpeg trims them to the exact sample."""
+
+        before_options = self.options.get("before_options", "")
+
+        # Reconnect options only exist for network streams
+        if location.startswith(("http://", "https://")):
+            before_options += f" {FFMPEG_RECONNECT_OPTIONS}"
+
+        if start:
+            before_options += f" -ss {start:.2f}"
+
+        return before_options.strip() or None
+
+    def _buffer(self, source, prebuffer:float=None) -> BufferedSource:
+        """Read a source ahead on a background thread"""
+
+        if prebuffer is None:
+            return BufferedSource(source, on_underrun=self._underrun)
+
+        return BufferedSource(source, prebuffer=prebuffer, on_underrun=self._underrun)
+
+    def _underrun(self) -> None:
+        self.underruns += 1
+
+    def pcm(
+        self,
+        guild_id:int,
+        stream_url:str,
+        *,
+        start:float=0.0,
+        prebuffer:float=None,
+        tee=None
+    ) -> BufferedSource:
+        """Spawn ffmpeg for a stream url and return the PCM source. Set
+        tee to a callable that wraps the ffmpeg source before it is
+        buffered."""
+
+        source = TrackedFFmpegPCMAudio(
+            self, guild_id, stream_url,
+            executable=self.executable,
+            before_options=self._before_options(stream_url, start),
+            options=self.options.get("options")
+        )
+        self._track(guild_id, source)
+
+        if tee is not None:
+            source = tee(source)
+
+        return self._buffer(source, prebuffer)
+
+    def opus(
+        self,
+        guild_id:int | None,
+        stream_url:str,
+        *,
+        volume:float=1.0,
+        start:float=0.0,
+        transcode:bool=False,
+        prebuffer:float=None,
+        tee=None
+    ) -> BufferedSource:
+        """Spawn ffmpeg for an Opus stream url and return the Opus
+        source. At full volume the packets are copied as they are,
+        otherwise ffmpeg applies the volume and re-encodes them. Set
+        transcode for streams that aren't Opus to begin with, prebuffer
+        to start sooner than usual, and tee to a callable that wraps
+        the ffmpeg source before it is buffered. A guild id of None
+        opens a source shared between guilds.
+        """
+
+        copy = volume == 1.0 and not transcode
+
+        options = self.options.get("options", "")
+        if volume != 1.0:
+            options += f" -af volume={volume:.3f}"
+
+        source = TrackedFFmpegOpusAudio(
+            self, guild_id, stream_url,
+            codec="opus" if copy else None,
+            executable=self.executable,
+            before_options=self._before_options(stream_url, start),
+            options=options.strip() or None
+        )
+        self._track(guild_id, source)
+
+        if copy:
+            self.passthrough += 1
+
+        if tee is not None:
+            source = tee(source)
+
+        return self._buffer(source, prebuffer)
+
+    def _track(self, guild_id:int | None, source) -> None:
+        """Start tracking a freshly created source, a guild id of None
+        is a source shared between guilds"""
+
+        self.created += 1
+
+        if guild_id is None:
+            self._shared.add(source)
+            return
+
+        self._live.setdefault(guild_id, set()).add(source)
+        self.peak = max(self.peak, self.live(guild_id))
+
+        log.debug("Guild %s has %s live ffmpeg processes", guild_id, self.live(guild_id))
+
+    def listen(self, guild_id:int) -> None:
+        """Count a shared source towards a guild that started reading
+        from it"""
+
+        self._listening[guild_id] = self._listening.get(guild_id, 0) + 1
+        self.peak = max(self.peak, self.live(guild_id))
+
+    def unlisten(self, guild_id:int) -> None:
+        """Stop counting a shared source towards a guild"""
+
+        listening = self._listening.get(guild_id, 0) - 1
+        if listening > 0:
+            self._listening[guild_id] = listening
+        else:
+            self._listening.pop(guild_id, None)
+
+    def release(self, guild_id:int | None, source) -> None:
+        """Stop tracking a source, called when it is cleaned up"""
+
+        if guild_id is None:
+            self._shared.discard(source)
+            return
+
+        live = self._live.get(guild_id)
+        if live is None:
+            return
+
+        live.discard(source)
+        if not live:
+            del self._live[guild_id]
+
+    def live(self, guild_id:int=None) -> int:
+        """Returns the number of live sources for a guild, including
+        the shared ones it reads from, or every live source if no guild
+        is given"""
+
+        if guild_id is not None:
+            return len(self._live.get(guild_id, ())) + self._listening.get(guild_id, 0)
+
+        return sum(len(live) for live in self._live.values()) + len(self._shared)
+
+    def stats(self) -> dict:
+        """Returns the process counters"""
+
+        return {
+            "live processes": self.live(),
+            "shared processes": len(self._shared),
+            "guilds with processes": len(self._live.keys() | self._listening.keys()),
+            "most in one guild": self.peak,
+            "created": self.created,
+            "opus passthrough": self.passthrough,
+            "buffer underruns": self.underruns,
+        }
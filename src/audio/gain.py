@@ -0,0 +1,140 @@
+"""Volume control for PCM audio.
+
+Replaces discord.PCMVolumeTransformer, which jumps straight to a new
+volume and can click when it does. Gain is applied with NumPy over the
+int16 samples, and volume changes ramp smoothly from the old gain to
+the new one over a short time. Any number of whole frames can be
+processed in one call, so buffered sources can work in batches.
+"""
+
+import numpy as np
+import discord
+
+from constants import (
+    MUSIC_DEFAULT_VOLUME,
+    MUSIC_VOLUME_RAMP,
+    MUSIC_VOLUME_RAMP_SECONDS
+)
+
+
+SAMPLE_RATE = discord.opus.Encoder.SAMPLING_RATE
+CHANNELS = discord.opus.Encoder.CHANNELS
+
+
+class GainTransformer(discord.AudioSource):
+    """Applies a volume to a PCM source with click-free ramps.
+
+    Args:
+        original (discord.AudioSource): The PCM source to transform
+        volume (float): The starting volume, 1.0 is unchanged
+        ramp (str): Either "linear" or "exponential", exponential
+            ramps sound even to the ear
+        ramp_seconds (float): How long a volume change takes
+
+    Raises:
+        discord.ClientException: If the source is not PCM
+    """
+
+    def __init__(
+        self,
+        original:discord.AudioSource,
+        volume:float=MUSIC_DEFAULT_VOLUME,
+        *,
+        ramp:str=MUSIC_VOLUME_RAMP,
+        ramp_seconds:float=MUSIC_VOLUME_RAMP_SECONDS
+    ):
+        if not isinstance(original, discord.AudioSource):
+            raise TypeError(f"expected AudioSource not {original.__class__.__name__}.")
+
+        if original.is_opus():
+            raise discord.ClientException("AudioSource must not be Opus encoded.")
+
+        if ramp not in ("linear", "exponential"):
+            raise ValueError(f"Unknown ramp: {ramp}")
+
+        self.original = original
+        self.ramp = ramp
+        self.ramp_samples = max(1, int(ramp_seconds * SAMPLE_RATE))
+
+        self._gain = max(volume, 0.0)
+        self._start = self._target = self._gain
+        self._ramp_done = self.ramp_samples
+
+    @property
+    def volume(self) -> float:
+        """The volume being ramped towards"""
+
+        return self._target
+
+    @volume.setter
+    def volume(self, value:float) -> None:
+        """Start ramping from the current gain to a new volume"""
+
+        self._start = self._gain
+        self._target = max(value, 0.0)
+        self._ramp_done = 0
+
+    def set_volume(self, value:float) -> None:
+        """Jump straight to a volume without ramping"""
+
+        self._gain = self._start = self._target = max(value, 0.0)
+        self._ramp_done = self.ramp_samples
+
+    @property
+    def buffering(self) -> bool:
+        """Returns True while the original source is refilling its
+        buffer"""
+
+        return getattr(self.original, "buffering", False)
+
+    def cleanup(self) -> None:
+        self.original.cleanup()
+
+    def read(self) -> bytes:
+        return self.apply(self.original.read())
+
+    def _curve(self, progress:np.ndarray) -> np.ndarray:
+        """Returns the gain at each point of the ramp (0 to 1)"""
+
+        start, target = self._start, self._target
+
+        # An exponential ramp can't start or end at silence
+        if self.ramp == "exponential" and start > 0 and target > 0:
+            return start * (target / start) ** progress
+
+        return start + (target - start) * progress
+
+    def apply(self, data:bytes) -> bytes:
+        """Apply the gain to any number of whole PCM frames"""
+
+        if not data:
+            return data
+
+        ramping = self._ramp_done < self.ramp_samples
+        if not ramping and self._gain == 1.0:
+            return data
+
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+
+        if ramping:
+            samples = samples.reshape(-1, CHANNELS)
+            count = min(len(samples), self.ramp_samples - self._ramp_done)
+
+            gains = np.full(len(samples), self._target, dtype=np.float32)
+            progress = np.arange(
+                self._ramp_done + 1, self._ramp_done + count + 1,
+                dtype=np.float32
+            ) / self.ramp_samples
+            gains[:count] = self._curve(progress)
+
+            self._ramp_done += count
+            self._gain = float(gains[count - 1]) if count else self._target
+            if self._ramp_done >= self.ramp_samples:
+                self._gain = self._target
+
+            samples *= gains[:, None]
+        else:
+            samples *= self._gain
+
+        np.clip(samples, -32768, 32767, out=samples)
+        return samples.astype(np.int16).tobytes()
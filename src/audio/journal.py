@@ -0,0 +1,367 @@
+"""Append-only journal of every guild's song queue.
+
+Queues only live in memory, so a crash used to lose all of them. Every
+change to a queue is now appended to that guild's journal file as one
+short JSON line, and every so often, or when the whole order changes,
+the queue is written out as a snapshot and the journal starts over.
+Recovering a queue reads its snapshot and replays the few lines after
+it. Queues are only read back when their guild is next used.
+
+Nothing touches the disk on the event loop. Changes are handed to a
+writer thread, which batches them into one write per guild. Reads go
+through the same thread so that they see every earlier change.
+
+Tracks are stored as compact records of their metadata, enough to show
+them and play them without searching again.
+"""
+
+import os
+import json
+import queue
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import Future
+
+from constants import DATA, MUSIC_QUEUE_JOURNAL_DIRNAME, MUSIC_QUEUE_SNAPSHOT_EVERY
+
+
+log = logging.getLogger(__name__)
+
+# Journal operations, one letter each to keep the lines short
+PUT = "p"  # ["p", record], append a song
+GET = "g"  # ["g"], take the first song
+REMOVE = "r"  # ["r", index]
+MOVE = "m"  # ["m", source, destination]
+ROTATE = "o"  # ["o", count]
+SET = "s"  # ["s", index, record], a song's metadata changed
+HEADER = "h"  # ["h", generation], first line, matches the snapshot
+
+
+def replay(records:list, operations) -> list:
+    """Apply journal operations to a snapshot's records
+
+    Raises:
+        ValueError: An operation is unknown or out of range
+    """
+
+    records = list(records)
+
+    for operation in operations:
+        kind = operation[0]
+
+        try:
+            if kind == PUT:
+                records.append(operation[1])
+            elif kind == GET:
+                records.pop(0)
+            elif kind == REMOVE:
+                records.pop(operation[1])
+            elif kind == MOVE:
+                records.insert(operation[2], records.pop(operation[1]))
+            elif kind == ROTATE:
+                if records:
+                    count = operation[1] % len(records)
+                    records = records[-count:] + records[:-count] if count else records
+            elif kind == SET:
+                records[operation[1]] = operation[2]
+            else:
+                raise ValueError(f"Unknown journal operation: {kind}")
+
+        except IndexError as error:
+            raise ValueError(f"Journal operation out of range: {operation}") from error
+
+    return records
+
+
+class GuildJournal:
+    """The journal of one guild's queue, handed to its SongQueue
+
+    Args:
+        journal (QueueJournal): The journal the changes are written to
+        guild_id (int): The guild the queue belongs to
+        snapshot_every (int): Least operations between snapshots
+    """
+
+    __slots__ = ("journal", "guild_id", "snapshot_every", "_since_snapshot")
+
+    def __init__(self, journal, guild_id:int, snapshot_every:int):
+        self.journal = journal
+        self.guild_id = guild_id
+        self.snapshot_every = snapshot_every
+        self._since_snapshot = 0
+
+    def due(self, size:int) -> bool:
+        """Returns True when a queue of this many songs should be
+        snapshotted. A long queue waits for as many operations as it
+        has songs, so snapshots cost O(1) per operation overall."""
+
+        return self._since_snapshot >= max(self.snapshot_every, size)
+
+    def append(self, *operation) -> None:
+        """Journal an operation"""
+
+        self._since_snapshot += 1
+        self.journal.submit(self.guild_id, "append", operation)
+
+    def snapshot(self, records:list) -> None:
+        """Replace the journal with the queue's full contents"""
+
+        self._since_snapshot = 0
+        self.journal.submit(self.guild_id, "snapshot", records)
+
+
+class QueueJournal:
+    """Journals and snapshots of every guild's queue, written from a
+    background thread.
+
+    Args:
+        directory (str): Where the files are kept
+        snapshot_every (int): Least operations between snapshots
+    """
+
+    __slots__ = (
+        "directory",
+        "snapshot_every",
+        "_pending",
+        "_thread",
+        "_generations",
+        "operations",
+        "snapshots",
+        "batches",
+        "rehydrated",
+        "songs_rehydrated",
+        "errors"
+    )
+
+    def __init__(
+        self,
+        directory:str=f"{DATA}{MUSIC_QUEUE_JOURNAL_DIRNAME}",
+        *,
+        snapshot_every:int=MUSIC_QUEUE_SNAPSHOT_EVERY
+    ):
+        self.directory = Path(directory)
+        self.snapshot_every = snapshot_every
+
+        self._pending = queue.SimpleQueue()
+        self._thread: threading.Thread = None
+
+        # The snapshot generation of each guild the writer has seen
+        self._generations: dict[int, int] = {}
+
+        self.operations = 0
+        self.snapshots = 0
+        self.batches = 0
+        self.rehydrated = 0
+        self.songs_rehydrated = 0
+        self.errors = 0
+
+    def guild(self, guild_id:int) -> GuildJournal:
+        """Returns the journal for a guild's queue"""
+
+        return GuildJournal(self, guild_id, self.snapshot_every)
+
+    def submit(self, guild_id:int, kind:str, payload, future:Future=None) -> None:
+        """Hand work to the writer thread, starting it on first use"""
+
+        if self._thread is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._thread = threading.Thread(
+                target=self._run, name="queue-journal", daemon=True
+            )
+            self._thread.start()
+
+        self._pending.put((guild_id, kind, payload, future))
+
+    async def load(self, guild_id:int) -> list:
+        """Returns the records of a guild's queue as it was journaled"""
+
+        future = Future()
+        self.submit(guild_id, "load", None, future)
+        records = await asyncio.wrap_future(future)
+
+        if records:
+            self.rehydrated += 1
+            self.songs_rehydrated += len(records)
+
+        return records
+
+    def _log(self, guild_id:int) -> Path:
+        return self.directory / f"{guild_id}.log"
+
+    def _snapshot(self, guild_id:int) -> Path:
+        return self.directory / f"{guild_id}.snap"
+
+    def _run(self) -> None:
+        """Write changes in batches until closed"""
+
+        while True:
+            batch = [self._pending.get()]
+            while True:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            closing = batch[-1] is None
+            if closing:
+                batch.pop()
+
+            try:
+                self._write(batch)
+            except Exception:
+                self.errors += 1
+                log.exception("Writing the queue journal failed")
+
+            if closing:
+                return
+
+    def _write(self, batch:list) -> None:
+        """Apply a batch in order, grouping the appends to each guild
+        into one write"""
+
+        lines: dict[int, list[str]] = {}
+
+        for guild_id, kind, payload, future in batch:
+            if kind == "append":
+                lines.setdefault(guild_id, []).append(
+                    json.dumps(payload, separators=(",", ":"))
+                )
+                self.operations += 1
+                continue
+
+            try:
+                # Anything else must see the appends before it
+                self._flush(guild_id, lines.pop(guild_id, None))
+
+                if kind == "snapshot":
+                    self._write_snapshot(guild_id, payload)
+                elif kind == "load":
+                    future.set_result(self._read(guild_id))
+
+            except (OSError, ValueError, KeyError) as error:
+                log.warning("Queue journal of guild %s failed: %s", guild_id, error)
+                self.errors += 1
+
+                if future is not None and not future.done():
+                    future.set_result([])
+
+            # Anything else goes to whoever is waiting on the load, the
+            # rest of the batch is still written
+            except Exception as error:
+                log.exception("Queue journal of guild %s failed", guild_id)
+                self.errors += 1
+
+                if future is not None and not future.done():
+                    future.set_exception(error)
+
+        for guild_id, guild_lines in lines.items():
+            try:
+                self._flush(guild_id, guild_lines)
+            except OSError as error:
+                log.warning("Queue journal of guild %s failed: %s", guild_id, error)
+                self.errors += 1
+
+        self.batches += 1
+
+    def _flush(self, guild_id:int, lines:list[str]) -> None:
+        if not lines:
+            return
+
+        self._prepare(guild_id)
+        with self._log(guild_id).open("a", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+
+    def _prepare(self, guild_id:int) -> int:
+        """Returns a guild's snapshot generation. The first time a
+        guild is seen, its journal is given a header if it has none
+        and a line left half written by a crash is cut off."""
+
+        generation = self._generations.get(guild_id)
+        if generation is not None:
+            return generation
+
+        generation = 0
+        try:
+            with self._snapshot(guild_id).open(encoding="utf-8") as file:
+                generation = json.load(file)["generation"]
+        except FileNotFoundError:
+            pass
+
+        path = self._log(guild_id)
+        try:
+            with path.open("rb+") as file:
+                data = file.read()
+                if not data.endswith(b"\n"):
+                    file.truncate(data.rfind(b"\n") + 1)
+        except FileNotFoundError:
+            data = b""
+
+        if not data.strip():
+            path.write_text(json.dumps([HEADER, generation]) + "\n", encoding="utf-8")
+
+        self._generations[guild_id] = generation
+        return generation
+
+    def _write_snapshot(self, guild_id:int, records:list) -> None:
+        """Write the queue out and start a new journal after it. The
+        snapshot is swapped in atomically before the journal is reset,
+        the header tells a stale journal apart if that is interrupted."""
+
+        generation = self._prepare(guild_id) + 1
+
+        path = self._snapshot(guild_id)
+        partial = path.with_suffix(".snap.partial")
+        partial.write_text(
+            json.dumps({"generation": generation, "queue": records}, separators=(",", ":")),
+            encoding="utf-8"
+        )
+        os.replace(partial, path)
+
+        self._log(guild_id).write_text(
+            json.dumps([HEADER, generation]) + "\n", encoding="utf-8"
+        )
+        self._generations[guild_id] = generation
+        self.snapshots += 1
+
+    def _read(self, guild_id:int) -> list:
+        """Returns a guild's snapshot with its journal replayed"""
+
+        generation = self._prepare(guild_id)
+
+        records = []
+        if generation:
+            with self._snapshot(guild_id).open(encoding="utf-8") as file:
+                records = json.load(file)["queue"]
+
+        with self._log(guild_id).open(encoding="utf-8") as file:
+            operations = [json.loads(line) for line in file]
+
+        # A journal from before the snapshot was reset, its operations
+        # are already in the snapshot
+        if not operations or operations[0] != [HEADER, generation]:
+            return records
+
+        return replay(records, operations[1:])
+
+    def stats(self) -> dict:
+        """Returns the journal counters"""
+
+        return {
+            "operations": self.operations,
+            "snapshots": self.snapshots,
+            "write batches": self.batches,
+            "backlog": self._pending.qsize(),
+            "queues rehydrated": self.rehydrated,
+            "songs rehydrated": self.songs_rehydrated,
+            "errors": self.errors,
+        }
+
+    def close(self) -> None:
+        """Write everything still pending and stop the writer"""
+
+        if self._thread is not None:
+            self._pending.put(None)
+            self._thread.join()
+            self._thread = None
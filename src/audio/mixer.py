@@ -0,0 +1,445 @@
+"""Gapless and crossfaded transitions between songs.
+
+Without a mixer, the next song's source is only started after the
+current one has ended and the player loop has caught up, which leaves
+a gap. The mixer plays the current song and holds the next song's
+source, opened and buffered ahead of time. When the current song ends,
+the mixer carries straight on with the next one in the same tick, or,
+for a crossfade, starts reading both a few seconds before the end and
+blends them with an equal-power curve in NumPy. Opus frames are only
+decoded while a crossfade is running, the rest of the time they pass
+straight through.
+
+Seeking hands the mixer a new source for the song being heard, opened
+at the new position. The old source keeps playing until the new one
+has buffered, then the mixer swaps them between two frames.
+"""
+
+import math
+import time
+import logging
+import threading
+
+import numpy as np
+import discord
+
+from .opus import FRAME_LENGTH
+from .buffer import OPUS_SILENCE
+from .gain import CHANNELS
+
+
+log = logging.getLogger(__name__)
+
+_FRAME_SAMPLES = discord.opus.Encoder.SAMPLES_PER_FRAME
+_FRAME_SIZE = discord.opus.Encoder.FRAME_SIZE
+
+
+class _Next:
+    """The source queued to play after the current one"""
+
+    __slots__ = ("source", "song", "duration", "fade")
+
+    def __init__(self, source:discord.AudioSource, song, duration:float, fade:int):
+        self.source = source
+        self.song = song
+        self.duration = duration
+        self.fade = fade
+
+
+class Mixer(discord.AudioSource):
+    """Plays a chain of sources without gaps between them.
+
+    Args:
+        source (discord.AudioSource): The first source to play
+        duration (float): Its length in seconds, 0 if unknown
+        start (float): Where in its song the source starts, in seconds
+        on_switch (Callable): Called from the player thread with the
+            song of a queued source when it starts being heard
+        on_gap (Callable): Called from the player thread with the
+            silence in seconds between one song and the next
+        on_seek (Callable): Called from the player thread with the
+            seconds between a seek and its audio being heard
+        previous (Mixer): The mixer that played the song before, used
+            to measure the gap when it wasn't handed over directly
+    """
+
+    def __init__(
+        self,
+        source:discord.AudioSource,
+        duration:float=0,
+        *,
+        start:float=0.0,
+        on_switch=None,
+        on_gap=None,
+        on_seek=None,
+        previous=None
+    ):
+        self.current = source
+        self.duration = duration
+        self.on_switch = on_switch
+        self.on_gap = on_gap
+        self.on_seek = on_seek
+
+        self._next: _Next = None
+        self._later: _Next = None  # queued while a crossfade is running
+        self._start = start  # where the current source starts in its song
+        self._frames = 0  # frames read from the current source
+        self._fade: int = None  # frames into the crossfade, if fading
+        self._decoders: dict[int, discord.opus.Decoder] = {}
+        self._opus = source.is_opus()
+        self._lock = threading.Lock()
+
+        # A seek waiting for its source to buffer, the source it will
+        # replace, where it starts and when it was asked for
+        self._seek: discord.AudioSource = None
+        self._seek_for: discord.AudioSource = None
+        self._seek_to = 0.0
+        self._seek_at = 0.0
+
+        # When the last real frame was read, to measure gaps. A gap is
+        # pending from the end of one song until the next one is heard.
+        self.last_frame_at: float = None
+        self._gap_since = previous.last_frame_at if previous else None
+
+    @property
+    def playing(self) -> discord.AudioSource:
+        """The newest source of the song being heard, which is the
+        queued one during a crossfade and a pending seek's source"""
+
+        if self._seek is not None:
+            return self._seek
+
+        return self._heard_source()
+
+    @property
+    def position(self) -> float:
+        """How far into the song being heard playback is, in seconds"""
+
+        if self._fade is not None:
+            return self._fade * FRAME_LENGTH
+
+        return self._start + self._frames * FRAME_LENGTH
+
+    @property
+    def fading(self) -> bool:
+        return self._fade is not None
+
+    @property
+    def buffering(self) -> bool:
+        return getattr(self.current, "buffering", False)
+
+    def is_opus(self) -> bool:
+        """Returns whether the last frame read was Opus, the output is
+        PCM while crossfading"""
+
+        return self._opus
+
+    def queue(self, source:discord.AudioSource, song, *, duration:float=0, crossfade:float=0) -> None:
+        """Queue the source to play when the current one ends, which
+        the mixer then owns.
+
+        Args:
+            source (discord.AudioSource): The next source
+            song (Song): Passed to on_switch when it starts
+            duration (float): Its length in seconds, 0 if unknown
+            crossfade (float): Seconds to crossfade over, 0 for a
+                gapless handoff
+        """
+
+        with self._lock:
+            fade = int(crossfade / FRAME_LENGTH) if duration else 0
+            upcoming = _Next(source, song, duration, fade)
+
+            # The source being faded into is already heard, this one
+            # follows it
+            if self._fade is not None:
+                if self._later is not None:
+                    self._close(self._later.source)
+                self._later = upcoming
+                return
+
+            if self._next is not None:
+                self._close(self._next.source)
+            self._next = upcoming
+
+    def cancel_next(self) -> bool:
+        """Drop the queued source that isn't being heard yet
+
+        Returns:
+            bool: True if there is no longer such a source
+        """
+
+        with self._lock:
+            if self._fade is not None:
+                if self._later is not None:
+                    self._close(self._later.source)
+                    self._later = None
+                return True
+
+            if self._next is not None:
+                self._close(self._next.source)
+                self._next = None
+
+            return True
+
+    def seek(self, source:discord.AudioSource, position:float) -> None:
+        """Carry on playing the song being heard from another source,
+        which the mixer then owns. It takes over once it has buffered.
+
+        Args:
+            source (discord.AudioSource): The song's audio, opened at
+                the position
+            position (float): Where the source starts, in seconds
+        """
+
+        with self._lock:
+            if self._seek is not None:
+                self._close(self._seek)
+
+            self._seek = source
+            self._seek_for = self._heard_source()
+            self._seek_to = position
+            self._seek_at = time.perf_counter()
+
+    def skip(self) -> bool:
+        """Cut straight to the queued source. During a crossfade the
+        queued source is already the song being heard, so there is
+        nothing to skip to.
+
+        Returns:
+            bool: True if there was a queued source to skip to
+        """
+
+        with self._lock:
+            if self._next is None or self._fade is not None:
+                return False
+
+            switched = self._switch(heard=False)
+
+        self._notify(switched)
+        return True
+
+    def read(self) -> bytes:
+        with self._lock:
+            if self._seek is not None:
+                self._check_seek()
+
+            if self._fade is None and self._should_fade():
+                self._fade = 0
+
+            if self._fade is not None:
+                data, switched = self._mix()
+            else:
+                data, switched = self._read_current()
+
+        self._notify(switched)
+        return data
+
+    def _heard_source(self) -> discord.AudioSource:
+        if self._fade is not None and self._next is not None:
+            return self._next.source
+
+        return self.current
+
+    def _check_seek(self) -> None:
+        """Swap in the pending seek's source once it has buffered, or
+        drop it if the song it was for has already ended"""
+
+        if self._seek_for is not self._heard_source():
+            self._close(self._seek)
+            self._seek = self._seek_for = None
+            return
+
+        if not getattr(self._seek, "buffering", False):
+            self._apply_seek()
+
+    def _apply_seek(self) -> None:
+        """Make the pending seek's source current, cutting short a
+        crossfade into the song it was for"""
+
+        if self._fade is not None:
+            self._switch(heard=True)
+
+        old, self.current = self.current, self._seek
+        self._seek = self._seek_for = None
+        self._start = self._seek_to
+        self._frames = 0
+
+        self._decoders.pop(id(old), None)
+        self._close(old)
+
+        if self.on_seek is not None:
+            self.on_seek(time.perf_counter() - self._seek_at)
+
+    def _should_fade(self) -> bool:
+        # A livestream or a song of unknown length has no end to fade
+        # out of, it is handed over when it runs out
+        upcoming = self._next
+        if upcoming is None or not upcoming.fade or self._seek is not None or not self.duration:
+            return False
+
+        remaining = self.duration - self.position
+
+        return (
+            remaining <= upcoming.fade * FRAME_LENGTH
+            and not getattr(upcoming.source, "buffering", False)
+        )
+
+    def _read_current(self) -> tuple[bytes, object]:
+        """Read the current source, moving on to the queued source if
+        it has ended"""
+
+        data = self.current.read()
+        switched = None
+
+        if not data:
+            # A seek back from the very end, or the next song
+            if self._seek is not None:
+                self._apply_seek()
+            elif self._next is not None:
+                switched = self._switch(heard=False)
+            else:
+                return b"", None
+
+            # The new source may still be filling its buffer, it is
+            # skipped over until it's ready
+            if getattr(self.current, "buffering", False):
+                self._opus = True
+                return OPUS_SILENCE, switched
+
+            data = self.current.read()
+            if not data:
+                return b"", switched
+
+        self._frames += 1
+        self._opus = self.current.is_opus()
+        self._heard()
+        return data, switched
+
+    def _mix(self) -> tuple[bytes, object]:
+        """Read a frame from both sources and blend them"""
+
+        upcoming = self._next
+        switched = upcoming.song if self._fade == 0 else None
+        old = self.current.read()
+
+        # The current song ended early, finish with the next song
+        if not old:
+            self._switch(heard=True)
+            data, _ = self._read_current()
+            return data, switched
+
+        new = upcoming.source.read()
+
+        try:
+            old_pcm = self._pcm(self.current, old)
+            new_pcm = self._pcm(upcoming.source, new)
+        except (discord.opus.OpusError, discord.opus.OpusNotLoaded) as error:
+            # Can't decode here, settle for a gapless handoff
+            log.warning("Crossfade unavailable: %s", error)
+            self._switch(heard=True)
+            self._frames += 1
+            self._opus = self.current.is_opus()
+            return new, switched
+
+        # Equal power curve, continuous across frames
+        start = self._fade / upcoming.fade
+        progress = start + np.arange(1, _FRAME_SAMPLES + 1, dtype=np.float32) / (_FRAME_SAMPLES * upcoming.fade)
+        angle = np.minimum(progress, 1.0) * (math.pi / 2)
+
+        mixed = (
+            old_pcm * np.cos(angle)[:, None]
+            + new_pcm * np.sin(angle)[:, None]
+        )
+        np.clip(mixed, -32768, 32767, out=mixed)
+
+        self._frames += 1
+        self._fade += 1
+        self._opus = False
+        self._heard()
+
+        if self._fade >= upcoming.fade:
+            frames = self._fade
+            self._switch(heard=True)
+            self._frames = frames
+
+        return mixed.astype(np.int16).tobytes(), switched
+
+    def _pcm(self, source:discord.AudioSource, data:bytes) -> np.ndarray:
+        """Returns a frame as float samples, decoding Opus frames"""
+
+        if not data:
+            return np.zeros((_FRAME_SAMPLES, CHANNELS), dtype=np.float32)
+
+        if source.is_opus():
+            decoder = self._decoders.get(id(source))
+            if decoder is None:
+                decoder = self._decoders[id(source)] = discord.opus.Decoder()
+            data = decoder.decode(data)
+
+        samples = np.frombuffer(data, dtype=np.int16)
+        if len(samples) != _FRAME_SIZE // 2:
+            samples = np.resize(samples, _FRAME_SIZE // 2)
+
+        return samples.reshape(-1, CHANNELS).astype(np.float32)
+
+    def _switch(self, heard:bool):
+        """Make the queued source current, closing the old one.
+
+        Returns:
+            The song that started being heard, if it wasn't already
+        """
+
+        upcoming, self._next, self._later = self._next, self._later, None
+        old, self.current = self.current, upcoming.source
+        self.duration = upcoming.duration
+        self._start = 0.0
+        self._frames = 0
+        self._fade = None
+
+        self._decoders.pop(id(old), None)
+        self._close(old)
+
+        if not heard:
+            self._gap_since = self.last_frame_at
+            return upcoming.song
+
+        return None
+
+    def _heard(self) -> None:
+        """Record that a real frame was read, ending any pending gap"""
+
+        now = time.perf_counter()
+
+        if self._gap_since is not None:
+            gap = max(0.0, now - self._gap_since - FRAME_LENGTH)
+            self._gap_since = None
+
+            if self.on_gap is not None:
+                self.on_gap(gap)
+
+        self.last_frame_at = now
+
+    def _notify(self, song) -> None:
+        if song is not None and self.on_switch is not None:
+            self.on_switch(song)
+
+    @staticmethod
+    def _close(source:discord.AudioSource) -> None:
+        """Clean up a source off the player thread, stopping ffmpeg can
+        take a while"""
+
+        threading.Thread(target=source.cleanup, daemon=True).start()
+
+    def cleanup(self) -> None:
+        with self._lock:
+            for upcoming in (self._next, self._later):
+                if upcoming is not None:
+                    upcoming.source.cleanup()
+            self._next = self._later = None
+
+            if self._seek is not None:
+                self._seek.cleanup()
+                self._seek = self._seek_for = None
+
+        self.current.cleanup()
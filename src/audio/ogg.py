@@ -0,0 +1,143 @@
+"""Writing Opus packets into an Ogg container.
+
+discord.py can read Ogg Opus but not write it. The audio cache keeps
+the packets of a track as they are played, so this muxes them into an
+Ogg Opus stream as described in RFC 7845: an OpusHead page, an
+OpusTags page, then the audio pages with the running sample count as
+their granule position.
+"""
+
+import zlib
+import struct
+import random
+
+
+# Samples in 48kHz, the rate every Opus stream is timed in
+SAMPLE_RATE = 48000
+CHANNELS = 2
+
+# The encoder delay of libopus, which ffmpeg and discord.py both use
+PRE_SKIP = 312
+
+_BEGIN = 0x02
+_END = 0x04
+_PAGE_HEADER = struct.Struct("<4sBBqIIIB")
+
+# Ogg uses the CRC-32 of zlib with the bits the other way round
+_REVERSED = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+# Samples per frame of each Opus frame duration, by TOC config
+_FRAME_SAMPLES = (
+    [480, 960, 1920, 2880] * 3  # SILK, 10 to 60ms
+    + [480, 960] * 2  # Hybrid, 10 or 20ms
+    + [120, 240, 480, 960] * 4  # CELT, 2.5 to 20ms
+)
+
+
+def ogg_crc(data:bytes) -> int:
+    """Returns the Ogg checksum of a page"""
+
+    crc = zlib.crc32(data.translate(_REVERSED), 0xFFFFFFFF) ^ 0xFFFFFFFF
+    return int(f"{crc:032b}"[::-1], 2)
+
+def packet_samples(packet:bytes) -> int:
+    """Returns how many 48kHz samples an Opus packet decodes to"""
+
+    if not packet:
+        return 0
+
+    toc = packet[0]
+    frames = toc & 0x03
+
+    if frames == 3:
+        frames = packet[1] & 0x3F if len(packet) > 1 else 0
+    elif frames:
+        frames = 2
+    else:
+        frames = 1
+
+    return _FRAME_SAMPLES[toc >> 3] * frames
+
+
+class OggOpusWriter:
+    """Muxes Opus packets into an Ogg stream written to a file.
+
+    Args:
+        file: A binary file open for writing
+        page_packets (int): The most packets put on one page, short
+            pages let ffmpeg seek in the file more precisely
+    """
+
+    __slots__ = (
+        "file",
+        "page_packets",
+        "serial",
+        "samples",
+        "written",
+        "_sequence",
+        "_packets"
+    )
+
+    def __init__(self, file, *, page_packets:int=50):
+        self.file = file
+        self.page_packets = page_packets
+        self.serial = random.getrandbits(32)
+
+        # The samples of every packet written so far, and the bytes
+        self.samples = 0
+        self.written = 0
+
+        self._sequence = 0
+        self._packets: list[bytes] = []
+
+        head = struct.pack(
+            "<8sBBHIhB", b"OpusHead", 1, CHANNELS, PRE_SKIP, SAMPLE_RATE, 0, 0
+        )
+        vendor = b"OnePlayer"
+        tags = b"OpusTags" + struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", 0)
+
+        self._page([head], 0, _BEGIN)
+        self._page([tags], 0, 0)
+
+    def write(self, packet:bytes) -> None:
+        """Add a packet, a page is written once it is full"""
+
+        if self._lacing(self._packets) + self._lacing([packet]) > 255 or len(self._packets) >= self.page_packets:
+            self._flush()
+
+        self._packets.append(packet)
+
+    def close(self) -> None:
+        """Write the last page, marked as the end of the stream"""
+
+        self._flush(_END)
+
+    @staticmethod
+    def _lacing(packets:list[bytes]) -> int:
+        return sum(len(packet) // 255 + 1 for packet in packets)
+
+    def _flush(self, flags:int=0) -> None:
+        if not self._packets and not flags:
+            return
+
+        for packet in self._packets:
+            self.samples += packet_samples(packet)
+
+        self._page(self._packets, self.samples, flags)
+        self._packets = []
+
+    def _page(self, packets:list[bytes], granule:int, flags:int) -> None:
+        lacing = bytearray()
+        for packet in packets:
+            lacing.extend(b"\xff" * (len(packet) // 255))
+            lacing.append(len(packet) % 255)
+
+        header = _PAGE_HEADER.pack(
+            b"OggS", 0, flags, granule, self.serial, self._sequence, 0, len(lacing)
+        )
+        page = bytearray(header + lacing + b"".join(packets))
+        struct.pack_into("<I", page, 22, ogg_crc(page))
+
+        self.file.write(page)
+        self.written += len(page)
+        self._sequence += 1
@@ -0,0 +1,98 @@
+"""Opus playback without decoding in the bot process.
+
+Most youtube audio streams are already Opus in a WebM container. For
+those ffmpeg can copy the Opus packets straight into an Ogg stream,
+which discord.py sends as they are, skipping the decode to PCM, the
+volume transform and the re-encode. Since the packets can't be scaled,
+any volume other than 100% is applied by ffmpeg's volume filter, with
+ffmpeg doing the encoding in its own process. Changing the volume
+swaps in a new ffmpeg process at the current position.
+"""
+
+import threading
+
+import discord
+
+
+# Discord expects one 20ms Opus frame per read
+FRAME_LENGTH = 0.02
+
+
+class OpusSource(discord.AudioSource):
+    """Plays an ffmpeg Opus source, which can be swapped out while it
+    is playing. Keeps track of the playback position.
+
+    Args:
+        song (Song): The song being played
+        original (discord.FFmpegOpusAudio): The ffmpeg source
+        location (str): The stream url or file ffmpeg is reading
+        start (float): The position in seconds that ffmpeg starts at
+        volume (float): The volume applied by ffmpeg
+        transcode (bool): True if the location isn't Opus, so ffmpeg
+            always has to encode it
+    """
+
+    def __init__(
+        self,
+        song,
+        original:discord.AudioSource,
+        location:str,
+        *,
+        start:float=0.0,
+        volume:float=1.0,
+        transcode:bool=False
+    ):
+        self.song = song
+        self.original = original
+        self.location = location
+        self.volume = volume
+        self.transcode = transcode
+
+        self._start = start
+        self._frames = 0
+        self._lock = threading.Lock()
+
+    @property
+    def passthrough(self) -> bool:
+        """Returns True if the packets are copied without re-encoding"""
+
+        return self.volume == 1.0 and not self.transcode
+
+    @property
+    def position(self) -> float:
+        """The playback position in seconds"""
+
+        return self._start + self._frames * FRAME_LENGTH
+
+    @property
+    def buffering(self) -> bool:
+        """Returns True while the ffmpeg source is refilling its buffer"""
+
+        return getattr(self.original, "buffering", False)
+
+    def is_opus(self) -> bool:
+        return True
+
+    def read(self) -> bytes:
+        with self._lock:
+            data = self.original.read()
+
+        if data:
+            self._frames += 1
+
+        return data
+
+    def replace(self, original:discord.AudioSource, *, start:float, volume:float) -> None:
+        """Swap in a new ffmpeg source, the old one is cleaned up"""
+
+        with self._lock:
+            old = self.original
+            self.original = original
+            self.volume = volume
+            self._start = start
+            self._frames = 0
+
+        old.cleanup()
+
+    def cleanup(self) -> None:
+        self.original.cleanup()
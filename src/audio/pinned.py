@@ -0,0 +1,132 @@
+"""Pinned tracks that are kept ready to play.
+
+Some commands always play the same few videos. Those tracks are
+pinned: their metadata is resolved and their audio saved to the audio
+cache at startup, and again on a schedule before the cached stream url
+expires, so playing one never has to wait on youtube.
+"""
+
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from .track import TrackInfo
+from constants import MUSIC_PINNED_REFRESH
+
+
+log = logging.getLogger(__name__)
+
+
+class PinnedRegistry:
+    """Keeps a fixed set of named tracks warm.
+
+    Args:
+        tracks (dict): Maps the name of each pinned track to its url
+        warm (Callable): Coroutine function that resolves a url and
+            caches its audio, returning the TrackInfo
+        is_cached (Callable): Returns True if a track's audio is cached
+        interval (float): Seconds between refreshes, this should be
+            shorter than the stream url lifetime
+    """
+
+    __slots__ = (
+        "tracks",
+        "warm",
+        "is_cached",
+        "interval",
+        "_infos",
+        "_failed",
+        "_warmed_at",
+        "_task"
+    )
+
+    def __init__(
+        self,
+        tracks:dict[str, str],
+        warm:Callable[[str], Awaitable[TrackInfo]],
+        is_cached:Callable[[TrackInfo], bool],
+        *,
+        interval:float=MUSIC_PINNED_REFRESH
+    ):
+        self.tracks = tracks
+        self.warm = warm
+        self.is_cached = is_cached
+        self.interval = interval
+
+        self._infos: dict[str, TrackInfo] = {}
+        self._failed: set[str] = set()
+        self._warmed_at: float = None
+        self._task: asyncio.Task = None
+
+    def __getitem__(self, name:str) -> str:
+        """Returns the url of a pinned track"""
+
+        return self.tracks[name]
+
+    def start(self) -> None:
+        """Start warming the tracks now and on every interval"""
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        """Stop the scheduled refreshes"""
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await self.warm_all()
+            await asyncio.sleep(self.interval)
+
+    async def warm_all(self) -> None:
+        """Warm every pinned track, one at a time so that the
+        resolver is left free for users."""
+
+        log.debug("Warming %s pinned tracks", len(self.tracks))
+
+        for name, url in self.tracks.items():
+            try:
+                self._infos[name] = await self.warm(url)
+                self._failed.discard(name)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Failed to warm pinned track %s", name)
+                self._failed.add(name)
+
+        self._warmed_at = time.time()
+
+    def status(self, name:str) -> str:
+        """Returns the status of a pinned track:
+
+        - "warm" when its metadata and audio are ready
+        - "partial" when only its metadata is ready
+        - "failed" when the last attempt to warm it failed
+        - "cold" otherwise
+        """
+
+        info = self._infos.get(name)
+
+        if info is not None and not info.stream_expired:
+            return "warm" if self.is_cached(info) else "partial"
+
+        if name in self._failed:
+            return "failed"
+
+        return "cold"
+
+    def stats(self) -> dict:
+        """Returns the status of every pinned track"""
+
+        warmed = (
+            f"{(time.time() - self._warmed_at) / 60:.0f} minutes ago"
+            if self._warmed_at else "never"
+        )
+        return {
+            **{name: self.status(name) for name in self.tracks},
+            "last warmed": warmed,
+        }
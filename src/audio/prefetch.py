@@ -0,0 +1,107 @@
+"""Background preparation of upcoming songs.
+
+While a song plays, the next few songs in the queue are prepared so
+that they are ready to go the moment the current one ends. Work for a
+song is cancelled as soon as it drops out of the look-ahead window,
+for example when it is removed, skipped over or shuffled away.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from constants import MUSIC_PREFETCH_DEPTH
+
+
+log = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """Keeps the first `depth` songs of a queue prepared.
+
+    Args:
+        queue (SongQueue): The queue to watch
+        prepare (Callable): Coroutine function that prepares a song
+            and returns True if there was any work to do, it should
+            return quickly if the song is already prepared
+        depth (int): How many upcoming songs to prepare
+    """
+
+    __slots__ = (
+        "queue",
+        "prepare",
+        "depth",
+        "_tasks",
+        "prepared",
+        "cancelled",
+        "failed"
+    )
+
+    def __init__(
+        self,
+        queue,
+        prepare:Callable[..., Awaitable],
+        *,
+        depth:int=MUSIC_PREFETCH_DEPTH
+    ):
+        self.queue = queue
+        self.prepare = prepare
+        self.depth = depth
+
+        self._tasks: dict[object, asyncio.Task] = {}
+        self.prepared = 0
+        self.cancelled = 0
+        self.failed = 0
+
+    def refresh(self) -> None:
+        """Start work for songs entering the look-ahead window and
+        cancel work for songs that have left it."""
+
+        upcoming = self.queue[:self.depth]
+
+        for song, task in list(self._tasks.items()):
+            if song not in upcoming:
+                log.debug("Cancelling prefetch, song left the window")
+                task.cancel()
+                del self._tasks[song]
+                self.cancelled += 1
+
+        for song in upcoming:
+            if song not in self._tasks:
+                self._tasks[song] = asyncio.create_task(self._prefetch(song))
+
+    def cancel_all(self) -> None:
+        """Cancel all outstanding work"""
+
+        for task in self._tasks.values():
+            task.cancel()
+
+        self.cancelled += len(self._tasks)
+        self._tasks.clear()
+
+    async def _prefetch(self, song) -> None:
+        """Prepare a single song"""
+
+        try:
+            if await self.prepare(song):
+                self.prepared += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:  # pylint: disable=broad-except
+            # The player will retry and report the error when it
+            # gets to the song, nothing to do here.
+            self.failed += 1
+            log.exception("Failed to prefetch a song")
+        finally:
+            if self._tasks.get(song) is asyncio.current_task():
+                del self._tasks[song]
+
+    def stats(self) -> dict:
+        """Returns the prefetch counters"""
+
+        return {
+            "in progress": len(self._tasks),
+            "prepared": self.prepared,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+        }
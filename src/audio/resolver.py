@@ -0,0 +1,262 @@
+"""Worker pool for resolving queries.
+
+Extraction is slow and mostly holds the GIL, so it gets a pool of its
+own instead of the event loop's default executor. Jobs are queued per
+guild and handed to the workers round-robin, with a cap on how many
+jobs a single guild can have running at once. This stops one guild
+pasting a pile of links from starving everybody else.
+"""
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+
+from exceptions import ResolverBusy
+from constants import (
+    MUSIC_RESOLVER_MODE,
+    MUSIC_RESOLVER_WORKERS,
+    MUSIC_RESOLVER_MAX_PENDING,
+    MUSIC_RESOLVER_GUILD_LIMIT
+)
+
+
+log = logging.getLogger(__name__)
+
+
+class _Job:
+    """A queued call waiting for a worker"""
+
+    __slots__ = ("guild_id", "func", "args", "local", "future", "queued_at")
+
+    def __init__(self, guild_id:int, func, args:tuple, local:bool, future:asyncio.Future):
+        self.guild_id = guild_id
+        self.func = func
+        self.args = args
+        self.local = local
+        self.future = future
+        self.queued_at = time.perf_counter()
+
+
+class ResolverPool:
+    """Bounded pool of resolver workers with per-guild fairness.
+
+    Args:
+        workers (int): The number of worker threads or processes
+        mode (str): Either "thread" or "process"
+        max_pending (int): The number of jobs that can wait for a
+            worker before new jobs are rejected
+        guild_limit (int): The number of jobs a single guild can have
+            running at once
+    """
+
+    __slots__ = (
+        "workers",
+        "mode",
+        "max_pending",
+        "guild_limit",
+        "_executor",
+        "_local_executor",
+        "_pending",
+        "_pending_count",
+        "_in_flight",
+        "_running",
+        "_waits",
+        "completed",
+        "rejected"
+    )
+
+    def __init__(
+        self,
+        workers:int=MUSIC_RESOLVER_WORKERS,
+        *,
+        mode:str=MUSIC_RESOLVER_MODE,
+        max_pending:int=MUSIC_RESOLVER_MAX_PENDING,
+        guild_limit:int=MUSIC_RESOLVER_GUILD_LIMIT
+    ):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown resolver mode: {mode}")
+
+        self.workers = workers
+        self.mode = mode
+        self.max_pending = max_pending
+        self.guild_limit = guild_limit
+
+        self._executor: Executor = None
+        self._local_executor: Executor = None
+        self._pending: OrderedDict[int, deque[_Job]] = OrderedDict()
+        self._pending_count = 0
+        self._in_flight: dict[int, int] = {}
+        self._running = 0
+
+        # Recent queue wait times in seconds
+        self._waits = deque(maxlen=512)
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def executor(self) -> Executor:
+        """The worker pool, created on first use"""
+
+        if self._executor is None:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="resolver"
+                )
+
+        return self._executor
+
+    @property
+    def local_executor(self) -> Executor:
+        """The worker pool for jobs that must stay in this process"""
+
+        if self.mode == "thread":
+            return self.executor
+
+        if self._local_executor is None:
+            self._local_executor = ThreadPoolExecutor(
+                self.workers, thread_name_prefix="resolver-local"
+            )
+
+        return self._local_executor
+
+    @property
+    def idle(self) -> bool:
+        """Returns True if a new job would start straight away. Jobs
+        whose caller gave up keep their worker until they return."""
+
+        return self._running + self._pending_count < self.workers
+
+    @property
+    def depth(self) -> int:
+        """The number of jobs waiting for a worker"""
+
+        return self._pending_count
+
+    async def submit(self, guild_id:int, func, *args, local:bool=False):
+        """Run a blocking function on the pool and return its result.
+
+        In process mode the function and its arguments must be
+        picklable, unless `local` is True. Local jobs always run on a
+        thread but still count towards the worker and guild limits.
+
+        Raises:
+            ResolverBusy: If the pool's queue is full
+        """
+
+        if self._pending_count >= self.max_pending:
+            self.rejected += 1
+            raise ResolverBusy(
+                f"{self._pending_count} resolves are already waiting"
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(guild_id, func, args, local, future)
+
+        self._pending.setdefault(guild_id, deque()).append(job)
+        self._pending_count += 1
+        self._dispatch()
+
+        return await future
+
+    def _next_job(self) -> _Job | None:
+        """Pop the next job, taking turns between guilds"""
+
+        for guild_id in list(self._pending):
+            if self._in_flight.get(guild_id, 0) >= self.guild_limit:
+                continue
+
+            jobs = self._pending[guild_id]
+            job = jobs.popleft()
+            self._pending_count -= 1
+
+            # Send the guild to the back of the line
+            if jobs:
+                self._pending.move_to_end(guild_id)
+            else:
+                del self._pending[guild_id]
+
+            return job
+
+        return None
+
+    def _dispatch(self) -> None:
+        """Start queued jobs while there are free workers"""
+
+        while self._running < self.workers:
+            job = self._next_job()
+            if job is None:
+                return
+
+            # The caller stopped waiting before the job started
+            if job.future.done():
+                continue
+
+            self._waits.append(time.perf_counter() - job.queued_at)
+            self._running += 1
+            self._in_flight[job.guild_id] = self._in_flight.get(job.guild_id, 0) + 1
+
+            work = job.future.get_loop().run_in_executor(
+                self.local_executor if job.local else self.executor,
+                job.func, *job.args
+            )
+            work.add_done_callback(
+                lambda work, job=job: self._finish(job, work)
+            )
+
+    def _finish(self, job:_Job, work:asyncio.Future) -> None:
+        """Hand a finished job's result to its caller"""
+
+        self._running -= 1
+        self._in_flight[job.guild_id] -= 1
+        if not self._in_flight[job.guild_id]:
+            del self._in_flight[job.guild_id]
+
+        self.completed += 1
+
+        if not job.future.done():
+            if work.cancelled():
+                job.future.cancel()
+            elif work.exception() is not None:
+                job.future.set_exception(work.exception())
+            else:
+                job.future.set_result(work.result())
+
+        self._dispatch()
+
+    def stats(self) -> dict:
+        """Returns the queue depth and wait time statistics"""
+
+        waits = sorted(self._waits)
+        return {
+            "mode": f"{self.mode} x{self.workers}",
+            "queue depth": self._pending_count,
+            "running": self._running,
+            "guilds waiting": len(self._pending),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg wait": f"{sum(waits) / len(waits) * 1000:.0f}ms"
+                if waits else "n/a",
+            "p95 wait": f"{waits[int(len(waits) * 0.95)] * 1000:.0f}ms"
+                if waits else "n/a",
+        }
+
+    def shutdown(self) -> None:
+        """Stop the workers and fail any queued jobs"""
+
+        for jobs in self._pending.values():
+            for job in jobs:
+                job.future.cancel()
+
+        self._pending.clear()
+        self._pending_count = 0
+
+        for executor in (self._executor, self._local_executor):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        self._executor = None
+        self._local_executor = None
@@ -0,0 +1,188 @@
+"""Where each guild's playback was up to, kept on disk.
+
+When the bot restarts or the music extension is reloaded, everything
+held in memory is lost and the song playing in each guild would have
+to start again from the beginning. Every second, the song and position
+of each playing guild is written to an SQLite table, and once more on
+a clean shutdown. When the extension loads again, the guilds are
+picked up where they were left, seeking straight to the position.
+"""
+
+import json
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+
+from .track import TrackInfo
+from constants import DATA, MUSIC_RESUME_FILENAME
+
+
+log = logging.getLogger(__name__)
+
+
+class ResumePoint:
+    """Where playback was up to in a guild"""
+
+    __slots__ = (
+        "guild_id",
+        "voice_channel_id",
+        "text_channel_id",
+        "requester_id",
+        "info",
+        "position",
+        "volume",
+        "loop",
+        "saved_at"
+    )
+
+    def __init__(
+        self,
+        guild_id:int,
+        voice_channel_id:int,
+        text_channel_id:int,
+        requester_id:int,
+        info:TrackInfo,
+        position:float,
+        *,
+        volume:float,
+        loop:bool=False,
+        saved_at:float=None
+    ):
+        self.guild_id = guild_id
+        self.voice_channel_id = voice_channel_id
+        self.text_channel_id = text_channel_id
+        self.requester_id = requester_id
+        self.info = info
+        self.position = position
+        self.volume = volume
+        self.loop = loop
+        self.saved_at = time.time() if saved_at is None else saved_at
+
+    @property
+    def age(self) -> float:
+        """Seconds since the point was saved"""
+
+        return time.time() - self.saved_at
+
+
+class ResumeStore:
+    """SQLite table of the resume point of every playing guild
+
+    Args:
+        path (str): The database file
+    """
+
+    __slots__ = ("path", "_db", "_lock", "saves", "resumed")
+
+    def __init__(self, path:str=f"{DATA}{MUSIC_RESUME_FILENAME}"):
+        self.path = path
+        self._db: sqlite3.Connection = None
+
+        # A save on a worker thread may still be running at shutdown
+        self._lock = threading.Lock()
+
+        self.saves = 0
+        self.resumed = 0
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        """The database, opened on first use"""
+
+        if self._db is None:
+            if self.path != ":memory:":
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS resume ("
+                "guild_id INTEGER PRIMARY KEY, voice_channel_id INTEGER, "
+                "text_channel_id INTEGER, requester_id INTEGER, "
+                "track TEXT NOT NULL, position REAL NOT NULL, "
+                "volume REAL NOT NULL, loop INTEGER NOT NULL, "
+                "saved_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+        return self._db
+
+    def save(self, points:list[ResumePoint]) -> None:
+        """Replace the stored points, guilds that aren't playing any
+        more are dropped. This blocks, run it in a thread."""
+
+        rows = [
+            (
+                point.guild_id,
+                point.voice_channel_id,
+                point.text_channel_id,
+                point.requester_id,
+                json.dumps(point.info.to_dict()),
+                point.position,
+                point.volume,
+                int(point.loop),
+                point.saved_at
+            )
+            for point in points
+        ]
+
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM resume")
+            self.db.executemany(
+                "INSERT INTO resume VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+        self.saves += 1
+
+    def load(self, max_age:float) -> list[ResumePoint]:
+        """Returns the stored points, leaving the table empty. Points
+        older than max_age seconds are dropped."""
+
+        points = []
+
+        with self._lock, self.db:
+            for row in self.db.execute("SELECT * FROM resume"):
+                (
+                    guild_id, voice_channel_id, text_channel_id, requester_id,
+                    track, position, volume, loop, saved_at
+                ) = row
+
+                point = ResumePoint(
+                    guild_id,
+                    voice_channel_id,
+                    text_channel_id,
+                    requester_id,
+                    TrackInfo.from_dict(json.loads(track)),
+                    position,
+                    volume=volume,
+                    loop=bool(loop),
+                    saved_at=saved_at
+                )
+
+                if point.age > max_age:
+                    log.debug("Dropping resume point of guild %s, too old", guild_id)
+                    continue
+
+                points.append(point)
+
+            self.db.execute("DELETE FROM resume")
+
+        return points
+
+    def stats(self) -> dict:
+        """Returns the store counters"""
+
+        return {
+            "saves": self.saves,
+            "guilds resumed": self.resumed,
+        }
+
+    def close(self) -> None:
+        """Close the database"""
+
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
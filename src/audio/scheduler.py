@@ -0,0 +1,382 @@
+"""Shared audio send scheduler.
+
+discord.py starts an AudioPlayer thread for every voice client that
+plays something, and each of those threads sleeps to its own 20ms
+cadence. With hundreds of guilds that is hundreds of threads competing
+for the GIL, and their wake-ups drift apart. Instead, a small fixed
+number of shard threads each run one shared 20ms tick, and on every
+tick send the next frame for each guild on that shard. The players
+stand in for discord.py's AudioPlayer, so VoiceClient's own pause,
+resume, stop and source methods keep working.
+
+Reading ffmpeg's output is not done on the shards. A read blocks until
+ffmpeg has the next frame, and one slow pipe would hold up every guild
+on the shard, so each BufferedSource still reads on its own thread and
+the shards only take frames that are already buffered.
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import discord
+from discord.enums import SpeakingState
+
+from constants import MUSIC_SEND_SHARDS, MUSIC_SEND_LATE_MS
+
+
+log = logging.getLogger(__name__)
+
+DELAY = discord.opus.Encoder.FRAME_LENGTH / 1000.0
+
+# A shard this many ticks behind starts a fresh schedule instead of
+# bursting frames to catch up
+_RESYNC_TICKS = 5
+
+
+class GuildSendStats:
+    """How late each guild's frames were sent compared to the tick"""
+
+    __slots__ = ("frames", "late", "stalls", "reconnects", "total", "max")
+
+    def __init__(self):
+        self.frames = 0
+        self.late = 0
+        self.stalls = 0
+        self.reconnects = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, lateness:float) -> None:
+        self.frames += 1
+        self.total += lateness
+        self.max = max(self.max, lateness)
+
+        if lateness * 1000 > MUSIC_SEND_LATE_MS:
+            self.late += 1
+
+    def as_dict(self) -> dict:
+        avg = self.total / self.frames * 1000 if self.frames else 0.0
+        return {
+            "frames sent": self.frames,
+            "late frames": self.late,
+            "ticks buffering": self.stalls,
+            "voice reconnects": self.reconnects,
+            "avg lateness": f"{avg:.2f}ms",
+            "max lateness": f"{self.max * 1000:.2f}ms",
+        }
+
+
+class ScheduledPlayer:
+    """Plays a source on a shard, in place of discord.py's AudioPlayer
+
+    Args:
+        source (discord.AudioSource): The audio to play
+        client (discord.VoiceClient): The voice client to send to
+        after (Callable): Called with an error or None when it ends
+        stats (GuildSendStats): Where to record lateness
+    """
+
+    __slots__ = (
+        "source",
+        "client",
+        "after",
+        "stats",
+        "_paused",
+        "_ended",
+        "_reconnecting",
+        "_finished",
+        "_error",
+        "_lock"
+    )
+
+    def __init__(self, source:discord.AudioSource, client:discord.VoiceClient, *, after=None, stats:GuildSendStats):
+        if after is not None and not callable(after):
+            raise TypeError('Expected a callable for the "after" parameter.')
+
+        self.source = source
+        self.client = client
+        self.after = after
+        self.stats = stats
+
+        self._paused = False
+        self._ended = False
+        self._reconnecting = False
+        self._finished = False
+        self._error: Exception = None
+        self._lock = threading.Lock()
+
+    def send(self, deadline:float) -> None:
+        """Send the next frame, called by the shard on each tick"""
+
+        if self._paused or self._ended:
+            return
+
+        # Nothing is read while discord.py reconnects, so playback picks
+        # up from the same frame
+        if not self.client._connected.is_set():
+            self._reconnecting = True
+            return
+
+        # The new voice session has to be told that we are speaking
+        if self._reconnecting:
+            self._reconnecting = False
+            self.stats.reconnects += 1
+            self._speak(SpeakingState.voice)
+
+        with self._lock:
+            source = self.source
+
+        try:
+            # Pause while the source refills after an underrun
+            if getattr(source, "buffering", False):
+                self.stats.stalls += 1
+                return
+
+            data = source.read()
+            if not data:
+                self.stop()
+                return
+
+            # A source can switch to PCM part way through, a mixer
+            # does when it starts a crossfade, so the encoder is only
+            # made once it is needed
+            encode = not source.is_opus()
+            if encode and not self.client.encoder:
+                self.client.encoder = discord.opus.Encoder()
+
+            self.stats.record(max(0.0, time.perf_counter() - deadline))
+            self.client.send_audio_packet(data, encode=encode)
+
+        except Exception as error:
+            self._error = error
+            self.stop()
+
+    def claim(self) -> bool:
+        """Returns True only for the first caller, who must then call
+        finish"""
+
+        with self._lock:
+            if self._finished:
+                return False
+
+            self._finished = True
+            return True
+
+    def finish(self) -> None:
+        """Call the after function and clean up the source, this runs
+        once the player has ended."""
+
+        if self.after is not None:
+            try:
+                self.after(self._error)
+            except Exception as error:
+                error.__context__ = self._error
+                log.exception("Calling the after function failed.", exc_info=error)
+        elif self._error:
+            log.exception("Exception while sending audio", exc_info=self._error)
+
+        self.source.cleanup()
+
+    def stop(self) -> None:
+        self._ended = True
+        self._paused = False
+        self._speak(SpeakingState.none)
+
+    def pause(self, *, update_speaking:bool=True) -> None:
+        self._paused = True
+        if update_speaking:
+            self._speak(SpeakingState.none)
+
+    def resume(self, *, update_speaking:bool=True) -> None:
+        self._paused = False
+        if update_speaking:
+            self._speak(SpeakingState.voice)
+
+    def is_playing(self) -> bool:
+        return not self._paused and not self._ended
+
+    def is_paused(self) -> bool:
+        return self._paused and not self._ended
+
+    def _set_source(self, source:discord.AudioSource) -> None:
+        with self._lock:
+            self.source = source
+
+    def _speak(self, speaking:SpeakingState) -> None:
+        try:
+            asyncio.run_coroutine_threadsafe(
+                self.client.ws.speak(speaking), self.client.client.loop
+            )
+        except Exception:
+            log.exception("Speaking call in player failed")
+
+
+class _Shard(threading.Thread):
+    """Sends a frame for each of its players on every tick"""
+
+    def __init__(self, index:int, finisher:ThreadPoolExecutor):
+        super().__init__(name=f"audio-send-{index}", daemon=True)
+
+        self.players: dict[int, ScheduledPlayer] = {}
+        self.finisher = finisher
+        self.ticks = 0
+        self.resyncs = 0
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+
+    def add(self, guild_id:int, player:ScheduledPlayer) -> None:
+        with self._lock:
+            old = self.players.get(guild_id)
+            self.players[guild_id] = player
+
+        # A stopped player replaced before its last tick, the new
+        # player has already said it is speaking
+        if old is not None:
+            old._ended = True
+            self.retire(guild_id, old)
+
+        self._wake.set()
+
+    def retire(self, guild_id:int, player:ScheduledPlayer) -> None:
+        """Remove an ended player and finish it off the tick"""
+
+        if not player.claim():
+            return
+
+        with self._lock:
+            if self.players.get(guild_id) is player:
+                del self.players[guild_id]
+
+        # Killing ffmpeg can take a while, keep it off the tick
+        self.finisher.submit(player.finish)
+
+    def close(self) -> None:
+        self._closed = True
+        self._wake.set()
+
+    def run(self) -> None:
+        while not self._closed:
+            if not self.players:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+
+            start = time.perf_counter()
+            tick = 0
+
+            while self.players and not self._closed:
+                deadline = start + DELAY * tick
+                self._tick(deadline)
+                tick += 1
+                self.ticks += 1
+
+                now = time.perf_counter()
+                if now - deadline > DELAY * _RESYNC_TICKS:
+                    self.resyncs += 1
+                    start, tick = now, 0
+
+                time.sleep(max(0.0, start + DELAY * tick - now))
+
+    def _tick(self, deadline:float) -> None:
+        with self._lock:
+            players = list(self.players.items())
+
+        for guild_id, player in players:
+            player.send(deadline)
+
+            if player._ended:
+                self.retire(guild_id, player)
+
+
+class SendScheduler:
+    """Plays audio for every guild from a few shared shard threads.
+
+    Args:
+        shards (int): How many send threads to run, guilds are spread
+            over them by id
+    """
+
+    __slots__ = ("shard_count", "_shards", "_finisher", "_stats")
+
+    def __init__(self, shards:int=MUSIC_SEND_SHARDS):
+        self.shard_count = max(1, shards)
+        self._shards: list[_Shard] = []
+        self._finisher: ThreadPoolExecutor = None
+        self._stats: dict[int, GuildSendStats] = {}
+
+    def _shard(self, guild_id:int) -> _Shard:
+        """Returns the shard for a guild, the threads start on first use"""
+
+        if not self._shards:
+            self._finisher = ThreadPoolExecutor(1, thread_name_prefix="audio-finish")
+            self._shards = [_Shard(i, self._finisher) for i in range(self.shard_count)]
+            for shard in self._shards:
+                shard.start()
+
+        return self._shards[guild_id % self.shard_count]
+
+    def play(self, voice:discord.VoiceClient, source:discord.AudioSource, *, after=None) -> None:
+        """Play a source on a voice client, like VoiceClient.play
+
+        Raises:
+            discord.ClientException: Already playing or not connected
+            TypeError: The source is not an AudioSource
+        """
+
+        if not voice.is_connected():
+            raise discord.ClientException("Not connected to voice.")
+
+        if voice.is_playing():
+            raise discord.ClientException("Already playing audio.")
+
+        if not isinstance(source, discord.AudioSource):
+            raise TypeError(f"source must be an AudioSource not {source.__class__.__name__}")
+
+        guild_id = voice.guild.id
+        stats = self._stats.setdefault(guild_id, GuildSendStats())
+        player = ScheduledPlayer(source, voice, after=after, stats=stats)
+
+        voice._player = player
+        player._speak(SpeakingState.voice)
+        self._shard(guild_id).add(guild_id, player)
+
+    def guild_stats(self, guild_id:int) -> dict:
+        """Returns the lateness of a guild's frames"""
+
+        return self._stats.get(guild_id, GuildSendStats()).as_dict()
+
+    def forget(self, guild_id:int) -> None:
+        """Drop a guild's statistics"""
+
+        self._stats.pop(guild_id, None)
+
+    def stats(self) -> dict:
+        """Returns the scheduler counters"""
+
+        return {
+            "shards": self.shard_count,
+            "players": sum(len(shard.players) for shard in self._shards),
+            "ticks": sum(shard.ticks for shard in self._shards),
+            "resyncs": sum(shard.resyncs for shard in self._shards),
+            "late frames": sum(stats.late for stats in self._stats.values()),
+        }
+
+    def shutdown(self) -> None:
+        """Stop every player and the shard threads"""
+
+        for shard in self._shards:
+            shard.close()
+            for guild_id, player in list(shard.players.items()):
+                player.stop()
+                shard.retire(guild_id, player)
+
+        if self._finisher is not None:
+            self._finisher.shutdown(wait=True)
+
+        self._shards = []
+        self._finisher = None
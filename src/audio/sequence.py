@@ -0,0 +1,409 @@
+"""Sequence with logarithmic positional operations.
+
+The song queue used to be a deque, where indexing, removing from the
+middle and shuffling are all linear or worse. This is an implicit
+treap: a randomly balanced binary tree ordered by position, where
+every node knows the size of its subtree. Nodes also keep a pointer to
+their parent so an item's position can be found by walking up.
+
+Items can be given a numeric weight, such as a song's duration, and
+every node also keeps the total weight of its subtree and how many of
+its items weigh nothing. This makes the total weight of the items
+before any position an O(log n) lookup.
+"""
+
+import sys
+import random
+from typing import Callable, Iterable, Iterator
+
+
+class _Node:
+    """A node of the treap"""
+
+    __slots__ = (
+        "item",
+        "priority",
+        "size",
+        "weight",
+        "total",
+        "weightless",
+        "left",
+        "right",
+        "parent"
+    )
+
+    def __init__(self, item, weight:int):
+        self.item = item
+        self.priority = random.random()
+        self.size = 1
+        self.weight = weight
+        self.total = weight
+        self.weightless = int(not weight)
+        self.left: _Node = None
+        self.right: _Node = None
+        self.parent: _Node = None
+
+
+def _size(node:_Node) -> int:
+    return node.size if node else 0
+
+def _update(node:_Node) -> _Node:
+    """Recalculate a node's subtree size and weights and fix its
+    children's parent pointers after its children have changed."""
+
+    node.size = 1
+    node.total = node.weight
+    node.weightless = int(not node.weight)
+
+    for child in (node.left, node.right):
+        if child:
+            node.size += child.size
+            node.total += child.total
+            node.weightless += child.weightless
+            child.parent = node
+
+    return node
+
+def _merge(left:_Node, right:_Node) -> _Node:
+    """Join two trees, every item of `left` comes before `right`"""
+
+    if not left:
+        return right
+    if not right:
+        return left
+
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        return _update(left)
+
+    right.left = _merge(left, right.left)
+    return _update(right)
+
+def _split(node:_Node, count:int) -> tuple[_Node, _Node]:
+    """Split a tree into its first `count` items and the rest"""
+
+    if not node:
+        return None, None
+
+    if _size(node.left) >= count:
+        left, node.left = _split(node.left, count)
+        if left:
+            left.parent = None
+        return left, _update(node)
+
+    node.right, right = _split(node.right, count - _size(node.left) - 1)
+    if right:
+        right.parent = None
+    return _update(node), right
+
+
+class IndexedSequence:
+    """A list-like sequence of unique, hashable items.
+
+    Indexing, `index()`, insertion and removal at any position, moving
+    an item, rotating and `weight_before()` are O(log n). Slicing is
+    O(log n + k) and shuffling is O(n).
+
+    Args:
+        items (Iterable): The initial items
+        weigh (Callable): Returns the weight of an item, items weigh
+            nothing if this is not given
+    """
+
+    __slots__ = ("_root", "_nodes", "weigh")
+
+    def __init__(self, items:Iterable=(), *, weigh:Callable[[object], int]=None):
+        self._root: _Node = None
+        self._nodes: dict[object, _Node] = {}
+        self.weigh = weigh
+        self._build([self._new_node(item) for item in items])
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def __bool__(self) -> bool:
+        return self._root is not None
+
+    def __contains__(self, item) -> bool:
+        return item in self._nodes
+
+    def __iter__(self) -> Iterator:
+        return self._iter_from(0)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({list(self)!r})"
+
+    def __sizeof__(self) -> int:
+        """The bytes held by the sequence's structure, not counting
+        the items themselves"""
+
+        node = sys.getsizeof(self._root) if self._root else 0
+        return object.__sizeof__(self) + sys.getsizeof(self._nodes) + node * len(self._nodes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+
+            items = self._iter_from(start)
+            return [next(items) for _ in range(max(0, stop - start))]
+
+        return self._node_at(index).item
+
+    def __delitem__(self, index:int) -> None:
+        self.pop(index)
+
+    def _normalize(self, index:int) -> int:
+        """Resolve a negative index and check that it is in range"""
+
+        length = len(self)
+        if index < 0:
+            index += length
+
+        if not 0 <= index < length:
+            raise IndexError("sequence index out of range")
+
+        return index
+
+    def _node_at(self, index:int) -> _Node:
+        """Returns the node at a position"""
+
+        index = self._normalize(index)
+        node = self._root
+
+        while True:
+            left = _size(node.left)
+            if index < left:
+                node = node.left
+            elif index == left:
+                return node
+            else:
+                index -= left + 1
+                node = node.right
+
+    def _iter_from(self, index:int) -> Iterator:
+        """In-order iteration starting at a position"""
+
+        stack = []
+        node = self._root
+
+        # Descend to the start position, keeping the nodes that
+        # still have to be visited on the stack.
+        while node:
+            left = _size(node.left)
+            if index <= left:
+                stack.append(node)
+                node = node.left
+            else:
+                index -= left + 1
+                node = node.right
+
+        while stack:
+            node = stack.pop()
+            yield node.item
+
+            node = node.right
+            while node:
+                stack.append(node)
+                node = node.left
+
+    def _set_root(self, root:_Node) -> None:
+        if root:
+            root.parent = None
+        self._root = root
+
+    def _new_node(self, item) -> _Node:
+        if item in self._nodes:
+            raise ValueError(f"{item!r} is already in the sequence")
+
+        weight = self.weigh(item) if self.weigh else 0
+        node = self._nodes[item] = _Node(item, weight)
+        return node
+
+    def _build(self, nodes:list[_Node]) -> None:
+        """Build a tree from scratch out of detached nodes in O(n).
+
+        This is the usual stack based cartesian tree construction:
+        the stack holds the right spine of the tree built so far.
+        """
+
+        spine: list[_Node] = []
+
+        for node in nodes:
+            node.right = None
+            last = None
+
+            while spine and spine[-1].priority < node.priority:
+                last = spine.pop()
+
+            node.left = last
+            if spine:
+                spine[-1].right = node
+
+            spine.append(node)
+
+        if not spine:
+            self._root = None
+            return
+
+        # Fix the sizes and parent pointers bottom up
+        order = []
+        stack = [spine[0]]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(child for child in (node.left, node.right) if child)
+
+        for node in reversed(order):
+            _update(node)
+
+        self._set_root(spine[0])
+
+    def index(self, item) -> int:
+        """Returns the position of an item
+
+        Raises:
+            ValueError: If the item is not in the sequence
+        """
+
+        try:
+            node = self._nodes[item]
+        except KeyError:
+            raise ValueError(f"{item!r} is not in the sequence") from None
+
+        index = _size(node.left)
+        while node.parent:
+            if node is node.parent.right:
+                index += _size(node.parent.left) + 1
+            node = node.parent
+
+        return index
+
+    @property
+    def total_weight(self) -> int:
+        """The total weight of every item"""
+
+        return self._root.total if self._root else 0
+
+    @property
+    def weightless(self) -> int:
+        """The number of items that weigh nothing"""
+
+        return self._root.weightless if self._root else 0
+
+    def weight_before(self, index:int) -> tuple[int, int]:
+        """Returns the total weight of the items before a position and
+        how many of them weigh nothing."""
+
+        total = weightless = 0
+        node = self._root
+
+        while node:
+            left = node.left
+            if index <= _size(left):
+                node = left
+                continue
+
+            if left:
+                total += left.total
+                weightless += left.weightless
+
+            total += node.weight
+            weightless += not node.weight
+            index -= _size(left) + 1
+            node = node.right
+
+        return total, weightless
+
+    def reweigh(self, item) -> None:
+        """Update an item's weight after it has changed
+
+        Raises:
+            KeyError: If the item is not in the sequence
+        """
+
+        node = self._nodes[item]
+        node.weight = self.weigh(item) if self.weigh else 0
+
+        while node:
+            _update(node)
+            node = node.parent
+
+    def insert(self, index:int, item) -> None:
+        """Insert an item before a position"""
+
+        index = max(0, min(len(self), index if index >= 0 else index + len(self)))
+        node = self._new_node(item)
+
+        left, right = _split(self._root, index)
+        self._set_root(_merge(_merge(left, node), right))
+
+    def append(self, item) -> None:
+        """Add an item to the end"""
+
+        self._set_root(_merge(self._root, self._new_node(item)))
+
+    def appendleft(self, item) -> None:
+        """Add an item to the start"""
+
+        self._set_root(_merge(self._new_node(item), self._root))
+
+    def pop(self, index:int=-1):
+        """Remove and return the item at a position"""
+
+        index = self._normalize(index)
+
+        left, rest = _split(self._root, index)
+        node, right = _split(rest, 1)
+        self._set_root(_merge(left, right))
+
+        del self._nodes[node.item]
+        return node.item
+
+    def popleft(self):
+        """Remove and return the first item"""
+
+        if not self._root:
+            raise IndexError("pop from an empty sequence")
+
+        return self.pop(0)
+
+    def remove(self, item) -> None:
+        """Remove an item
+
+        Raises:
+            ValueError: If the item is not in the sequence
+        """
+
+        self.pop(self.index(item))
+
+    def move(self, source:int, destination:int) -> None:
+        """Move the item at one position to another"""
+
+        item = self.pop(source)
+        self.insert(destination, item)
+
+    def rotate(self, count:int=1) -> None:
+        """Rotate the sequence `count` steps to the right, negative
+        values rotate left. This matches `collections.deque.rotate`."""
+
+        if not self._root:
+            return
+
+        count %= len(self)
+        left, right = _split(self._root, len(self) - count)
+        self._set_root(_merge(right, left))
+
+    def clear(self) -> None:
+        """Remove every item"""
+
+        self._root = None
+        self._nodes.clear()
+
+    def shuffle(self) -> None:
+        """Shuffle the items in place"""
+
+        nodes = list(self._nodes.values())
+        random.shuffle(nodes)
+        self._build(nodes)
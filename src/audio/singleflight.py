@@ -0,0 +1,79 @@
+"""Sharing one resolve between identical requests.
+
+When a link is shared, lots of people play it within a few seconds of
+each other, and before the first resolve has finished and cached the
+result every one of them would run youtube_dl on the same query. The
+first request for a key now starts the work as a task of its own and
+any request for the same key while it runs waits on that task instead.
+
+The task is shielded from the requests waiting on it, so one of them
+giving up doesn't cancel the work for the others. An error is raised
+to everyone waiting, and the key is forgotten as soon as the task
+finishes so that the next request tries again.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Hashable
+
+
+log = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Runs at most one coroutine per key at a time, sharing its
+    result with every caller for that key."""
+
+    __slots__ = ("_flights", "started", "joined", "failed")
+
+    def __init__(self):
+        self._flights: dict[Hashable, asyncio.Task] = {}
+
+        self.started = 0
+        self.joined = 0
+        self.failed = 0
+
+    def __contains__(self, key:Hashable) -> bool:
+        return key in self._flights
+
+    async def run(self, key:Hashable, func:Callable[[], Awaitable]):
+        """Returns the result of `func()`, or of the call already
+        running for the key. Cancelling the caller doesn't cancel the
+        shared call.
+
+        Raises:
+            Whatever the shared call raised
+        """
+
+        task = self._flights.get(key)
+
+        if task is None:
+            task = asyncio.get_running_loop().create_task(func())
+            self._flights[key] = task
+            task.add_done_callback(lambda task, key=key: self._landed(key, task))
+            self.started += 1
+        else:
+            log.debug("Joining the resolve already running for %s", key)
+            self.joined += 1
+
+        return await asyncio.shield(task)
+
+    def _landed(self, key:Hashable, task:asyncio.Task) -> None:
+        if self._flights.get(key) is task:
+            del self._flights[key]
+
+        # Mark the error as seen, the callers may all have gone
+        if not task.cancelled() and task.exception() is not None:
+            self.failed += 1
+
+    def stats(self) -> dict:
+        """Returns how many calls were shared"""
+
+        calls = self.started + self.joined
+        return {
+            "in flight": len(self._flights),
+            "started": self.started,
+            "joined": self.joined,
+            "shared": f"{self.joined / calls:.0%}" if calls else "n/a",
+            "failed": self.failed,
+        }
@@ -0,0 +1,576 @@
+"""Playing spotify tracks by matching them to youtube videos.
+
+Spotify doesn't hand out audio, only the title, artists, duration and
+ISRC of each track. Every track has to be found on youtube instead, and
+doing that one search at a time would take minutes for a long playlist.
+The tracks are matched in batches, with the searches of a batch running
+together. Each search returns a few candidates, which are scored here
+on how close their title and duration are to the track's, and the best
+one is kept if it scores well enough.
+
+A track only ever needs to be matched once. Matches are stored on disk
+under the track's ISRC and spotify id, the ISRC is shared by every
+release of a recording so the same song on another album or playlist
+is found without searching again.
+"""
+
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from difflib import SequenceMatcher
+from urllib.parse import urlparse
+from typing import Awaitable, Callable
+
+import httpx
+
+from .track import TrackInfo
+from exceptions import SpotifyError, YTDLError, ResolverBusy
+from constants import (
+    DATA,
+    SPOTIFY_CREDENTIALS,
+    MUSIC_SPOTIFY_MATCH_FILENAME,
+    MUSIC_SPOTIFY_MATCH_TTL,
+    MUSIC_SPOTIFY_MATCH_BATCH,
+    MUSIC_SPOTIFY_MATCH_THRESHOLD,
+    MUSIC_SPOTIFY_DURATION_TOLERANCE,
+    MUSIC_PLAYLIST_MAX_TRACKS
+)
+
+
+log = logging.getLogger(__name__)
+
+_SPOTIFY_ID = re.compile(r"^[A-Za-z0-9]{22}$")
+_SPOTIFY_KINDS = ("track", "album", "playlist")
+
+# Parts of a video title that say nothing about which song it is
+_TITLE_NOISE = re.compile(
+    r"[\(\[][^\)\]]*\b(official|video|audio|lyrics?|visuali[sz]er|hd|hq|4k|mv)\b[^\)\]]*[\)\]]"
+    r"|\s-\s.*\bremaster(ed)?\b.*$"
+    r"|\b(feat|ft)\b\.?",
+    re.IGNORECASE
+)
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+# How much each part of a candidate counts towards its score
+_TITLE_WEIGHT = 0.5
+_ARTIST_WEIGHT = 0.2
+_DURATION_WEIGHT = 0.3
+
+
+def spotify_link(query:str) -> tuple[str, str] | None:
+    """Returns the kind (track, album or playlist) and id of a spotify
+    url or uri, or None if the query is not one."""
+
+    query = query.strip()
+
+    if query.startswith("spotify:"):
+        parts = query.split(":")[1:]
+    else:
+        try:
+            url = urlparse(query)
+        except ValueError:
+            return None
+
+        if (url.hostname or "").lower() != "open.spotify.com":
+            return None
+
+        # Localised links start with a language, /intl-de/track/...
+        parts = [part for part in url.path.split("/") if part]
+        if parts and parts[0].startswith("intl-"):
+            parts = parts[1:]
+
+    if len(parts) >= 2 and parts[0] in _SPOTIFY_KINDS and _SPOTIFY_ID.match(parts[1]):
+        return parts[0], parts[1]
+
+    return None
+
+def normalize_title(text:str) -> str:
+    """Lowercase a title and strip the noise and punctuation from it"""
+
+    text = _TITLE_NOISE.sub(" ", text.lower())
+    return " ".join(_PUNCTUATION.sub(" ", text).split())
+
+
+class SpotifyTrack:
+    """What spotify says about a track"""
+
+    __slots__ = ("id", "title", "artists", "duration", "isrc")
+
+    def __init__(self, id:str, title:str, artists:tuple[str, ...], duration:float, isrc:str=None):
+        self.id = id
+        self.title = title
+        self.artists = artists
+        self.duration = duration
+        self.isrc = isrc
+
+    @classmethod
+    def from_data(cls, data:dict):
+        """Create a track from a spotify api track object"""
+
+        return cls(
+            id=data["id"],
+            title=data["name"],
+            artists=tuple(artist["name"] for artist in data.get("artists", ())),
+            duration=data.get("duration_ms", 0) / 1000,
+            isrc=data.get("external_ids", {}).get("isrc")
+        )
+
+    @property
+    def query(self) -> str:
+        """The youtube search for the track"""
+
+        return f"{', '.join(self.artists)} - {self.title}"
+
+    @property
+    def keys(self) -> list[str]:
+        """The keys the track's match is stored under, best first"""
+
+        keys = [f"spotify:{self.id}"]
+        if self.isrc:
+            keys.insert(0, f"isrc:{self.isrc.upper()}")
+
+        return keys
+
+
+def match_score(track:SpotifyTrack, candidate:dict) -> float:
+    """Returns how well a youtube search result matches a track, from
+    0 to 1. The title is compared with and without the artists, since
+    videos are often named "artist - title", and a difference in
+    duration counts against the candidate up to the tolerance."""
+
+    title = normalize_title(candidate.get("title") or "")
+    wanted = normalize_title(track.title)
+    artists = [normalize_title(artist) for artist in track.artists]
+
+    title_score = max(
+        SequenceMatcher(None, title, wanted).ratio(),
+        SequenceMatcher(None, title, " ".join((*artists, wanted))).ratio()
+    )
+
+    # Every word of the track's title is in the video's, the rest is
+    # likely the artist or a label
+    if wanted and set(wanted.split()) <= set(title.split()):
+        title_score = max(title_score, 0.9)
+
+    channel = normalize_title(candidate.get("uploader") or "")
+    artist_score = float(any(
+        artist and (artist in title or artist in channel)
+        for artist in artists
+    ))
+
+    duration = candidate.get("duration")
+    if duration and track.duration:
+        difference = abs(float(duration) - track.duration)
+        duration_score = max(0.0, 1 - difference / MUSIC_SPOTIFY_DURATION_TOLERANCE)
+    else:
+        duration_score = 0.5
+
+    return (
+        _TITLE_WEIGHT * title_score
+        + _ARTIST_WEIGHT * artist_score
+        + _DURATION_WEIGHT * duration_score
+    )
+
+
+class SpotifyClient:
+    """Looks tracks up with the spotify web api, using the client
+    credentials in the credentials file (the client id and secret, one
+    per line), read the first time they're needed."""
+
+    API = "https://api.spotify.com/v1/"
+    TOKEN_URL = "https://accounts.spotify.com/api/token"
+
+    __slots__ = ("credentials_path", "_client", "_token", "_token_expires")
+
+    def __init__(self, credentials_path:str=SPOTIFY_CREDENTIALS):
+        self.credentials_path = credentials_path
+        self._client: httpx.AsyncClient = None
+        self._token: str = None
+        self._token_expires = 0.0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The http client, created on first use"""
+
+        if self._client is None:
+            self._client = httpx.AsyncClient(base_url=self.API, timeout=10)
+
+        return self._client
+
+    async def _authorize(self) -> str:
+        """Returns an access token, fetching a new one if it expired
+
+        Raises:
+            SpotifyError: There are no credentials or they were refused
+        """
+
+        if self._token is not None and time.time() < self._token_expires:
+            return self._token
+
+        try:
+            with open(self.credentials_path, "r", encoding="utf-8") as file:
+                client_id, client_secret = file.read().split()[:2]
+        except (OSError, ValueError) as error:
+            raise SpotifyError("Spotify isn't set up on this bot!") from error
+
+        response = await self._request(
+            "POST",
+            self.TOKEN_URL,
+            data={"grant_type": "client_credentials"},
+            auth=(client_id, client_secret)
+        )
+        if response.status_code != 200:
+            raise SpotifyError("Spotify refused the bot's credentials!")
+
+        data = self._json(response)
+        self._token = data["access_token"]
+        self._token_expires = time.time() + data.get("expires_in", 3600) - 60
+        return self._token
+
+    async def _get(self, path:str, **params) -> dict:
+        """Returns the json of an api request, waiting out rate limits
+
+        Raises:
+            SpotifyError: The request failed
+        """
+
+        for _ in range(3):
+            response = await self._request(
+                "GET",
+                path,
+                params=params,
+                headers={"Authorization": f"Bearer {await self._authorize()}"}
+            )
+
+            if response.status_code == 429:
+                retry_after = float(response.headers.get("Retry-After", 1))
+                log.debug("Spotify rate limited, waiting %ss", retry_after)
+                await asyncio.sleep(retry_after)
+                continue
+
+            if response.status_code == 401:
+                self._token = None
+                continue
+
+            break
+
+        if response.status_code in (400, 404):
+            raise SpotifyError("I couldn't find that on spotify!")
+
+        if response.status_code != 200:
+            raise SpotifyError(f"Spotify returned an error ({response.status_code})")
+
+        return self._json(response)
+
+    async def _request(self, method:str, url:str, **kwargs) -> httpx.Response:
+        """Send a request, a connection failure or timeout is raised as
+        a SpotifyError so that it reaches the user"""
+
+        try:
+            return await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as error:
+            log.warning("Request to spotify failed: %r", error)
+            raise SpotifyError("I couldn't reach spotify, please try again!") from error
+
+    @staticmethod
+    def _json(response:httpx.Response) -> dict:
+        try:
+            return response.json()
+        except ValueError as error:
+            raise SpotifyError("Spotify sent back something I couldn't read!") from error
+
+    async def track(self, track_id:str) -> SpotifyTrack:
+        """Returns a track by its id"""
+
+        return SpotifyTrack.from_data(await self._get(f"tracks/{track_id}"))
+
+    async def search(self, query:str) -> SpotifyTrack:
+        """Returns the top track for a search
+
+        Raises:
+            SpotifyError: Nothing was found
+        """
+
+        data = await self._get("search", q=query, type="track", limit=1)
+        items = data["tracks"]["items"]
+
+        if not items:
+            raise SpotifyError(f"I couldn't find anything that matches `{query}` on spotify!")
+
+        return SpotifyTrack.from_data(items[0])
+
+    async def collection(self, kind:str, collection_id:str, limit:int=MUSIC_PLAYLIST_MAX_TRACKS):
+        """Async generator that lists the tracks of an album or
+        playlist a page at a time. The first value yielded is its name.
+        Local files and removed tracks are skipped."""
+
+        if kind == "playlist":
+            data = await self._get(f"playlists/{collection_id}", fields="name")
+        else:
+            data = await self._get(f"albums/{collection_id}")
+        yield data["name"]
+
+        offset = 0
+        page_size = 100 if kind == "playlist" else 50
+
+        while offset < limit:
+            page = await self._get(
+                f"{kind}s/{collection_id}/tracks",
+                limit=min(page_size, limit - offset),
+                offset=offset
+            )
+
+            items = page["items"]
+            if kind == "playlist":
+                items = [
+                    item["track"] for item in items
+                    if item.get("track") and not item.get("is_local")
+                    and item["track"].get("id")
+                ]
+            else:
+                # Album tracks come without their ISRC
+                ids = ",".join(item["id"] for item in items if item.get("id"))
+                items = (await self._get("tracks", ids=ids))["tracks"] if ids else []
+
+            if items:
+                yield [SpotifyTrack.from_data(item) for item in items if item]
+
+            offset += page_size
+            if not page.get("next"):
+                return
+
+    async def close(self) -> None:
+        """Close the http client"""
+
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class MatchCache:
+    """The youtube video each spotify track was matched to, in an
+    SQLite table keyed by ISRC and spotify id. The database is only used
+    from worker threads."""
+
+    __slots__ = ("path", "ttl", "_db", "_lock", "hits", "misses")
+
+    def __init__(
+        self,
+        path:str=f"{DATA}{MUSIC_SPOTIFY_MATCH_FILENAME}",
+        *,
+        ttl:float=MUSIC_SPOTIFY_MATCH_TTL
+    ):
+        self.path = path
+        self.ttl = ttl
+        self._db: sqlite3.Connection = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        """The database connection, opened on first use"""
+
+        if self._db is None:
+            if self.path != ":memory:":
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS matches ("
+                "key TEXT PRIMARY KEY, track TEXT NOT NULL, "
+                "score REAL NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+        return self._db
+
+    async def get_many(self, tracks:list[SpotifyTrack]) -> dict[str, TrackInfo]:
+        """Returns the matches of the tracks that have one, by spotify
+        id, in a single query"""
+
+        keys = {key for track in tracks for key in track.keys}
+        if not keys:
+            return {}
+
+        stored = await asyncio.to_thread(self._load, keys)
+
+        found = {}
+        for track in tracks:
+            record = next((stored[key] for key in track.keys if key in stored), None)
+            if record is None:
+                self.misses += 1
+                continue
+
+            found[track.id] = TrackInfo.from_record(json.loads(record))
+            self.hits += 1
+
+        return found
+
+    async def put_many(self, matches:list[tuple[SpotifyTrack, TrackInfo, float]]) -> None:
+        """Store the matches of the tracks along with their scores"""
+
+        now = time.time()
+        await asyncio.to_thread(self._store, [
+            (key, json.dumps(info.to_record()), score, now)
+            for track, info, score in matches
+            for key in track.keys
+        ])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM matches").fetchone()[0]
+
+    def close(self) -> None:
+        """Close the database connection"""
+
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _load(self, keys:set[str]) -> dict[str, str]:
+        """Returns the stored records of the keys that have one, this
+        blocks"""
+
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT key, track FROM matches WHERE key IN "
+                f"({', '.join('?' * len(keys))}) AND stored_at > ?",
+                (*keys, time.time() - self.ttl)
+            ).fetchall()
+
+        return dict(rows)
+
+    def _store(self, rows:list[tuple]) -> None:
+        """Write matches to the database, this blocks"""
+
+        with self._lock:
+            self.db.executemany("INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?)", rows)
+            self.db.commit()
+
+
+class SpotifyMatcher:
+    """Matches spotify tracks to youtube videos in batches.
+
+    Args:
+        cache (MatchCache): Where the matches are kept
+        to_info (Callable): Converts a chosen search result to a track
+        batch (int): How many tracks are searched for at once
+        threshold (float): The lowest score a match can have
+    """
+
+    __slots__ = (
+        "cache",
+        "to_info",
+        "batch",
+        "threshold",
+        "searches",
+        "matched",
+        "unmatched"
+    )
+
+    def __init__(
+        self,
+        cache:MatchCache,
+        to_info:Callable[[dict], TrackInfo],
+        *,
+        batch:int=MUSIC_SPOTIFY_MATCH_BATCH,
+        threshold:float=MUSIC_SPOTIFY_MATCH_THRESHOLD
+    ):
+        self.cache = cache
+        self.to_info = to_info
+        self.batch = batch
+        self.threshold = threshold
+
+        self.searches = 0
+        self.matched = 0
+        self.unmatched = 0
+
+    async def match(self, tracks:list[SpotifyTrack], search:Callable[[str], Awaitable[list[dict]]]):
+        """Async generator that yields each batch of tracks as pairs of
+        the track and its match, or None if nothing matched well enough.
+        Tracks that were matched before come from the cache, the rest
+        are searched for together.
+
+        Args:
+            tracks (list): The tracks, yielded in the same order
+            search (Callable): Coroutine function that returns the
+                youtube search results for a query
+
+        Raises:
+            ResolverBusy: There are too many searches waiting
+        """
+
+        for i in range(0, len(tracks), self.batch):
+            batch = tracks[i:i + self.batch]
+            found = await self.cache.get_many(batch)
+
+            # The same track twice in a batch is searched for once
+            missing = list({track.id: track for track in batch if track.id not in found}.values())
+            results = await asyncio.gather(
+                *(self._search(track, search) for track in missing),
+                return_exceptions=True
+            )
+
+            matches = []
+            for track, result in zip(missing, results):
+                if isinstance(result, ResolverBusy):
+                    raise result
+
+                if isinstance(result, BaseException):
+                    log.debug("Searching for %s failed: %s", track.query, result)
+                    continue
+
+                if result is not None:
+                    info, score = result
+                    found[track.id] = info
+                    matches.append((track, info, score))
+
+            if matches:
+                await self.cache.put_many(matches)
+
+            self.matched += len(matches)
+            self.unmatched += len(missing) - len(matches)
+
+            yield [(track, found.get(track.id)) for track in batch]
+
+    async def _search(self, track:SpotifyTrack, search) -> tuple[TrackInfo, float] | None:
+        """Returns the best search result for a track and its score, or
+        None if none of them scored well enough"""
+
+        self.searches += 1
+
+        try:
+            candidates = await search(track.query)
+        except YTDLError:
+            return None
+
+        scored = [(match_score(track, candidate), candidate) for candidate in candidates]
+        if not scored:
+            return None
+
+        score, candidate = max(scored, key=lambda pair: pair[0])
+        if score < self.threshold:
+            log.debug("Best match for %s only scored %.2f", track.query, score)
+            return None
+
+        return self.to_info(candidate), score
+
+    def stats(self) -> dict:
+        """Returns the match counters"""
+
+        lookups = self.cache.hits + self.cache.misses
+        return {
+            "searches": self.searches,
+            "matched": self.matched,
+            "unmatched": self.unmatched,
+            "cache hits": self.cache.hits,
+            "cache hit rate": f"{self.cache.hits / lookups:.1%}" if lookups else "n/a",
+        }
@@ -0,0 +1,222 @@
+"""The lifecycle of each guild's voice state.
+
+A voice state, its player task and its queue used to be created the
+first time a guild ran any music command and were then kept until the
+bot left the channel with /leave, so every guild that had ever checked
+the queue held one forever. States are now only created when playback
+starts and are kept in least recently active order. A sweep every so
+often releases states that have been idle for too long, and when there
+are more states than the cap allows, the least recently active idle
+state is released to make room. Queues are journaled, so a released
+guild picks its queue back up the next time it plays.
+
+The states only need to provide:
+
+- `busy`, True while playing, busy states are never released as idle
+- `closed`, True once the state can't be used any more
+- `close()`, a coroutine that releases the state
+- `estimated_size()`, roughly how many bytes the state holds
+"""
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+from constants import (
+    MUSIC_STATE_IDLE_TTL,
+    MUSIC_STATE_CAPACITY,
+    MUSIC_STATE_SWEEP_SECONDS
+)
+
+
+log = logging.getLogger(__name__)
+
+
+class GuildStates:
+    """The voice state of each guild, least recently active first.
+
+    Args:
+        ttl (float): Seconds a state can be idle before it's released
+        capacity (int): The most states kept at once
+        sweep_every (float): Seconds between sweeps for idle states
+    """
+
+    __slots__ = (
+        "ttl",
+        "capacity",
+        "sweep_every",
+        "_states",
+        "_active",
+        "_closing",
+        "_task",
+        "created",
+        "evicted_idle",
+        "evicted_capacity",
+        "over_capacity"
+    )
+
+    def __init__(
+        self,
+        *,
+        ttl:float=MUSIC_STATE_IDLE_TTL,
+        capacity:int=MUSIC_STATE_CAPACITY,
+        sweep_every:float=MUSIC_STATE_SWEEP_SECONDS
+    ):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.sweep_every = sweep_every
+
+        # Guild id to state, in order of when each was last active
+        self._states: OrderedDict[int, object] = OrderedDict()
+        self._active: dict[int, float] = {}
+
+        self._closing: set[asyncio.Task] = set()
+        self._task: asyncio.Task = None
+
+        self.created = 0
+        self.evicted_idle = 0
+        self.evicted_capacity = 0
+
+        # Times the cap was exceeded because every state was busy
+        self.over_capacity = 0
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, guild_id:int) -> bool:
+        return guild_id in self._states
+
+    def values(self):
+        return self._states.values()
+
+    def items(self):
+        return self._states.items()
+
+    def get(self, guild_id:int):
+        """Returns a guild's state and marks it active, None if it has
+        none or it has closed"""
+
+        state = self._states.get(guild_id)
+        if state is None:
+            return None
+
+        if state.closed:
+            self.remove(guild_id)
+            return None
+
+        self.touch(guild_id)
+        return state
+
+    def add(self, guild_id:int, state) -> None:
+        """Keep a new state, releasing the least recently active idle
+        state if there are too many"""
+
+        self._states[guild_id] = state
+        self.touch(guild_id)
+        self.created += 1
+
+        if len(self._states) > self.capacity:
+            self._evict_one(keep=guild_id)
+
+    def touch(self, guild_id:int) -> None:
+        """Mark a guild's state as active now"""
+
+        if guild_id in self._states:
+            self._states.move_to_end(guild_id)
+            self._active[guild_id] = time.monotonic()
+
+    def remove(self, guild_id:int):
+        """Stop keeping a guild's state without releasing it
+
+        Returns:
+            The state, or None if the guild had none
+        """
+
+        self._active.pop(guild_id, None)
+        return self._states.pop(guild_id, None)
+
+    def start(self) -> None:
+        """Start sweeping for idle states"""
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        """Stop the sweeps"""
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_every)
+            self.sweep()
+
+    def sweep(self) -> int:
+        """Release every state idle for longer than the ttl. Playing
+        counts as activity, so a state's idle time starts at most one
+        sweep before its playback ended.
+
+        Returns:
+            int: How many states were released
+        """
+
+        deadline = time.monotonic() - self.ttl
+        released = 0
+
+        for guild_id, state in list(self._states.items()):
+            if state.busy and not state.closed:
+                self.touch(guild_id)
+                continue
+
+            if self._active[guild_id] > deadline and not state.closed:
+                continue
+
+            log.debug("Releasing idle voice state of guild %s", guild_id)
+            self._release(guild_id)
+            self.evicted_idle += 1
+            released += 1
+
+        return released
+
+    def _evict_one(self, keep:int) -> None:
+        """Release the least recently active state that isn't busy,
+        other than the one being kept"""
+
+        for guild_id, state in self._states.items():
+            if guild_id != keep and (not state.busy or state.closed):
+                log.debug("Releasing voice state of guild %s to make room", guild_id)
+                self._release(guild_id)
+                self.evicted_capacity += 1
+                return
+
+        self.over_capacity += 1
+        log.warning("Every one of %s voice states is busy", len(self._states))
+
+    def _release(self, guild_id:int) -> None:
+        state = self.remove(guild_id)
+        if state is None or state.closed:
+            return
+
+        task = asyncio.get_running_loop().create_task(state.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def stats(self) -> dict:
+        """Returns the lifecycle counters and memory estimate"""
+
+        sizes = [state.estimated_size() for state in self._states.values()]
+        busy = sum(1 for state in self._states.values() if state.busy)
+
+        return {
+            "live": len(self._states),
+            "busy": busy,
+            "created": self.created,
+            "released idle": self.evicted_idle,
+            "released for room": self.evicted_capacity,
+            "over capacity": self.over_capacity,
+            "avg bytes": f"{sum(sizes) / len(sizes):,.0f}" if sizes else "n/a",
+            "total bytes": f"{sum(sizes):,}",
+        }
@@ -0,0 +1,189 @@
+"""One timer wheel for every guild's deadlines.
+
+Each voice state used to keep a task alive just to wait on its queue
+inside a three minute timeout, so that it could leave the channel once
+nothing had been queued for that long. An idle guild cost a task and a
+timeout handle on the event loop. Idle guilds now have no task at all,
+their deadline is an entry in a hashed timer wheel.
+
+The wheel is a ring of slots, one per tick. A timer goes in the slot
+its deadline falls on, with a count of how many more times round the
+ring to wait, so scheduling and cancelling are O(1). A single task
+advances the wheel one slot per tick and only runs while there are
+timers, deadlines are accurate to within a tick.
+"""
+
+import math
+import asyncio
+import logging
+from typing import Callable
+
+from constants import MUSIC_TIMER_TICK_SECONDS, MUSIC_TIMER_SLOTS
+
+
+log = logging.getLogger(__name__)
+
+
+class Timer:
+    """A callback waiting in the wheel, returned by schedule"""
+
+    __slots__ = ("wheel", "callback", "slot", "rounds")
+
+    def __init__(self, wheel, callback:Callable[[], None], slot:int, rounds:int):
+        self.wheel = wheel
+        self.callback = callback
+        self.slot = slot
+        self.rounds = rounds
+
+    @property
+    def active(self) -> bool:
+        """Returns True until the timer fires or is cancelled"""
+
+        return self.slot is not None
+
+    def cancel(self) -> None:
+        """Stop the timer from firing"""
+
+        self.wheel.cancel(self)
+
+
+class TimerWheel:
+    """Runs callbacks after a delay, for many timers at once.
+
+    Args:
+        tick (float): Seconds per slot, the precision of the timers
+        slots (int): The number of slots in the ring
+    """
+
+    __slots__ = (
+        "tick",
+        "_slots",
+        "_cursor",
+        "_pending",
+        "_task",
+        "scheduled",
+        "fired",
+        "cancelled",
+        "ticks"
+    )
+
+    def __init__(
+        self,
+        *,
+        tick:float=MUSIC_TIMER_TICK_SECONDS,
+        slots:int=MUSIC_TIMER_SLOTS
+    ):
+        self.tick = tick
+        self._slots: list[set[Timer]] = [set() for _ in range(slots)]
+        self._cursor = 0
+        self._pending = 0
+        self._task: asyncio.Task = None
+
+        self.scheduled = 0
+        self.fired = 0
+        self.cancelled = 0
+        self.ticks = 0
+
+    def __len__(self) -> int:
+        return self._pending
+
+    def schedule(self, delay:float, callback:Callable[[], None]) -> Timer:
+        """Call a function on the event loop after a delay
+
+        Args:
+            delay (float): Seconds to wait, rounded up to a tick
+            callback (Callable): Called with no arguments
+
+        Returns:
+            Timer: The timer, which can be cancelled
+        """
+
+        ticks = max(1, math.ceil(delay / self.tick))
+        slot = (self._cursor + ticks) % len(self._slots)
+        timer = Timer(self, callback, slot, (ticks - 1) // len(self._slots))
+
+        self._slots[slot].add(timer)
+        self._pending += 1
+        self.scheduled += 1
+
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+        return timer
+
+    def cancel(self, timer:Timer) -> None:
+        """Stop a timer from firing, nothing happens if it already has"""
+
+        if timer.slot is None:
+            return
+
+        self._slots[timer.slot].discard(timer)
+        timer.slot = None
+        self._pending -= 1
+        self.cancelled += 1
+
+    async def _run(self) -> None:
+        """Advance the wheel every tick while there are timers. Ticks
+        are kept to the clock, a late wake up catches up on the ticks
+        it missed."""
+
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time() + self.tick
+
+        try:
+            while self._pending:
+                await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+                while next_tick <= loop.time() and self._pending:
+                    self._advance()
+                    next_tick += self.tick
+        finally:
+            self._task = None
+
+    def _advance(self) -> None:
+        """Move to the next slot and fire the timers that are due"""
+
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        self.ticks += 1
+
+        slot = self._slots[self._cursor]
+        due = [timer for timer in slot if not timer.rounds]
+
+        for timer in slot:
+            timer.rounds -= 1
+
+        for timer in due:
+            slot.discard(timer)
+            timer.slot = None
+            self._pending -= 1
+            self.fired += 1
+
+            try:
+                timer.callback()
+            except Exception:
+                log.exception("Timer callback failed")
+
+    def stats(self) -> dict:
+        """Returns the wheel counters"""
+
+        return {
+            "pending": self._pending,
+            "scheduled": self.scheduled,
+            "fired": self.fired,
+            "cancelled": self.cancelled,
+            "ticks": self.ticks,
+        }
+
+    def close(self) -> None:
+        """Drop every timer without firing it"""
+
+        for slot in self._slots:
+            for timer in slot:
+                timer.slot = None
+            slot.clear()
+
+        self._pending = 0
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,63 @@
+"""How long each stage of starting playback takes.
+
+Between someone running /play and hearing the song, the bot has to
+acknowledge the interaction, connect to the voice channel, resolve the
+query and start the audio. The recent durations of each stage are kept
+so that the stats can show where the time to first audio goes.
+"""
+
+import time
+from collections import deque
+from typing import Awaitable
+
+
+class StageTimings:
+    """The recent durations of each stage, in the order the stages
+    were first recorded.
+
+    Args:
+        samples (int): How many recent durations are kept per stage
+    """
+
+    __slots__ = ("samples", "_stages")
+
+    def __init__(self, samples:int=200):
+        self.samples = samples
+        self._stages: dict[str, deque[float]] = {}
+
+    def record(self, stage:str, seconds:float) -> None:
+        """Add a duration to a stage"""
+
+        durations = self._stages.get(stage)
+        if durations is None:
+            durations = self._stages[stage] = deque(maxlen=self.samples)
+
+        durations.append(seconds)
+
+    def since(self, stage:str, started:float) -> None:
+        """Record the time since a `time.perf_counter()` reading"""
+
+        self.record(stage, time.perf_counter() - started)
+
+    async def measure(self, stage:str, awaitable:Awaitable):
+        """Await something and record how long it took, nothing is
+        recorded if it raises"""
+
+        started = time.perf_counter()
+        result = await awaitable
+        self.since(stage, started)
+        return result
+
+    def stats(self) -> dict:
+        """Returns the average and p95 of each stage"""
+
+        stats = {}
+        for stage, durations in self._stages.items():
+            ordered = sorted(durations)
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            stats[stage] = (
+                f"avg {sum(ordered) / len(ordered) * 1000:.0f}ms, "
+                f"p95 {p95 * 1000:.0f}ms"
+            )
+
+        return stats
@@ -0,0 +1,177 @@
+"""Compact metadata record for a track.
+
+A youtube_dl info dict carries every format, thumbnail and subtitle
+of a video, which adds up to tens of KB per queued song. Only the few
+fields used by the embeds and the player are kept.
+"""
+
+import sys
+import time
+
+from .cache import stream_url_expiry, youtube_video_id
+from constants import MUSIC_CACHE_STREAM_TTL
+
+
+def format_duration(seconds:int) -> str:
+    """Format a number of seconds as `m:ss` or `h:mm:ss`"""
+
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+
+    if hours:
+        return f"{hours}:{minutes:02}:{seconds:02}"
+
+    return f"{minutes}:{seconds:02}"
+
+
+def parse_duration(text:str) -> float:
+    """Parse seconds, `m:ss` or `h:mm:ss` into a number of seconds
+
+    Raises:
+        ValueError: If the text isn't a duration
+    """
+
+    parts = text.strip().split(":")
+    if len(parts) > 3:
+        raise ValueError(f"Invalid duration: {text}")
+
+    seconds = 0.0
+    for part in parts:
+        value = float(part)
+        if value < 0:
+            raise ValueError(f"Invalid duration: {text}")
+
+        seconds = seconds * 60 + value
+
+    return seconds
+
+
+class TrackInfo:
+    """The metadata of a track"""
+
+    __slots__ = (
+        "title",
+        "url",
+        "uploader",
+        "uploader_url",
+        "duration",
+        "thumbnail",
+        "codec",
+        "stream_url",
+        "stream_expires"
+    )
+
+    def __init__(
+        self,
+        title:str,
+        url:str,
+        *,
+        uploader:str=None,
+        uploader_url:str=None,
+        duration:int=0,
+        thumbnail:str=None,
+        codec:str=None,
+        stream_url:str=None,
+        stream_expires:float=0.0
+    ):
+        self.title = title
+        self.url = url
+        self.uploader = uploader
+        self.uploader_url = uploader_url
+        self.duration = duration
+        self.thumbnail = thumbnail
+        self.codec = codec
+        self.stream_url = stream_url
+        self.stream_expires = stream_expires
+
+    @classmethod
+    def from_data(cls, data:dict, stream_ttl:float=MUSIC_CACHE_STREAM_TTL):
+        """Create a track from a youtube_dl info dict, the dict can be
+        discarded afterwards."""
+
+        stream_url = data.get("url")
+        return cls(
+            title=data.get("title"),
+            url=data.get("webpage_url"),
+            uploader=data.get("uploader"),
+            uploader_url=data.get("uploader_url"),
+            duration=int(data.get("duration") or 0),
+            thumbnail=data.get("thumbnail"),
+            codec=data.get("acodec"),
+            stream_url=stream_url,
+            stream_expires=stream_url_expiry(stream_url, stream_ttl, time.time())
+        )
+
+    def __sizeof__(self) -> int:
+        """The bytes held by the track, including its strings"""
+
+        return object.__sizeof__(self) + sum(
+            sys.getsizeof(getattr(self, field)) for field in self.__slots__
+        )
+
+    def to_dict(self) -> dict:
+        """Returns the fields of the track, for storing it"""
+
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data:dict):
+        """Create a track from the fields returned by to_dict"""
+
+        return cls(**data)
+
+    def to_record(self) -> list:
+        """Returns the fields needed to show and replay the track, as a
+        short list. The stream url expires, so it is left out."""
+
+        return [
+            self.title,
+            self.url,
+            self.uploader,
+            self.uploader_url,
+            self.duration,
+            self.thumbnail,
+            self.codec
+        ]
+
+    @classmethod
+    def from_record(cls, record:list):
+        """Create a track from the list returned by to_record"""
+
+        title, url, uploader, uploader_url, duration, thumbnail, codec = record
+        return cls(
+            title,
+            url,
+            uploader=uploader,
+            uploader_url=uploader_url,
+            duration=duration,
+            thumbnail=thumbnail,
+            codec=codec
+        )
+
+    @property
+    def parsed_duration(self) -> str:
+        """The duration of the track as a readable string"""
+
+        if not self.duration:
+            return "Livestream"
+
+        return format_duration(self.duration)
+
+    @property
+    def video_id(self) -> str | None:
+        """The youtube video id of the track, if it is a youtube video"""
+
+        return youtube_video_id(self.url or "")
+
+    @property
+    def stream_expired(self) -> bool:
+        """Returns True if the stream url can no longer be used"""
+
+        return time.time() >= self.stream_expires
+
+    @property
+    def is_placeholder(self) -> bool:
+        """Returns True if the track has not been fully resolved yet"""
+
+        return self.stream_url is None
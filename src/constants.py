@@ -60,3 +60,164 @@ MUSIC_ADDEDPLAYSOON = (
     "I've added the song to the queue!"
     "\nIt will play in a moment."
 )
+MUSIC_VOLUMESET = "I've set the volume to **{}%** :thumbsup:"
+MUSIC_GAPLESSSET = "Songs will now play back to back :thumbsup:"
+MUSIC_CROSSFADESET = "Songs will now crossfade over **{}** seconds :thumbsup:"
+MUSIC_SEEKED = "I've skipped to **{}** :thumbsup:"
+MUSIC_RESUMING = "Picking up **{}** from **{}** :thumbsup:"
+MUSIC_CANTSEEK = "I can't seek in a livestream!"
+MUSIC_INVALIDPOSITION = (
+    "That isn't a valid position!"
+    "\nUse seconds, `m:ss` or `h:mm:ss`."
+)
+MUSIC_UNPLAYABLE = "I couldn't play **{}**, skipping it!"
+MUSIC_RESOLVERBUSY = (
+    "I'm looking up a lot of songs right now!"
+    "\nPlease try again in a moment."
+)
+MUSIC_RESOLVERTIMEOUT = (
+    "Looking up that song took too long!"
+    "\nPlease try again in a moment."
+)
+MUSIC_SPOTIFYNOMATCH = "I couldn't find **{}** on youtube!"
+MUSIC_DOWNLOADFAILED = (
+    "Youtube wouldn't give me that song!"
+    "\nIt may be private, age restricted or unavailable."
+)
+MUSIC_CONNECTFAILED = (
+    "I couldn't join your voice channel!"
+    "\nPlease try again in a moment."
+)
+
+# Music metadata cache
+DATA = 'data/'
+MUSIC_CACHE_FILENAME = 'music_cache.sqlite3'
+MUSIC_CACHE_MEMORY_ENTRIES = 512
+MUSIC_CACHE_METADATA_TTL = 60 * 60 * 24 * 7  # 7 days
+MUSIC_CACHE_STREAM_TTL = 60 * 60 * 5  # 5 hours, youtube urls expire in ~6
+
+# Music resolver pool, mode is either "thread" or "process"
+MUSIC_RESOLVER_MODE = 'thread'
+MUSIC_RESOLVER_WORKERS = 4
+MUSIC_RESOLVER_MAX_PENDING = 256
+MUSIC_RESOLVER_GUILD_LIMIT = 2
+
+# Resolver backends in the order they're tried, with their timeout in
+# seconds. The first runs on the resolver pool above, the others on a
+# pool of their own with this many workers, so that a hedge never waits
+# behind the resolve it is racing. A backend slower than its p95 is
+# hedged with the next one, no sooner than the min delay, and until it
+# has enough samples after the default delay.
+MUSIC_RESOLVER_BACKENDS = {
+    "youtube": {"timeout": 20},
+    "youtube-lite": {"workers": 2, "timeout": 15},
+}
+MUSIC_HEDGE_MIN_DELAY = 0.5
+MUSIC_HEDGE_DEFAULT_DELAY = 3
+MUSIC_HEDGE_MIN_SAMPLES = 20
+
+# Spotify tracks are played by matching them to youtube videos. The
+# client id and secret go in this file, one per line. Tracks are
+# searched for this many at a time, on a pool of as many workers that
+# a single guild can fill. The results are scored from 0 to 1 on their
+# title and on their duration, which counts for nothing once it is off
+# by the tolerance in seconds. The best result is kept if it scores at
+# least the threshold, and remembered for the max age.
+SPOTIFY_CREDENTIALS = 'SPOTIFY'
+MUSIC_SPOTIFY_MATCH_FILENAME = 'spotify_matches.sqlite3'
+MUSIC_SPOTIFY_MATCH_BATCH = 10
+MUSIC_SPOTIFY_CANDIDATES = 5
+MUSIC_SPOTIFY_DURATION_TOLERANCE = 15
+MUSIC_SPOTIFY_MATCH_THRESHOLD = 0.6
+MUSIC_SPOTIFY_MATCH_TTL = 60 * 60 * 24 * 30  # 30 days
+
+# Number of upcoming songs to prepare while the current one plays
+MUSIC_PREFETCH_DEPTH = 3
+
+# Seconds before a song ends to start ffmpeg for the next one, 0 disables
+MUSIC_WARM_SECONDS = 5
+
+# FFmpeg
+FFMPEG_EXECUTABLE = 'bin/ffmpeg.exe'
+FFMPEG_RECONNECT_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+
+# Playlists are enqueued in batches and resolved in the background
+MUSIC_PLAYLIST_MAX_TRACKS = 1000
+MUSIC_PLAYLIST_ENQUEUE_BATCH = 50
+MUSIC_PLAYLIST_RESOLVE_BATCH = 10
+
+# Volume of a guild that hasn't set one. Opus streams are only passed
+# through untouched, shared between guilds and saved to the audio cache
+# at 1.0, at any other volume ffmpeg applies it and re-encodes them
+MUSIC_DEFAULT_VOLUME = 0.5
+
+# Volume changes ramp over this long, either "linear" or "exponential"
+MUSIC_VOLUME_RAMP = 'exponential'
+MUSIC_VOLUME_RAMP_SECONDS = 0.1
+
+# On-disk cache of played tracks, policy is either "lru" or "lfu"
+MUSIC_AUDIO_CACHE_ENABLED = True
+MUSIC_AUDIO_CACHE_DIRNAME = 'audio/'
+MUSIC_AUDIO_CACHE_BYTES = 2 * 1024 ** 3  # 2 GiB
+MUSIC_AUDIO_CACHE_POLICY = 'lru'
+MUSIC_AUDIO_CACHE_JOBS = 2
+MUSIC_AUDIO_CACHE_MAX_DURATION = 60 * 15  # longer tracks aren't saved
+
+# Tracks kept warm for the youtube-shortcuts commands, by command name
+MUSIC_PINNED_TRACKS = {
+    "rickroll": "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "iamabadperson": "https://www.youtube.com/watch?v=aAkMkVFwAoo",
+    "2010youtube": "https://www.youtube.com/watch?v=Cm0qaXi9THA",
+    "deadmeme": "https://www.youtube.com/watch?v=LBnUc09MK2w",
+}
+MUSIC_PINNED_REFRESH = 60 * 60 * 4  # 4 hours, within the stream url TTL
+
+# Guilds starting the same track within this many seconds share one ffmpeg
+MUSIC_BROADCAST_ENABLED = True
+MUSIC_BROADCAST_BUFFER_SECONDS = 10
+
+# Audio is sent from this many shared threads, frames sent more than
+# MUSIC_SEND_LATE_MS after their tick are counted as late
+MUSIC_SEND_SHARDS = 2
+MUSIC_SEND_LATE_MS = 5
+
+# Audio is read ahead of the sender, playback starts once the prebuffer
+# is full and pauses to refill if the buffer ever runs dry
+MUSIC_BUFFER_SECONDS = 5
+MUSIC_PREBUFFER_SECONDS = 3
+MUSIC_BUFFER_REFILL_SECONDS = 1
+
+# How songs lead into each other by default, "gapless" or "crossfade"
+MUSIC_TRANSITION = 'gapless'
+MUSIC_CROSSFADE_SECONDS = 3
+
+# How far the rewind and forward buttons seek, and how much audio a
+# seek buffers before it is heard
+MUSIC_SEEK_STEP_SECONDS = 10
+MUSIC_SEEK_PREBUFFER_SECONDS = 0.5
+
+# Where each guild's playback is up to is saved this often, so that it
+# can pick up from there after a restart. Points older than the max age
+# are dropped.
+MUSIC_RESUME_FILENAME = 'music_resume.sqlite3'
+MUSIC_RESUME_SAVE_SECONDS = 1
+MUSIC_RESUME_MAX_AGE = 60 * 10  # 10 minutes
+
+# Every change to a queue is journaled in this directory, the whole
+# queue is snapshotted after at least this many changes
+MUSIC_QUEUE_JOURNAL_DIRNAME = 'queues/'
+MUSIC_QUEUE_SNAPSHOT_EVERY = 256
+
+# Voice states idle for longer than this are released, checked every
+# sweep. At most this many are kept, the least recently active idle
+# state is released to make room.
+MUSIC_STATE_IDLE_TTL = 60 * 10  # 10 minutes
+MUSIC_STATE_SWEEP_SECONDS = 60
+MUSIC_STATE_CAPACITY = 1000
+
+# The bot leaves a voice channel after this long with nothing to play.
+# Idle deadlines are kept in a timer wheel of this many slots, each
+# one tick long.
+MUSIC_IDLE_DISCONNECT_SECONDS = 60 * 3  # 3 minutes
+MUSIC_TIMER_TICK_SECONDS = 1
+MUSIC_TIMER_SLOTS = 512
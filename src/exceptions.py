@@ -9,3 +9,12 @@ class VoiceError(Exception):
 
 class YTDLError(Exception):
     """An error occured while fetching data from YouTube"""
+
+class ResolverBusy(Exception):
+    """Too many queries are already waiting to be resolved"""
+
+class ResolverTimeout(Exception):
+    """A resolver backend took too long to resolve a query"""
+
+class SpotifyError(Exception):
+    """An error occured while fetching data from Spotify"""
@@ -1,12 +1,13 @@
 """Extension for music commands"""
 
+import sys
+import time
 import asyncio
 import logging
 import functools
 import itertools
-import random
 import math
-from async_timeout import timeout
+from collections import deque
 from enum import Enum, auto
 from abc import ABC, abstractmethod
 
@@ -20,11 +21,56 @@ import youtube_dl
 
 from ui import (
     AddedTrackEmbed,
+    PlaylistAddedEmbed,
     TrackAddedView,
+    MusicControlView,
     NowPlayingEmbed,
-    MusicQueueEmbed
+    MusicQueueEmbed,
+    MusicStatsEmbed,
+    time_until_played
+)
+from audio import (
+    MetadataCache,
+    ResolverPool,
+    Prefetcher,
+    FFmpegFactory,
+    OpusSource,
+    GainTransformer,
+    TrackInfo,
+    IndexedSequence,
+    AudioCache,
+    PinnedRegistry,
+    BroadcastManager,
+    SendScheduler,
+    Mixer,
+    ResumePoint,
+    ResumeStore,
+    QueueJournal,
+    GuildStates,
+    TimerWheel,
+    Timer,
+    SingleFlight,
+    Backend,
+    ResolverRegistry,
+    SpotifyClient,
+    SpotifyMatcher,
+    MatchCache,
+    spotify_link,
+    StageTimings,
+    format_duration,
+    parse_duration,
+    canonical_query
+)
+from audio.cache import youtube_playlist_id
+from audio.journal import PUT, GET, REMOVE, MOVE, ROTATE, SET
+from utils import is_bot_owner
+from exceptions import (
+    VoiceError,
+    YTDLError,
+    ResolverBusy,
+    ResolverTimeout,
+    SpotifyError
 )
-from exceptions import VoiceError, YTDLError
 from constants import (
     MUSIC_CANTLEAVEVC,
     MUSIC_USERNOTINVC,
@@ -42,6 +88,38 @@ from constants import (
     MUSIC_LOOPING,
     MUSIC_NOTLOOPING,
     MUSIC_ADDEDPLAYSOON,
+    MUSIC_RESOLVERBUSY,
+    MUSIC_RESOLVERTIMEOUT,
+    MUSIC_SPOTIFYNOMATCH,
+    MUSIC_DOWNLOADFAILED,
+    MUSIC_CONNECTFAILED,
+    MUSIC_UNPLAYABLE,
+    MUSIC_VOLUMESET,
+    MUSIC_GAPLESSSET,
+    MUSIC_CROSSFADESET,
+    MUSIC_SEEKED,
+    MUSIC_RESUMING,
+    MUSIC_CANTSEEK,
+    MUSIC_INVALIDPOSITION,
+    MUSIC_DEFAULT_VOLUME,
+    MUSIC_WARM_SECONDS,
+    MUSIC_PLAYLIST_MAX_TRACKS,
+    MUSIC_PLAYLIST_ENQUEUE_BATCH,
+    MUSIC_PLAYLIST_RESOLVE_BATCH,
+    MUSIC_AUDIO_CACHE_ENABLED,
+    MUSIC_AUDIO_CACHE_MAX_DURATION,
+    MUSIC_PINNED_TRACKS,
+    MUSIC_BROADCAST_ENABLED,
+    MUSIC_BUFFER_REFILL_SECONDS,
+    MUSIC_TRANSITION,
+    MUSIC_CROSSFADE_SECONDS,
+    MUSIC_SEEK_PREBUFFER_SECONDS,
+    MUSIC_RESUME_SAVE_SECONDS,
+    MUSIC_RESUME_MAX_AGE,
+    MUSIC_IDLE_DISCONNECT_SECONDS,
+    MUSIC_RESOLVER_BACKENDS,
+    MUSIC_SPOTIFY_CANDIDATES,
+    MUSIC_SPOTIFY_MATCH_BATCH,
     INVALID_PAGE_NUMBER
 )
 from . import BaseCog
@@ -52,25 +130,33 @@ youtube_dl.utils.bug_reports_message = lambda: ''
 
 log = logging.getLogger(__name__)
 
+# Why a query couldn't be played, each is told to the user
+RESOLVE_ERRORS = (
+    YTDLError,
+    SpotifyError,
+    ResolverBusy,
+    ResolverTimeout,
+    youtube_dl.utils.DownloadError
+)
+
 
 class Sources(Enum):
     Youtube = auto()  # not following name convensions here because the
     Spotify = auto()  # variable names are show on the user interface
 
 
-class Source(ABC):
-    """Represents a source for audio content"""
+class Transitions(Enum):
+    Gapless = auto()
+    Crossfade = auto()
 
-    requester: discord.User
-    channel: discord.TextChannel
-    data: dict
 
-    uploader: str
-    uploader_url: str
-    upload_date: str
-    thumbnail: str
-    title: str
-    description: str
+class SeekModes(Enum):
+    Fast = auto()
+    Precise = auto()
+
+
+class Source(ABC):
+    """Represents a source for audio content"""
 
     @classmethod
     @abstractmethod
@@ -78,89 +164,514 @@ class Source(ABC):
         pass
 
 
-class YTDLSource(Source, discord.PCMVolumeTransformer):
+class YTDLSource(Source, GainTransformer):
     """Represents a youtube source for audio content"""
 
     __slots__ = ()
 
-    YTDL_OPTIONS = {"default_search": "auto"}
+    YTDL_OPTIONS = {
+        "default_search": "auto",
+        "format": "bestaudio[acodec=opus]/bestaudio/best"
+    }
     FFMPEG_OPTIONS = {"options": "-vn"}
     ytdl = youtube_dl.YoutubeDL(YTDL_OPTIONS)
+    ytdl_flat = youtube_dl.YoutubeDL({**YTDL_OPTIONS, "extract_flat": "in_playlist"})
+
+    # Skips downloading the DASH manifest, which is quicker and still
+    # finds an audio format, used to hedge slow resolves
+    ytdl_lite = youtube_dl.YoutubeDL({**YTDL_OPTIONS, "youtube_include_dash_manifest": False})
+
+    cache = MetadataCache()
+    resolver = ResolverPool()
+
+    # Searches for spotify matches run a whole batch at once, which the
+    # resolver pool's per-guild limit would hold to two
+    searcher = ResolverPool(
+        MUSIC_SPOTIFY_MATCH_BATCH, guild_limit=MUSIC_SPOTIFY_MATCH_BATCH
+    )
+    backends = ResolverRegistry(
+        definitive=(YTDLError, ResolverBusy, youtube_dl.utils.DownloadError)
+    )
+    flights = SingleFlight()
+    factory = FFmpegFactory(FFMPEG_OPTIONS)
+    audio_cache = AudioCache() if MUSIC_AUDIO_CACHE_ENABLED else None
+    broadcasts = BroadcastManager(factory) if MUSIC_BROADCAST_ENABLED else None
 
-    def __init__(self, inter: Inter, ffmpeg_source: discord.FFmpegPCMAudio, *, data: dict, volume:float=0.5):
+    def __init__(self, song, ffmpeg_source: discord.FFmpegPCMAudio, *, volume:float=MUSIC_DEFAULT_VOLUME):
         super().__init__(ffmpeg_source, volume)
 
-        self.requester: discord.User = inter.user
-        self.channel: discord.TextChannel = inter.channel
-        self.data = data
-
-        log.debug(data)
-
-        # shorthands for audio data
-        self.uploader = data.get('uploader')
-        self.uploader_url = data.get('uploader_url')
-        self.upload_date = data.get('upload_date')
-        self.title = data.get('title')
-        self.thumbnail = data.get('thumbnail')
-        self.description = data.get('description')
-        self.duration = int(data.get('duration'))
-        self.tags = data.get('tags')
-        self.url = data.get('webpage_url')
-        self.views = data.get('view_count')
-        self.likes = data.get('like_count')
-        self.dislikes = data.get('dislike_count')
-        self.stream_url = data.get('url')
+        self.song: Song = song
+
+    @classmethod
+    async def create(
+        cls,
+        song,
+        volume:float=MUSIC_DEFAULT_VOLUME,
+        *,
+        start:float=0.0,
+        precise:bool=False,
+        prebuffer:float=None
+    ):
+        """Create the audio source for a song, this spawns ffmpeg so
+        only call it right before the song is played.
+
+        Songs in the audio cache are played from their local file.
+        Other songs played from the start are saved to it from the
+        frames being played, as long as ffmpeg doesn't apply the volume.
+        At full volume, guilds starting the same track together share
+        one ffmpeg process through a broadcast. Opus streams are played
+        through an OpusSource, which skips decoding them in the bot,
+        anything else is decoded to PCM.
+
+        A start position seeks the input. Copied Opus packets can only
+        start on a packet boundary, set precise to have ffmpeg encode
+        them again so that playback starts exactly at the position.
+        """
+
+        log.debug("Creating audio source for %s", song.info.title)
+
+        info = song.info
+        local = await cls.audio_cache.path(info.video_id) if cls.audio_cache else None
+        location = local or info.stream_url
+        transcode = not local and info.codec != "opus"
+
+        tee = None
+        if (
+            cls.audio_cache is not None and not local and not start
+            and 0 < info.duration <= MUSIC_AUDIO_CACHE_MAX_DURATION
+        ):
+            tee = functools.partial(cls.audio_cache.tee, info.video_id, info.duration)
+
+        if (
+            cls.broadcasts is not None and not start and volume == 1.0
+            and info.duration and info.video_id
+        ):
+            return OpusSource(
+                song,
+                cls.broadcasts.subscribe(
+                    song.guild_id, info.video_id, location, transcode=transcode, tee=tee
+                ),
+                location,
+                transcode=transcode
+            )
+
+        if not transcode:
+            return OpusSource(
+                song,
+                cls.factory.opus(
+                    song.guild_id,
+                    location,
+                    volume=volume,
+                    start=start,
+                    transcode=precise,
+                    prebuffer=prebuffer,
+                    tee=tee if volume == 1.0 else None
+                ),
+                location,
+                start=start,
+                volume=volume,
+                transcode=precise
+            )
+
+        # The volume of PCM is applied after the frames are read
+        return cls(
+            song,
+            cls.factory.pcm(
+                song.guild_id, location, start=start, prebuffer=prebuffer, tee=tee
+            ),
+            volume=volume
+        )
+
+    @classmethod
+    def is_cached(cls, song) -> bool:
+        """Returns True if the song's audio is in the audio cache"""
+
+        return cls.is_track_cached(song.info)
 
+    @classmethod
+    async def warm(cls, url:str) -> TrackInfo:
+        """Resolve a url with a fresh stream url and save its audio to
+        the audio cache, used to keep pinned tracks ready to play."""
+
+        # Guild id 0 queues the work apart from every real guild
+        data = await cls.resolve(0, url, refresh=True)
+        info = TrackInfo.from_data(data, cls.cache.stream_ttl)
+
+        if cls.audio_cache is not None:
+            await cls.audio_cache.store(info.video_id, info.stream_url, info.codec)
+
+        return info
+
+    @classmethod
+    def is_track_cached(cls, info:TrackInfo) -> bool:
+        """Returns True if a track's audio is in the audio cache"""
+
+        return cls.audio_cache is not None and info.video_id in cls.audio_cache
 
     @classmethod
     async def from_query(cls, inter:Inter, query:str, async_loop:asyncio.BaseEventLoop):
-        """Create a youtube source from a search query"""
+        """Create a song from a youtube search query"""
 
         log.debug("from youtube query")
 
-        data = await async_loop.run_in_executor(None, lambda: cls.ytdl.extract_info(query, download=False))
+        data = await cls.resolve(inter.guild.id, query)
+        return Song(inter, TrackInfo.from_data(data, cls.cache.stream_ttl))
+
+    @classmethod
+    async def resolve(cls, guild_id:int, query:str, *, refresh:bool=False) -> dict:
+        """Returns the info dict for a query, from the cache if
+        possible, otherwise from the resolver pool. Set refresh to
+        skip the cache and store a fresh result. Identical queries
+        resolving at the same time share one resolve."""
+
+        key = canonical_query(query)
+        data = None if refresh else await cls.cache.get(key)
+
+        # The metadata may be cached while the stream url has expired,
+        # the webpage url skips the search when re-resolving.
+        if data is None or "url" not in data:
+            lookup = (data or {}).get("webpage_url") or query
+            data = await cls.flights.run(
+                key, functools.partial(cls._resolve_fresh, guild_id, key, lookup)
+            )
+
+        return data
+
+    @classmethod
+    async def _resolve_fresh(cls, guild_id:int, key:str, lookup:str) -> dict:
+        """Resolve a query with the resolver backends and cache the
+        result"""
+
+        data = await cls.backends.resolve(guild_id, lookup)
+        await cls.cache.put(key, data)
+        return data
+
+    @classmethod
+    def extract_lite(cls, query:str) -> dict:
+        """Run extract without the DASH manifest, for the lite backend"""
+
+        return cls.extract(query, lite=True)
+
+    @classmethod
+    def extract(cls, query:str, lite:bool=False) -> dict:
+        """Run youtube_dl on a query, this blocks so it should be run
+        on the resolver pool.
+
+        Args:
+            query (str): The search query or url
+            lite (bool): Skip the DASH manifest
+
+        Raises:
+            YTDLError: If the query returned nothing
+        """
+
+        ytdl = cls.ytdl_lite if lite else cls.ytdl
+        data = ytdl.extract_info(query, download=False)
+
+        if data and "entries" in data:
+            data = next(iter(data["entries"]), None)
+
+        if not data:
+            raise YTDLError(f"Couldn't find anything that matches `{query}`")
+
+        return data
+
+    @classmethod
+    async def playlist(cls, inter:Inter, url:str):
+        """Async generator that lists a playlist in batches of songs.
+
+        The songs are placeholders built from the flat listing, they
+        are fully resolved when prepared. The first value yielded is
+        the title of the playlist.
+        """
+
+        log.debug("listing playlist %s", url)
+
+        guild_id = inter.guild.id
+        title, entries = await cls.resolver.submit(
+            guild_id, cls.open_playlist, url, local=True
+        )
+        yield title
+
+        remaining = MUSIC_PLAYLIST_MAX_TRACKS
+        while remaining > 0:
+            batch = await cls.resolver.submit(
+                guild_id, cls.next_entries, entries,
+                min(remaining, MUSIC_PLAYLIST_ENQUEUE_BATCH),
+                local=True
+            )
+            if not batch:
+                return
+
+            remaining -= len(batch)
+            yield [Song(inter, cls.flat_entry_info(entry)) for entry in batch]
+
+    @classmethod
+    def open_playlist(cls, url:str) -> tuple[str, itertools.islice]:
+        """Fetch the first page of a playlist, the rest of the entries
+        are fetched lazily as the returned iterator is consumed.
+
+        Raises:
+            YTDLError: If the url is not a playlist
+        """
+
+        data = cls.ytdl_flat.extract_info(url, download=False, process=False)
+
+        if not data or "entries" not in data:
+            raise YTDLError(f"Couldn't find a playlist at `{url}`")
+
+        return data.get("title"), iter(data["entries"])
+
+    @classmethod
+    async def search(cls, guild_id:int, query:str) -> list[dict]:
+        """Returns the flat entries of the top youtube search results
+        for a query"""
+
+        return await cls.searcher.submit(
+            guild_id, cls.search_entries, query, MUSIC_SPOTIFY_CANDIDATES, local=True
+        )
+
+    @classmethod
+    def search_entries(cls, query:str, count:int) -> list[dict]:
+        """Search youtube without resolving the results, this blocks so
+        it should be run on the resolver pool.
+
+        Raises:
+            YTDLError: If the search returned nothing
+        """
+
+        data = cls.ytdl_flat.extract_info(f"ytsearch{count}:{query}", download=False)
+        entries = [entry for entry in (data or {}).get("entries") or () if entry]
+
+        if not entries:
+            raise YTDLError(f"Couldn't find anything that matches `{query}`")
+
+        return entries
+
+    @staticmethod
+    def next_entries(entries, count:int) -> list[dict]:
+        """Take the next entries from a playlist iterator, this may
+        fetch another page so it should be run on the resolver pool."""
+
+        return [
+            entry for entry in itertools.islice(entries, count)
+            if entry
+        ]
+
+    @staticmethod
+    def flat_entry_info(entry:dict) -> TrackInfo:
+        """Convert a flat playlist entry into a placeholder track"""
+
+        url = entry.get("url")
+        if entry.get("ie_key") == "Youtube" and entry.get("id"):
+            url = f"https://www.youtube.com/watch?v={entry['id']}"
+
+        return TrackInfo(
+            title=entry.get("title") or url,
+            url=url,
+            uploader=entry.get("uploader"),
+            duration=int(entry.get("duration") or 0)
+        )
+
 
-        if "entries" in data:
-            data = data["entries"][0]
+YTDLSource.backends.register(Backend(
+    "youtube",
+    YTDLSource.resolver,
+    YTDLSource.extract,
+    timeout=MUSIC_RESOLVER_BACKENDS["youtube"]["timeout"]
+))
+YTDLSource.backends.register(Backend(
+    "youtube-lite",
+    ResolverPool(MUSIC_RESOLVER_BACKENDS["youtube-lite"]["workers"]),
+    YTDLSource.extract_lite,
+    timeout=MUSIC_RESOLVER_BACKENDS["youtube-lite"]["timeout"]
+))
 
-        filename = cls.ytdl.prepare_filename(data)
-        return cls(inter, discord.FFmpegPCMAudio(filename, **cls.FFMPEG_OPTIONS, executable="bin/ffmpeg.exe"), data=data)
 
+class SpotifySource(Source):
+    """Represents a spotify source for audio content. Spotify tracks
+    are matched to youtube videos, which are played in their place."""
+
+    __slots__ = ()
 
-class SpotifySource(Source, discord.PCMVolumeTransformer):
-    """Represents a spotiy source for audio content"""
+    client = SpotifyClient()
+    matcher = SpotifyMatcher(MatchCache(), YTDLSource.flat_entry_info)
 
     @classmethod
     async def from_query(cls, inter:Inter, search:str, async_loop:asyncio.BaseEventLoop):
-        """Create a spotify source from a search query"""
-        pass
+        """Create a song from a spotify track url or search query
+
+        Raises:
+            SpotifyError: If nothing was found or it had no match
+        """
+
+        log.debug("from spotify query")
+
+        link = spotify_link(search)
+        if link is not None:
+            track = await cls.client.track(link[1])
+        else:
+            track = await cls.client.search(search)
+
+        search = functools.partial(YTDLSource.search, inter.guild.id)
+        async for batch in cls.matcher.match([track], search):
+            _, info = batch[0]
+
+        if info is None:
+            raise SpotifyError(MUSIC_SPOTIFYNOMATCH.format(track.title))
+
+        return Song(inter, info)
+
+    @classmethod
+    async def collection(cls, inter:Inter, kind:str, collection_id:str):
+        """Async generator that lists an album or playlist in batches
+        of songs, matching each batch as it goes. Tracks without a match
+        are left out. The first value yielded is the title.
+        """
+
+        log.debug("listing spotify %s %s", kind, collection_id)
+
+        pages = cls.client.collection(kind, collection_id)
+        yield await anext(pages)
+
+        search = functools.partial(YTDLSource.search, inter.guild.id)
+        async for page in pages:
+            async for batch in cls.matcher.match(page, search):
+                yield [Song(inter, info) for _, info in batch if info is not None]
 
 
 class Song:
-    """A class to represent a song"""
+    """A class to represent a song. Only the track's metadata is held
+    here, the audio source is created when the song is played."""
 
-    __slots__ = ('source', 'requester')
+    __slots__ = ('requester', 'channel', 'info')
 
-    def __init__(self, source: YTDLSource):
+    def __init__(self, inter:Inter, info:TrackInfo):
 
         log.debug("Creating Song instance")
 
-        self.source = source
-        self.requester = source.requester
+        self.requester: discord.User = inter.user
+        self.channel: discord.TextChannel = inter.channel
+        self.info = info
+
+    @classmethod
+    def restore(cls, requester:discord.Member, channel:discord.TextChannel, info:TrackInfo):
+        """Recreate a song that was playing before a restart"""
+
+        song = cls.__new__(cls)
+        song.requester = requester
+        song.channel = channel
+        song.info = info
+        return song
+
+    @property
+    def guild_id(self) -> int:
+        """The id of the guild the song was requested in"""
+
+        return self.channel.guild.id
+
+    async def prepare(self) -> bool:
+        """Make sure the song is ready to be played, re-resolving the
+        stream url if it has expired. Songs in the audio cache don't
+        need a stream url, their file is checked instead.
+
+        Returns:
+            bool: True if there was any work to do
+        """
+
+        if not self.info.stream_expired:
+            return False
+
+        audio_cache = YTDLSource.audio_cache
+        if (
+            audio_cache is not None
+            and not self.info.is_placeholder
+            and await audio_cache.verify(self.info.video_id)
+        ):
+            return False
+
+        log.debug("Refreshing expired stream url for %s", self.info.title)
+
+        data = await YTDLSource.resolve(self.guild_id, self.info.url)
+        self.info = TrackInfo.from_data(data, YTDLSource.cache.stream_ttl)
+        return True
 
 
 class SongQueue(asyncio.Queue):
-    """Queue that holds songs"""
+    """Queue that holds songs. Listeners are called with no arguments
+    whenever the contents or the order of the queue changes.
 
-    def __getitem__(self, item):
-        if isinstance(item, slice):
-            return list(itertools.islice(
-                self._queue,
-                item.start,
-                item.stop,
-                item.step
-            ))
+    The songs are kept in an IndexedSequence, so positional lookups
+    and changes are O(log n) instead of scanning a deque.
+
+    Given a journal, every change is written to it so that the queue
+    can be rebuilt after a restart.
+    """
+
+    def __init__(self, maxsize:int=0, *, journal=None):
+        self._listeners = []
+        self._journal = journal
+        super().__init__(maxsize)
+
+    def add_listener(self, listener) -> None:
+        """Register a function to be called when the queue changes"""
+
+        self._listeners.append(listener)
+
+    def _changed(self) -> None:
+        for listener in self._listeners:
+            listener()
+
+    @staticmethod
+    def _record(song:Song) -> list:
+        """Returns the song as it is journaled"""
+
+        return [song.requester.id, song.channel.id, *song.info.to_record()]
+
+    def _journal_op(self, *operation) -> None:
+        """Journal a change, snapshotting the queue instead every so
+        often so that the journal stays short"""
+
+        if self._journal is None:
+            return
+
+        if self._journal.due(len(self._queue)):
+            self.journal_snapshot()
+        else:
+            self._journal.append(*operation)
+
+    def journal_snapshot(self) -> None:
+        """Write the whole queue to the journal"""
+
+        if self._journal is not None:
+            self._journal.snapshot([self._record(song) for song in self._queue])
 
+    def restore(self, songs:list[Song]) -> None:
+        """Put songs read back from the journal, without journaling
+        them again"""
+
+        journal, self._journal = self._journal, None
+        try:
+            for song in songs:
+                self.put_nowait(song)
+        finally:
+            self._journal = journal
+
+    def _init(self, maxsize):
+        self._queue = IndexedSequence(weigh=lambda song: song.info.duration)
+
+    def _put(self, item):
+        super()._put(item)
+        self._journal_op(PUT, self._record(item))
+        self._changed()
+
+    def _get(self):
+        item = super()._get()
+        self._journal_op(GET)
+        self._changed()
+        return item
+
+    def __getitem__(self, item):
         return self._queue[item]
 
     def __iter__(self):  # pylint: disable=non-iterator-returned
@@ -169,6 +680,9 @@ class SongQueue(asyncio.Queue):
     def __len__(self) -> int:
         return self.qsize()
 
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + sys.getsizeof(self._queue)
+
     def index(self, song:Song) -> int:
         """Returns the index of a song in the queue"""
 
@@ -177,25 +691,66 @@ class SongQueue(asyncio.Queue):
     def __contains__(self, song:Song) -> bool:
         return song in self._queue
 
+    @property
+    def total_duration(self) -> int:
+        """The total duration of the queue in seconds, livestreams and
+        songs of unknown length count as zero"""
+
+        return self._queue.total_weight
+
+    @property
+    def livestreams(self) -> int:
+        """The number of songs in the queue without a known length"""
+
+        return self._queue.weightless
+
+    def duration_before(self, index: int) -> tuple[int, int]:
+        """Returns the total duration of the songs before a position,
+        and how many of them are livestreams or of unknown length"""
+
+        return self._queue.weight_before(index)
+
+    def update_duration(self, song:Song) -> None:
+        """Update the duration index after a song's metadata changed"""
+
+        if song in self._queue:
+            self._queue.reweigh(song)
+            self._journal_op(SET, self._queue.index(song), self._record(song))
+
     def rotate(self, index: int) -> None:
         """Rotates a song to the top of the queue"""
 
         self._queue.rotate(index)
+        self._journal_op(ROTATE, index)
+        self._changed()
+
+    def move(self, source: int, destination: int) -> None:
+        """Moves a song to another position in the queue"""
+
+        self._queue.move(source, destination)
+        self._journal_op(MOVE, source, destination)
+        self._changed()
 
     def clear(self) -> None:
         """Clears the queue"""
 
         self._queue.clear()
+        self.journal_snapshot()
+        self._changed()
 
     def shuffle(self) -> None:
         """Shuffles the queue"""
 
-        random.shuffle(self._queue)
+        self._queue.shuffle()
+        self.journal_snapshot()
+        self._changed()
 
     def remove(self, index: int) -> None:
         """Removes a song from the queue"""
 
         del self._queue[index]
+        self._journal_op(REMOVE, index)
+        self._changed()
 
 
 class VoiceState:
@@ -204,37 +759,199 @@ class VoiceState:
 
     __slots__ = (
         "bot",
-        "inter",
+        "guild",
         "current",
-        "voice",
+        "_voice",
+        "_idle_timer",
+        "_closed",
         "next",
         "queue",
+        "rehydrated",
         "_loop",
         "_volume",
         "skip_votes",
-        "audio_player"
+        "audio_player",
+        "prefetcher",
+        "_warm",
+        "_mixer",
+        "_handoff",
+        "transition",
+        "crossfade",
+        "gap_times",
+        "seek_times",
+        "_seeked",
+        "_resume_at",
+        "_first_audio"
     )
 
-    def __init__(self, bot, inter:Inter):
+    # Audio for every guild is sent from a few shared threads instead
+    # of one discord.py AudioPlayer thread per guild
+    sender = SendScheduler()
+
+    # Every guild's queue is journaled to disk and read back when the
+    # guild is next used after a restart
+    journal = QueueJournal()
+
+    # The idle deadline of every guild, idle guilds have no task
+    timers = TimerWheel()
+
+    # How long each stage of /play takes, up to the song being heard
+    play_timings = StageTimings()
+
+    def __init__(self, bot, guild:discord.Guild):
 
         log.debug("Creating VoiceState instance")
 
         self.bot = bot
-        self.inter = inter
+        self.guild = guild
 
         self.current: Song = None
-        self.voice: VoiceClient = None
+        self._voice: VoiceClient = None
         self.next = asyncio.Event()
-        self.queue = SongQueue()
+        self.queue = SongQueue(journal=self.journal.guild(guild.id))
 
         self._loop = False
-        self._volume = 0.5  # min: 0.01, max: 1.00
+        self._volume = MUSIC_DEFAULT_VOLUME  # min: 0.01, max: 1.00
         self.skip_votes = set()
 
-        self.audio_player = bot.loop.create_task(self.audio_player_task())
+        # Prepare upcoming songs while the current one plays
+        self.prefetcher = Prefetcher(self.queue, self.prepare_song)
+        self.queue.add_listener(self.prefetcher.refresh)
+
+        # Songs are played through a mixer, which is handed the next
+        # song's audio source shortly before the current song ends so
+        # that it is buffered and can follow on without a gap. If the
+        # queue changes first, the warm song is cancelled.
+        self._mixer: Mixer = None
+        self._warm: Song = None
+
+        # Set when the mixer has moved on to the warm song by itself
+        self._handoff: Song = None
+        self.queue.add_listener(self._check_warm)
+
+        # How songs lead into each other
+        self.transition = Transitions[MUSIC_TRANSITION.capitalize()]
+        self.crossfade = MUSIC_CROSSFADE_SECONDS
+
+        # Silence between one song ending and the next being heard
+        self.gap_times = deque(maxlen=100)
+
+        # Time between a seek and its audio being heard. Seeking also
+        # wakes the wait for the end of the song, which moved.
+        self.seek_times = deque(maxlen=100)
+        self._seeked = asyncio.Event()
+
+        # Set to play the current song from a position instead of
+        # taking the next song from the queue, when resuming
+        self._resume_at: float = None
+
+        # A song queued while nothing was playing, and when it was
+        # requested, to time how long it took to start
+        self._first_audio: tuple[Song, float] = None
+
+        # The queue as it was journaled, the guild waits for it before
+        # being used
+        self.rehydrated = bot.loop.create_task(self.rehydrate())
+
+        # The player task only runs while there is something to play,
+        # it is started when songs are queued. Once it runs dry, the
+        # bot leaves the channel if nothing is queued before the idle
+        # timer fires.
+        self.audio_player: asyncio.Task = None
+        self._idle_timer: Timer = None
+        self._closed = False
+        self.queue.add_listener(self.wake)
 
     def __del__(self) -> None:
-        self.audio_player.cancel()
+        if self.audio_player is not None:
+            self.audio_player.cancel()
+        self.prefetcher.cancel_all()
+
+    @property
+    def voice(self) -> VoiceClient:
+        """The voice client, None if not in a voice channel"""
+
+        return self._voice
+
+    @voice.setter
+    def voice(self, value:VoiceClient):
+        self._voice = value
+
+        if value is None:
+            self._cancel_idle()
+        else:
+            self.wake()
+
+    @property
+    def running(self) -> bool:
+        """Returns True while the player task is running"""
+
+        return self.audio_player is not None and not self.audio_player.done()
+
+    def wake(self) -> None:
+        """Start the player task if there is something to play,
+        otherwise start counting down to leaving the channel. Called
+        whenever the queue changes or the bot joins a channel."""
+
+        if self._closed or self.voice is None or self.running:
+            return
+
+        if len(self.queue) or self._resume_at is not None:
+            self._cancel_idle()
+            self.audio_player = self.bot.loop.create_task(self.audio_player_task())
+
+        elif self._idle_timer is None:
+            self._idle_timer = self.timers.schedule(
+                MUSIC_IDLE_DISCONNECT_SECONDS, self._idle_timeout
+            )
+
+    def _cancel_idle(self) -> None:
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+    def _idle_timeout(self) -> None:
+        """Nothing was queued in time, leave the channel"""
+
+        self._idle_timer = None
+        if self.running or self.voice is None:
+            return
+
+        log.debug("Guild %s has been idle, leaving", self.guild.id)
+        self.bot.loop.create_task(self.stop())
+
+    async def rehydrate(self) -> None:
+        """Rebuild the queue from the journal. Songs requested in
+        channels that no longer exist are left out."""
+
+        try:
+            records = await self.journal.load(self.guild.id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("Couldn't rehydrate the queue of guild %s", self.guild.id)
+            return
+
+        songs = []
+        for requester_id, channel_id, *track in records:
+            channel = self.guild.get_channel(channel_id)
+            if channel is None:
+                continue
+
+            songs.append(Song.restore(
+                self.guild.get_member(requester_id) or self.guild.me,
+                channel,
+                TrackInfo.from_record(track)
+            ))
+
+        if songs:
+            log.debug("Rehydrated %s songs for guild %s", len(songs), self.guild.id)
+
+        self.queue.restore(songs)
+
+        # The journal's positions must match the queue's
+        if len(songs) != len(records):
+            self.queue.journal_snapshot()
 
     @property
     def loop(self) -> bool:
@@ -248,6 +965,10 @@ class VoiceState:
 
         self._loop = value
 
+        # A looping song is followed by itself, not the warm song
+        if value:
+            self._cancel_warm()
+
     @property
     def volume(self) -> float:
         """Returns the volume"""
@@ -255,10 +976,35 @@ class VoiceState:
         return self._volume
 
     @volume.setter
-    async def volume(self, value: float) -> None:
-        """Sets the volume"""
+    def volume(self, value: float) -> None:
+        """Sets the volume, applying it to the playing song"""
 
         self._volume = value
+        source = self._mixer.playing if self._mixer else None
+
+        # The warm song's source was opened at the old volume
+        self._cancel_warm()
+
+        # Opus packets can't be scaled, ffmpeg is restarted with the
+        # new volume where the song is up to instead.
+        if isinstance(source, OpusSource):
+            if source.volume != value:
+                position = source.position
+                source.replace(
+                    YTDLSource.factory.opus(
+                        self.current.guild_id,
+                        source.location,
+                        volume=value,
+                        start=position,
+                        transcode=source.transcode,
+                        prebuffer=MUSIC_BUFFER_REFILL_SECONDS
+                    ),
+                    start=position,
+                    volume=value
+                )
+
+        elif isinstance(source, YTDLSource):
+            source.volume = value
 
     @property
     def is_playing(self) -> bool:
@@ -267,46 +1013,391 @@ class VoiceState:
         return self.voice and self.current
 
     async def audio_player_task(self) -> None:
-        """Background task that handles the audio player"""
+        """Plays songs until there are none left, started by wake"""
 
         log.debug("Starting audio player task")
 
-        while True:
+        while self.voice is not None:
             self.next.clear()
 
-            if not self.loop:
-                self.current = None
-                try:
+            resume_at, self._resume_at = self._resume_at, None
+            handoff, self._handoff = self._handoff, None
+            if handoff is not None:
+                self._continue_with(handoff)
+            else:
+                # Only a song that follows straight on from the last
+                # has a gap worth measuring
+                previous = self._mixer if self.loop or len(self.queue) else None
+
+                if not self.loop and resume_at is None:
+                    self.current = None
+                    try:
+                        self.current = self.queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+
+                if not await self._play(previous, start=resume_at or 0.0):
+                    continue
+
+            self.prefetcher.refresh()
+            self._check_first_audio()
+
+            if resume_at is None:
+                await self.current.channel.send(
+                    embed=NowPlayingEmbed(self.current),
+                    view=MusicControlView(self)
+                )
+            else:
+                await self.current.channel.send(MUSIC_RESUMING.format(
+                    self.current.info.title, format_duration(resume_at)
+                ))
 
-                    # Get the next song or timeout in 3 minutes
-                    async with timeout(180):
-                        log.debug("fetching song from queue")
-                        self.current = await self.queue.get()
+            await self._wait_for_end()
 
-                except asyncio.TimeoutError:
-                    log.debug("TimeoutError: no song in queue")
-                    self.bot.loop.create_task(self.stop())
-                    return
+            # discord.py retries a dropped connection by itself, and
+            # the sender holds its place meanwhile. If the voice client
+            # has given up, the bot was disconnected for good.
+            if self.voice is not None and not self.voice.is_connected():
+                log.debug("Voice client disconnected, stopping")
+                self.loop = False
+                await self.stop()
+                continue
+
+        # Once this task is done, start the idle countdown or play
+        # anything queued meanwhile
+        log.debug("Audio player task ran out of songs")
+        self.bot.loop.call_soon(self.wake)
+
+    async def _play(self, previous:Mixer=None, *, start:float=0.0) -> bool:
+        """Start playing the current song through a new mixer
+
+        Args:
+            previous (Mixer): The mixer of the song before, if this
+                one follows straight on from it
+            start (float): Where in the song to start, in seconds
+
+        Returns:
+            bool: False if the song couldn't be played
+        """
 
-            log.debug("Playing song %s", self.current.source.title)
+        log.debug("Playing song %s", self.current.info.title)
 
-            self.current.source.volume = self._volume
-            self.voice.play(self.current.source, after=self.play_next_song)
-            await self.current.source.channel.send(
-                embed=NowPlayingEmbed(self.current),
-                # view=MusicControlView(self)
+        # Usually a no-op, the prefetcher has already done this
+        try:
+            await self.current.prepare()
+        except (YTDLError, youtube_dl.utils.DownloadError, ResolverTimeout) as error:
+            log.warning("Skipping unplayable song %s: %s", self.current.info.title, error)
+            await self.current.channel.send(
+                MUSIC_UNPLAYABLE.format(self.current.info.title)
             )
-            await self.next.wait()
+            self.loop = False
+            return False
+
+        # Anything warmed up was queued on the old mixer
+        self._warm = None
+
+        self._mixer = Mixer(
+            await YTDLSource.create(
+                self.current,
+                self._volume,
+                start=start,
+                prebuffer=MUSIC_SEEK_PREBUFFER_SECONDS if start else None
+            ),
+            self.current.info.duration,
+            start=start,
+            on_switch=self._on_switch,
+            on_gap=self.gap_times.append,
+            on_seek=self.seek_times.append,
+            previous=previous
+        )
+        self.sender.play(self.voice, self._mixer, after=self.play_next_song)
+        return True
+
+    def time_first_audio(self, song:Song, requested_at:float) -> None:
+        """Time how long a song takes to start playing from when it was
+        requested, if there is nothing ahead of it"""
+
+        if not self.is_playing and len(self.queue) and self.queue[0] is song:
+            self._first_audio = (song, requested_at)
+
+    def _check_first_audio(self) -> None:
+        """Record the time to first audio once the timed song starts,
+        or stop waiting for it if it has left the queue"""
+
+        if self._first_audio is None:
+            return
+
+        song, requested_at = self._first_audio
+        if song is self.current:
+            self.play_timings.since("first audio", requested_at)
+            self._first_audio = None
+        elif song not in self.queue:
+            self._first_audio = None
+
+    def _continue_with(self, song:Song) -> None:
+        """The mixer has already started the song, take it out of the
+        queue and carry on"""
+
+        log.debug("Mixer moved on to %s", song.info.title)
+
+        self.current = song
+        if song in self.queue:
+            self.queue.remove(self.queue.index(song))
+
+    def _on_switch(self, song:Song) -> None:
+        """Called from the player thread when the mixer starts a song"""
+
+        self.bot.loop.call_soon_threadsafe(self._handed_off, song)
+
+    def _handed_off(self, song:Song) -> None:
+        self._handoff = song
+        self._warm = None
+        self.next.set()
+
+    async def _wait_for_end(self) -> None:
+        """Wait for the current song to end, queueing the next song's
+        audio source on the mixer shortly before it does. The time
+        left is worked out again whenever the song is seeked. The next
+        song of a livestream is only opened once the stream ends."""
+
+        ended = asyncio.ensure_future(self.next.wait())
+
+        try:
+            while True:
+                lead = None
+                if MUSIC_WARM_SECONDS and self._warm is None and self.current.info.duration:
+                    lead = self._time_left - MUSIC_WARM_SECONDS - self._fade_seconds
+                    if lead <= 0:
+                        await self._open_warm()
+                        lead = None
+
+                self._seeked.clear()
+                seeked = asyncio.ensure_future(self._seeked.wait())
+
+                done, _ = await asyncio.wait(
+                    (ended, seeked),
+                    timeout=lead,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                seeked.cancel()
+
+                if ended in done:
+                    return
+        finally:
+            ended.cancel()
+
+    @property
+    def _time_left(self) -> float:
+        """Seconds until the current song ends"""
+
+        return self.current.info.duration - self.position
+
+    @property
+    def _fade_seconds(self) -> float:
+        return self.crossfade if self.transition is Transitions.Crossfade else 0
+
+    async def _open_warm(self) -> None:
+        """Open the audio source for the song at the top of the queue
+        and queue it on the mixer"""
+
+        if self.loop or not len(self.queue) or self._warm is not None or self._mixer is None:
+            return
+
+        song = self.queue[0]
+        if song.info.stream_expired and not YTDLSource.is_cached(song):
+            return
+
+        log.debug("Warming up audio source for %s", song.info.title)
+        self._warm = song
+        mixer = self._mixer
+        source = await YTDLSource.create(song, self._volume)
+
+        # Cancelled, or the song ended, while the source was created
+        if self._warm is not song or self._mixer is not mixer:
+            source.cleanup()
+            return
+
+        mixer.queue(
+            source,
+            song,
+            duration=song.info.duration,
+            crossfade=self._fade_seconds
+        )
+
+    def _check_warm(self) -> None:
+        """Cancel the warm song if it is no longer next in the queue"""
+
+        if self._warm is not None and (not len(self.queue) or self.queue[0] is not self._warm):
+            self._cancel_warm()
+
+    def _cancel_warm(self) -> None:
+        """Drop the warm song's audio source, unless the mixer has
+        already started fading into it"""
+
+        if self._warm is not None and self._mixer is not None and self._mixer.cancel_next():
+            self._warm = None
+
+    async def prepare_song(self, song:Song) -> bool:
+        """Prepare a queued song, keeping the queue's duration index
+        up to date if its metadata changed
+
+        Returns:
+            bool: True if there was any work to do
+        """
+
+        if not await song.prepare():
+            return False
+
+        self.queue.update_duration(song)
+        return True
+
+    async def seek(self, position:float, *, precise:bool=False) -> float:
+        """Carry on playing the current song from a position. The song
+        keeps playing until the audio at the new position is ready.
+
+        Args:
+            position (float): Where to seek to in seconds, it is kept
+                within the song
+            precise (bool): Start exactly at the position rather than
+                the nearest packet before it, which costs an encode
+
+        Returns:
+            float: The position that was seeked to
+
+        Raises:
+            VoiceError: Nothing is playing or it's a livestream
+        """
+
+        if not self.is_playing or self._mixer is None:
+            raise VoiceError(MUSIC_NOTPLAYING)
+
+        song = self.current
+        if not song.info.duration:
+            raise VoiceError(MUSIC_CANTSEEK)
+
+        position = min(max(0.0, position), max(0.0, song.info.duration - 1))
+
+        # The stream url may have expired since the song started
+        await song.prepare()
+        if song is not self.current:
+            raise VoiceError(MUSIC_NOTPLAYING)
+
+        log.debug("Seeking %s to %.2fs", song.info.title, position)
+
+        source = await YTDLSource.create(
+            song,
+            self._volume,
+            start=position,
+            precise=precise,
+            prebuffer=MUSIC_SEEK_PREBUFFER_SECONDS
+        )
+
+        if song is not self.current or self._mixer is None:
+            source.cleanup()
+            raise VoiceError(MUSIC_NOTPLAYING)
+
+        self._mixer.seek(source, position)
+
+        # The warm song may now be needed sooner or much later
+        self._cancel_warm()
+        self._seeked.set()
+        return position
+
+    @property
+    def position(self) -> float:
+        """How far into the current song playback is, in seconds"""
+
+        return self._mixer.position if self._mixer else 0.0
+
+    def resume(self, song:Song, position:float) -> None:
+        """Play a song from a position before anything in the queue,
+        to pick up where playback was left before a restart"""
+
+        self.current = song
+        self._resume_at = position
+        self.wake()
+
+    def resume_point(self) -> ResumePoint | None:
+        """Returns where playback is up to, or None if nothing is
+        playing"""
+
+        if not self.is_playing or self._mixer is None or not self.voice.is_connected():
+            return None
+
+        song = self.current
+        return ResumePoint(
+            self.guild.id,
+            self.voice.channel.id,
+            song.channel.id,
+            song.requester.id,
+            song.info,
+            self.position if song.info.duration else 0.0,
+            volume=self._volume,
+            loop=self.loop
+        )
+
+    def suspend(self) -> None:
+        """Stop the player task but stay in the voice channel, for
+        when the extension is reloaded and will resume playback. The
+        send scheduler is shut down separately."""
+
+        if self.audio_player is not None:
+            self.audio_player.cancel()
+
+        self._cancel_idle()
+        self.prefetcher.cancel_all()
+        self._cancel_warm()
+
+    @property
+    def busy(self) -> bool:
+        """Returns True while a song is playing"""
+
+        return bool(self.is_playing)
+
+    @property
+    def closed(self) -> bool:
+        """Returns True once the state has been released"""
+
+        return self._closed
+
+    async def close(self) -> None:
+        """Release the state, leaving the voice channel. The queue is
+        kept in the journal for the next time the guild plays."""
+
+        log.debug("Closing voice state of guild %s", self.guild.id)
+
+        self._closed = True
+        self.suspend()
+        self.sender.forget(self.guild.id)
+
+        if self.voice:
+            await self.voice.disconnect()
+            self.voice = None
+
+    def estimated_size(self) -> int:
+        """Roughly how many bytes the state holds, not counting the
+        bot, guild and voice client it shares"""
+
+        size = sys.getsizeof(self) + sys.getsizeof(self.queue)
+        for song in itertools.chain((self.current,), self.queue):
+            if song is not None:
+                size += sys.getsizeof(song) + sys.getsizeof(song.info)
+
+        return size + sum(
+            sys.getsizeof(collection)
+            for collection in (self.gap_times, self.seek_times, self.skip_votes)
+        )
 
     def play_next_song(self, error=None):
         """Plays the next song in the queue"""
 
         log.debug("Playing next song")
 
+        # Raising here would leave the player waiting on next forever
         if error:
-            raise VoiceError(str(error))
+            log.error("Playback of %s stopped: %s", self.current and self.current.info.title, error)
 
-        self.next.set()
+        self.bot.loop.call_soon_threadsafe(self.next.set)
 
     def skip_to_song(self, index: int):
         """Skips to a song in the queue"""
@@ -327,12 +1418,42 @@ class VoiceState:
         self.skip_votes.clear()
 
         if self.is_playing:
-            self.voice.stop()
+            # Cut straight to the warm song if the mixer has it
+            if self._mixer is None or not self._mixer.skip():
+                self.voice.stop()
+
+    def stats(self) -> dict:
+        """Returns the playback statistics of this voice state"""
+
+        gaps, seeks = self.gap_times, self.seek_times
+        return {
+            "queued": len(self.queue),
+            "live ffmpeg processes": YTDLSource.factory.live(
+                self.guild.id
+            ),
+            "transition": self.transition.name.lower() if not self._fade_seconds
+                else f"crossfade {self.crossfade}s",
+            "avg gap": f"{sum(gaps) / len(gaps) * 1000:.0f}ms"
+                if gaps else "n/a",
+            "max gap": f"{max(gaps) * 1000:.0f}ms"
+                if gaps else "n/a",
+            "avg seek": f"{sum(seeks) / len(seeks) * 1000:.0f}ms"
+                if seeks else "n/a",
+            "max seek": f"{max(seeks) * 1000:.0f}ms"
+                if seeks else "n/a",
+            **{
+                f"prefetch {key}": value
+                for key, value in self.prefetcher.stats().items()
+            },
+            **self.sender.guild_stats(self.guild.id)
+        }
 
     async def stop(self):
         """Stops the player and clears the queue"""
 
         self.queue.clear()
+        self.prefetcher.cancel_all()
+        self._cancel_warm()
 
         if self.voice:
             await self.voice.disconnect()
@@ -343,23 +1464,183 @@ class MusicCog(BaseCog, name="New Music"):
     """Cog for music commands"""
 
     __slots__ = ()
-    voice_states = {}
+    voice_states = GuildStates()
+    pinned = PinnedRegistry(
+        MUSIC_PINNED_TRACKS, YTDLSource.warm, YTDLSource.is_track_cached
+    )
+    resume_store = ResumeStore()
+    connects = SingleFlight()
+    _resume_tasks: list[asyncio.Task] = []
+
+    async def cog_load(self) -> None:
+        """Start keeping the pinned tracks warm, pick up playback
+        where it was left and start saving where it is up to"""
+
+        self.pinned.start()
+        self.voice_states.start()
+        self._resume_tasks = [
+            self.bot.loop.create_task(self._resume_guilds()),
+            self.bot.loop.create_task(self._save_resume_points())
+        ]
 
     async def cog_unload(self) -> None:
-        """Cleanup when cog is unloaded"""
+        """Cleanup when cog is unloaded. Guilds that are playing stay
+        in their voice channel, for the reloaded cog to carry on."""
+
+        self.pinned.stop()
+        self.voice_states.stop()
+
+        for task in self._resume_tasks:
+            task.cancel()
+
+        # A save or load still running in a thread finishes first, so
+        # it can't overwrite the final save or race the close
+        await asyncio.gather(*self._resume_tasks, return_exceptions=True)
+
+        # Save exactly where each guild is up to
+        points = self._resume_points()
+        await asyncio.to_thread(self.resume_store.save, points)
+        self.resume_store.close()
+
+        # The other guilds are released, their queues are journaled for
+        # the reloaded cog
+        resuming = {point.guild_id for point in points}
+        closing = []
+        for guild_id, state in self.voice_states.items():
+            if guild_id in resuming:
+                state.suspend()
+            else:
+                closing.append(state.close())
 
-        for state in self.voice_states.values():
-            self.bot.loop.create_task(state.stop())
+        await asyncio.gather(*closing, return_exceptions=True)
+        VoiceState.journal.close()
+        VoiceState.timers.close()
+
+        YTDLSource.cache.close()
+        YTDLSource.resolver.shutdown()
+        YTDLSource.backends.shutdown()
+        YTDLSource.searcher.shutdown()
+        SpotifySource.matcher.cache.close()
+        await SpotifySource.client.close()
+        VoiceState.sender.shutdown()
 
-    def get_voice_state(self, inter:Inter, /):
+        if YTDLSource.audio_cache is not None:
+            YTDLSource.audio_cache.close()
+
+    async def get_voice_state(self, inter:Inter, /, *, create:bool=False):
         """Get the voice state of the guild"""
 
+        return await self.guild_voice_state(inter.guild, create=create)
+
+    async def guild_voice_state(self, guild:discord.Guild, /, *, create:bool=False):
+        """Get the voice state of a guild. States are only created for
+        commands that start playback, otherwise this returns None for a
+        guild without one. A new state's queue is read back from the
+        journal before it is returned."""
+
+        state = self.voice_states.get(guild.id)
+        if state is None:
+            if not create:
+                return None
+
+            state = VoiceState(self.bot, guild)
+            self.voice_states.add(guild.id, state)
+
+        # Shielded, one command giving up mustn't cancel it for others
+        await asyncio.shield(state.rehydrated)
+        return state
+
+    def _resume_points(self) -> list[ResumePoint]:
+        """Returns where each playing guild is up to"""
+
+        points = []
+        for state in self.voice_states.values():
+            point = state.resume_point()
+            if point is not None:
+                points.append(point)
+
+        return points
+
+    @staticmethod
+    async def _in_thread(function, *args):
+        """Run a blocking call in a worker thread. If the caller is
+        cancelled the call is still waited for before cancelling, a
+        thread can't be stopped part way."""
+
+        call = asyncio.ensure_future(asyncio.to_thread(function, *args))
         try:
-            return self.voice_states[inter.guild.id]
-        except KeyError:
-            state = VoiceState(self.bot, inter)
-            self.voice_states[inter.guild.id] = state
-            return state
+            return await asyncio.shield(call)
+        except asyncio.CancelledError:
+            await asyncio.gather(call, return_exceptions=True)
+            raise
+
+    async def _save_resume_points(self) -> None:
+        """Save where each guild is up to every few seconds, the
+        writes run on a worker thread"""
+
+        saved = False
+
+        while True:
+            await asyncio.sleep(MUSIC_RESUME_SAVE_SECONDS)
+
+            points = self._resume_points()
+            if points or saved:
+                await self._in_thread(self.resume_store.save, points)
+                saved = bool(points)
+
+    async def _resume_guilds(self) -> None:
+        """Pick up playback where it was left before the last restart
+        or reload"""
+
+        await self.bot.wait_until_ready()
+
+        points = await self._in_thread(self.resume_store.load, MUSIC_RESUME_MAX_AGE)
+        for point in points:
+            try:
+                await self._resume_guild(point)
+            except (discord.ClientException, discord.HTTPException, asyncio.TimeoutError) as error:
+                log.warning("Couldn't resume playback in guild %s: %s", point.guild_id, error)
+
+    async def _resume_guild(self, point:ResumePoint) -> None:
+        """Rejoin a guild's voice channel and carry on playing its song
+        from the position it was up to"""
+
+        guild = self.bot.get_guild(point.guild_id)
+        if guild is None:
+            return
+
+        channel = guild.get_channel(point.voice_channel_id)
+        text_channel = guild.get_channel(point.text_channel_id)
+        voice = guild.voice_client
+
+        # Nobody is left to listen, leave if the reload kept us here
+        if (
+            channel is None or text_channel is None
+            or not any(not member.bot for member in channel.members)
+        ):
+            if voice is not None:
+                await voice.disconnect()
+            return
+
+        # After a reload the voice connection is still there
+        if voice is None or not voice.is_connected():
+            voice = await channel.connect()
+
+        log.debug("Resuming guild %s at %.2fs", guild.id, point.position)
+
+        state = await self.guild_voice_state(guild, create=True)
+        state.voice = voice
+        state.volume = point.volume
+        state.loop = point.loop
+        state.resume(
+            Song.restore(
+                guild.get_member(point.requester_id) or guild.me,
+                text_channel,
+                point.info
+            ),
+            point.position
+        )
+        self.resume_store.resumed += 1
 
     @staticmethod
     async def check_member_in_vc(inter:Inter) -> bool:
@@ -391,7 +1672,8 @@ class MusicCog(BaseCog, name="New Music"):
             app_commands.CheckFailure: If the bot is not playing a song
         """
 
-        if not self.get_voice_state(inter).check_playing:
+        voice_state = await self.get_voice_state(inter)
+        if voice_state is None or not voice_state.check_playing:
             raise app_commands.CheckFailure(MUSIC_NOTPLAYING)
 
         return True
@@ -401,10 +1683,11 @@ class MusicCog(BaseCog, name="New Music"):
         """Join the voice channel of the user who invoked the command"""
 
         voice_channel = inter.user.voice.channel
-        voice_state = self.get_voice_state(inter)
+        voice_state = await self.get_voice_state(inter, create=True)
 
         if inter.guild.voice_client:
             await inter.guild.voice_client.move_to(voice_channel)
+            voice_state.voice = inter.guild.voice_client
             return
 
         voice_state.voice: VoiceClient = await voice_channel.connect()
@@ -427,9 +1710,12 @@ class MusicCog(BaseCog, name="New Music"):
             await inter.response.send_message(MUSIC_CANTLEAVEVC)
             return
 
-        voice_state = self.get_voice_state(inter)
-        await voice_state.stop()
-        del self.voice_states[inter.guild.id]
+        voice_state = self.voice_states.remove(inter.guild.id)
+        if voice_state is None:
+            await inter.guild.voice_client.disconnect()
+        else:
+            await voice_state.stop()
+            await voice_state.close()
     
         await inter.response.send_message(MUSIC_LEFTVC)
 
@@ -438,16 +1724,16 @@ class MusicCog(BaseCog, name="New Music"):
     async def currently_playing_cmd(self, inter:Inter):
         """Shows the currently playing song"""
 
-        voice_state = self.get_voice_state(inter)
+        voice_state = await self.get_voice_state(inter)
 
-        if not voice_state.is_playing:
+        if voice_state is None or not voice_state.is_playing:
             await inter.response.send_message(MUSIC_NOTPLAYING)
             return
 
         # Send an embed for the currently playing song
         await inter.response.send_message(
             embed=NowPlayingEmbed(voice_state.current),
-            # view=MusicControlView(voice_state)
+            view=MusicControlView(voice_state)
         )
 
     @app_commands.command(name="queue")
@@ -462,10 +1748,10 @@ class MusicCog(BaseCog, name="New Music"):
 
         log.debug("Checking the queue for page %s", page)
 
-        voice_state = self.get_voice_state(inter)
+        voice_state = await self.get_voice_state(inter)
 
         # Check if the queue is empty first
-        if len(voice_state.queue) == 0:
+        if voice_state is None or len(voice_state.queue) == 0:
             await inter.response.send_message(MUSIC_QUEUEEMPTY)
             return
 
@@ -484,9 +1770,16 @@ class MusicCog(BaseCog, name="New Music"):
         end = start + items_per_page
 
         # Create an output string containing the page info
-        output = f"**Music Queue - {len(voice_state.queue)} tracks**\n\n"
+        total = format_duration(voice_state.queue.total_duration)
+        if voice_state.queue.livestreams:
+            total += "+"
+
+        output = f"**Music Queue - {len(voice_state.queue)} tracks ({total})**\n\n"
         for i, song in enumerate(voice_state.queue[start:end], start=start):
-            output += f"{i+1}. [{song.source.title}]({song.source.url})\n"
+            output += (
+                f"{i+1}. [{song.info.title}]({song.info.url})"
+                f" - {time_until_played(voice_state, i)}\n"
+            )
 
         log.debug("Finished creating queue output")
 
@@ -497,18 +1790,54 @@ class MusicCog(BaseCog, name="New Music"):
         )
         await inter.response.send_message(embed=embed)
 
+    @app_commands.command(name="music-stats")
+    @app_commands.check(is_bot_owner)
+    async def music_stats_cmd(self, inter:Inter):
+        """Shows the internal statistics of the music player"""
+
+        voice_state = await self.get_voice_state(inter)
+        embed = MusicStatsEmbed({
+            "Metadata Cache": YTDLSource.cache.stats(),
+            "Resolver Pool": YTDLSource.resolver.stats(),
+            "Shared Resolves": YTDLSource.flights.stats(),
+            "Resolver Backends": YTDLSource.backends.stats(),
+            "Play Pipeline": VoiceState.play_timings.stats(),
+            "Spotify Matches": SpotifySource.matcher.stats(),
+            "Spotify Search Pool": YTDLSource.searcher.stats(),
+            "FFmpeg Processes": YTDLSource.factory.stats(),
+            "Send Scheduler": VoiceState.sender.stats(),
+            **(
+                {"Broadcasts": YTDLSource.broadcasts.stats()}
+                if YTDLSource.broadcasts is not None else {}
+            ),
+            **(
+                {"Audio Cache": YTDLSource.audio_cache.stats()}
+                if YTDLSource.audio_cache is not None else {}
+            ),
+            "Pinned Tracks": self.pinned.stats(),
+            "Resume Points": self.resume_store.stats(),
+            "Queue Journal": VoiceState.journal.stats(),
+            "Voice States": self.voice_states.stats(),
+            "Idle Timers": VoiceState.timers.stats(),
+            **(
+                {"This Guild": voice_state.stats()}
+                if voice_state is not None else {}
+            )
+        })
+        await inter.response.send_message(embed=embed, ephemeral=True)
+
     @app_commands.command(name="skip")
     @app_commands.check(check_member_in_vc)
     async def skip_cmd(self, inter:Inter):
         """Skips the currently playing song. Requires 3 votes unless
         the requester or an admin skips the song."""
 
-        voice_state = self.get_voice_state(inter)
+        voice_state = await self.get_voice_state(inter)
 
         log.debug("Checking if the user can skip the song")
 
         # Check that there is a song playing
-        if not voice_state.is_playing:
+        if voice_state is None or not voice_state.is_playing:
             log.debug("No song is playing")
             await inter.response.send_message(MUSIC_NOTPLAYING)
             return
@@ -555,10 +1884,10 @@ class MusicCog(BaseCog, name="New Music"):
     async def pause_cmd(self, inter:Inter):
         """Pauses the currently playing song"""
 
-        voice_state = self.get_voice_state(inter)
+        voice_state = await self.get_voice_state(inter)
 
         # Check that there is a song playing
-        if not voice_state.is_playing:
+        if voice_state is None or not voice_state.is_playing:
             await inter.response.send_message(MUSIC_NOTPLAYING)
             return
 
@@ -570,10 +1899,10 @@ class MusicCog(BaseCog, name="New Music"):
     async def resume_cmd(self, inter:Inter):
         """Resumes the currently playing song"""
 
-        voice_state = self.get_voice_state(inter)
+        voice_state = await self.get_voice_state(inter)
 
         # Check that there is a song playing
-        if not voice_state.is_playing:
+        if voice_state is None or not voice_state.is_playing:
             await inter.response.send_message(MUSIC_NOTPLAYING)
             return
 
@@ -588,16 +1917,101 @@ class MusicCog(BaseCog, name="New Music"):
 
         log.debug("Stopping the music player")
 
-        voice_state = self.get_voice_state(inter)
-        voice_state.queue.clear()
+        voice_state = await self.get_voice_state(inter)
 
-        if voice_state.is_playing:
-            await voice_state.stop()
+        if voice_state is not None:
+            voice_state.queue.clear()
+
+            if voice_state.is_playing:
+                await voice_state.stop()
 
         await inter.response.send_message(MUSIC_STOPPED)
 
 
 
+    @app_commands.command(name="volume")
+    @app_commands.check(check_member_in_vc)
+    async def volume_cmd(self, inter:Inter, volume:app_commands.Range[int, 1, 100]):
+        """Sets the volume of the music player
+
+        Args:
+            volume (int): The volume as a percentage
+        """
+
+        voice_state = await self.get_voice_state(inter)
+        if voice_state is None:
+            await inter.response.send_message(MUSIC_NOTPLAYING)
+            return
+
+        voice_state.volume = volume / 100
+
+        await inter.response.send_message(MUSIC_VOLUMESET.format(volume))
+
+    @app_commands.command(name="seek")
+    @app_commands.check(check_member_in_vc)
+    async def seek_cmd(self, inter:Inter, position:str, mode:SeekModes=SeekModes.Fast):
+        """Skips to a position in the currently playing song
+
+        Args:
+            position (str): Where to skip to, in seconds, m:ss or h:mm:ss
+            mode (SeekModes): Fast starts from the nearest point before
+                the position, precise starts exactly at it
+        """
+
+        voice_state = await self.get_voice_state(inter)
+
+        if voice_state is None or not voice_state.is_playing:
+            await inter.response.send_message(MUSIC_NOTPLAYING)
+            return
+
+        try:
+            seconds = parse_duration(position)
+        except ValueError:
+            await inter.response.send_message(MUSIC_INVALIDPOSITION, ephemeral=True)
+            return
+
+        # An expired stream url is refreshed first, which may take a while
+        await inter.response.defer()
+
+        try:
+            seconds = await voice_state.seek(
+                seconds, precise=mode is SeekModes.Precise
+            )
+        except VoiceError as error:
+            await inter.followup.send(str(error))
+            return
+
+        await inter.followup.send(MUSIC_SEEKED.format(format_duration(seconds)))
+
+    @app_commands.command(name="transition")
+    @app_commands.check(check_member_in_vc)
+    async def transition_cmd(
+        self,
+        inter:Inter,
+        mode:Transitions,
+        seconds:app_commands.Range[int, 1, 12]=MUSIC_CROSSFADE_SECONDS
+    ):
+        """Sets how songs lead into each other
+
+        Args:
+            mode (Transitions): Play songs back to back, or crossfade
+            seconds (int): How long a crossfade lasts
+        """
+
+        voice_state = await self.get_voice_state(inter)
+        if voice_state is None:
+            await inter.response.send_message(MUSIC_NOTPLAYING)
+            return
+
+        voice_state.transition = mode
+        if mode is Transitions.Crossfade:
+            voice_state.crossfade = seconds
+            message = MUSIC_CROSSFADESET.format(seconds)
+        else:
+            message = MUSIC_GAPLESSSET
+
+        await inter.response.send_message(message)
+
     @app_commands.command(name="loop")
     @app_commands.check(check_member_in_vc)
     async def loop_cmd(self, inter:Inter, loop:bool):
@@ -607,10 +2021,10 @@ class MusicCog(BaseCog, name="New Music"):
             loop (bool): True if the song should loop
         """
 
-        voice_state = self.get_voice_state(inter)
+        voice_state = await self.get_voice_state(inter)
 
         # We can't loop if there is no song playing
-        if not voice_state.is_playing:
+        if voice_state is None or not voice_state.is_playing:
             await inter.response.send_message(MUSIC_NOTPLAYING)
             return
 
@@ -628,23 +2042,119 @@ class MusicCog(BaseCog, name="New Music"):
             search (str): The search query or URL to use
         """
 
-        voice_state = self.get_voice_state(inter)
+        if youtube_playlist_id(search):
+            return await self.playlist_playback(
+                inter, search, YTDLSource.playlist(inter, search)
+            )
 
-        # Join the voice channel if the bot is not already in one
-        if not inter.guild.voice_client:
-            await self.join_vc(inter)
+        await self.play_pipeline(inter, functools.partial(
+            YTDLSource.from_query, inter, search, async_loop=self.bot.loop
+        ))
 
-        # This may take a while, defer to prevent timeout
-        await inter.response.defer()
+    async def spotify_playback(self, inter:Inter, search:str):
+        """Plays audio from a spotify search query or URL, I will join
+           the vc if the I'm not already in one.
 
-        # Create a source from the search query
-        source = await YTDLSource.from_query(
-            inter, search, async_loop=self.bot.loop
-        )
+        Args:
+            search (str): The search query or URL to use
+        """
+
+        link = spotify_link(search)
+        if link is not None and link[0] != "track":
+            return await self.playlist_playback(
+                inter, search, SpotifySource.collection(inter, *link)
+            )
+
+        await self.play_pipeline(inter, functools.partial(
+            SpotifySource.from_query, inter, search, async_loop=self.bot.loop
+        ))
+
+    async def start_playback(self, inter:Inter):
+        """Acknowledge a play command and start joining the user's
+        voice channel in the background. The interaction has to be
+        acknowledged within 3 seconds, so it is done before anything
+        that could take a while.
+
+        Returns:
+            The guild's voice state, and a future that is done once
+            the bot is in the voice channel
+        """
+
+        await VoiceState.play_timings.measure("acknowledge", inter.response.defer())
+        voice_state = await self.get_voice_state(inter, create=True)
+
+        if inter.guild.voice_client:
+            connecting = self.bot.loop.create_future()
+            connecting.set_result(None)
+        else:
+            # Commands run at the same time share one handshake
+            connecting = self.bot.loop.create_task(VoiceState.play_timings.measure(
+                "connect",
+                self.connects.run(inter.guild.id, functools.partial(self.join_vc, inter))
+            ))
+
+        return voice_state, connecting
+
+    @staticmethod
+    async def joined(inter:Inter, connecting) -> bool:
+        """Wait for the bot to join the voice channel, telling the
+        user if it couldn't
+
+        Returns:
+            bool: True if the bot is in the voice channel
+        """
+
+        try:
+            await connecting
+        except (discord.ClientException, discord.HTTPException, asyncio.TimeoutError) as error:
+            log.warning("Couldn't join voice in guild %s: %s", inter.guild.id, error)
+            await inter.followup.send(MUSIC_CONNECTFAILED)
+            return False
+
+        return True
+
+    @staticmethod
+    def resolve_failure(error:Exception) -> str:
+        """Returns the message telling the user why their query
+        couldn't be played"""
+
+        if isinstance(error, ResolverBusy):
+            return MUSIC_RESOLVERBUSY
+
+        if isinstance(error, ResolverTimeout):
+            return MUSIC_RESOLVERTIMEOUT
+
+        if isinstance(error, youtube_dl.utils.DownloadError):
+            log.warning("Couldn't resolve a query: %s", error)
+            return MUSIC_DOWNLOADFAILED
+
+        return str(error)
+
+    async def play_pipeline(self, inter:Inter, resolve):
+        """Plays a song, resolving it while the bot joins the voice
+        channel and queueing it once both are done. The time taken by
+        each stage is recorded.
+
+        Args:
+            resolve: Coroutine function that returns the song
+        """
+
+        requested_at = time.perf_counter()
+        voice_state, connecting = await self.start_playback(inter)
+
+        try:
+            song = await VoiceState.play_timings.measure("resolve", resolve())
+        except RESOLVE_ERRORS as error:
+            await inter.followup.send(self.resolve_failure(error))
+            await asyncio.gather(connecting, return_exceptions=True)
+            return
+
+        if not await self.joined(inter, connecting):
+            return
 
-        # Add the source to the queue as a Song
-        song = Song(source)
         await voice_state.queue.put(song)
+        VoiceState.play_timings.since("queued", requested_at)
+        voice_state.time_first_audio(song, requested_at)
 
         # if the song is the only one in the queue, another embed
         # will be sent when the song starts playing, so don't clutter
@@ -659,47 +2169,86 @@ class MusicCog(BaseCog, name="New Music"):
 
         await inter.followup.send(MUSIC_ADDEDPLAYSOON)
 
-    async def spotify_playback(self, inter:Inter, search:str):
-        """Plays audio from a search query or URL, I will join the
-           join the vc if the I'm not already in one.
+    async def playlist_playback(self, inter:Inter, url:str, batches):
+        """Enqueues a playlist. The songs are added in batches as the
+        playlist is listed, and a single summary message is kept up to
+        date instead of sending one embed per song. The first batch is
+        listed while the bot joins the voice channel.
 
         Args:
-            search (str): The search query or URL to use
+            url (str): The url of the playlist
+            batches: Async generator that yields the title of the
+                playlist and then its songs in batches
         """
 
-        voice_state = self.get_voice_state(inter)
+        requested_at = time.perf_counter()
+        voice_state, connecting = await self.start_playback(inter)
+        songs = []
+        message = None
 
-        # Join the voice channel if the bot is not already in one
-        if not inter.guild.voice_client:
-            await self.join_vc(inter)
+        try:
+            title = await anext(batches)
 
-        # This may take a while, defer to prevent timeout
-        await inter.response.defer()
+            async for batch in batches:
+                if not await self.joined(inter, connecting):
+                    return
 
-        # Create a source from the search query
-        source = await SpotifySource.create_source(
-            inter, search, loop=self.bot.loop
-        )
+                for song in batch:
+                    await voice_state.queue.put(song)
 
-        # Add the source to the queue as a Song
-        song = Song(source)
-        await voice_state.queue.put(song)
+                if batch and not songs:
+                    VoiceState.play_timings.since("queued", requested_at)
+                    voice_state.time_first_audio(batch[0], requested_at)
 
-        # if the song is the only one in the queue, another embed
-        # will be sent when the song starts playing, so don't clutter
-        # the chat with this embed also.
-        if voice_state.is_playing:
-            embed = AddedTrackEmbed(
-                song=song,
-                voice_state=voice_state
-            )
-            view = TrackAddedView(song, voice_state)
-            return await inter.followup.send(embed=embed, view=view)
+                songs.extend(batch)
+                embed = PlaylistAddedEmbed(title, url, inter.user, len(songs), done=False)
 
-        await inter.followup.send(MUSIC_ADDEDPLAYSOON)
+                if message is None:
+                    message = await inter.followup.send(embed=embed, wait=True)
+                else:
+                    await message.edit(embed=embed)
+
+        # Once some songs are queued, the playlist is cut short instead
+        except RESOLVE_ERRORS as error:
+            if message is None:
+                await inter.followup.send(self.resolve_failure(error))
+                await asyncio.gather(connecting, return_exceptions=True)
+                return
 
+            log.warning("Stopped listing playlist %s: %s", url, error)
 
+        if not await self.joined(inter, connecting):
+            return
+
+        embed = PlaylistAddedEmbed(title, url, inter.user, len(songs), done=True)
+        if message is None:
+            await inter.followup.send(embed=embed)
+        else:
+            await message.edit(embed=embed)
 
+        self.bot.loop.create_task(self.resolve_placeholders(voice_state, songs))
+
+    @staticmethod
+    async def resolve_placeholders(voice_state, songs:list):
+        """Fill in the full metadata of placeholder songs in batches,
+        skipping any songs that have since left the queue."""
+
+        for i in range(0, len(songs), MUSIC_PLAYLIST_RESOLVE_BATCH):
+            batch = [
+                song for song in songs[i:i + MUSIC_PLAYLIST_RESOLVE_BATCH]
+                if song.info.is_placeholder and song in voice_state.queue
+            ]
+
+            if not batch:
+                continue
+
+            try:
+                await asyncio.gather(
+                    *(voice_state.prepare_song(song) for song in batch),
+                    return_exceptions=True
+                )
+            except asyncio.CancelledError:
+                return
 
     @app_commands.command(name="play")
     @app_commands.check(check_member_in_vc)
@@ -711,6 +2260,9 @@ class MusicCog(BaseCog, name="New Music"):
             search (str): The search query or URL to use
         """
 
+        if source is Sources.Spotify:
+            return await self.spotify_playback(inter, search)
+
         await self.youtube_playback(inter, search)
 
     shortcut_group = app_commands.Group(
@@ -724,7 +2276,7 @@ class MusicCog(BaseCog, name="New Music"):
     async def rickroll(self, inter:Inter):
         """Plays Rick Astley's "Never Gonna Give You Up" in the current"""
 
-        await self.youtube_playback(inter, search="https://www.youtube.com/watch?v=dQw4w9WgXcQ")
+        await self.youtube_playback(inter, search=self.pinned["rickroll"])
 
 
     @shortcut_group.command(name="iamabadperson")
@@ -732,21 +2284,21 @@ class MusicCog(BaseCog, name="New Music"):
     async def iamabadperson(self, inter:Inter):
         """Plays that one very annoying christmas song in the current"""
 
-        await self.youtube_playback(inter, search="https://www.youtube.com/watch?v=aAkMkVFwAoo")
+        await self.youtube_playback(inter, search=self.pinned["iamabadperson"])
 
     @shortcut_group.command(name="2010youtube")
     @app_commands.check(check_member_in_vc)
     async def old_youtube(self, inter:Inter):
         """Plays a nostalgic track in the current voice channel"""
 
-        await self.youtube_playback(inter, search="https://www.youtube.com/watch?v=Cm0qaXi9THA")
+        await self.youtube_playback(inter, search=self.pinned["2010youtube"])
     
     @shortcut_group.command(name="deadmeme")
     @app_commands.check(check_member_in_vc)
     async def deadmeme(self, inter:Inter):
         """Plays a dead meme in the current voice channel"""
 
-        await self.youtube_playback(inter, search="https://www.youtube.com/watch?v=LBnUc09MK2w")
+        await self.youtube_playback(inter, search=self.pinned["deadmeme"])
 
     
 
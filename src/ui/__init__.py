@@ -3,6 +3,9 @@
 from .embeds import (
     AddedTrackEmbed,
     NowPlayingEmbed,
-    MusicQueueEmbed
+    PlaylistAddedEmbed,
+    MusicQueueEmbed,
+    MusicStatsEmbed,
+    time_until_played
 )
 from .views import MusicControlView, TrackAddedView
@@ -9,6 +9,37 @@ import discord
 log = logging.getLogger(__name__)
 
 
+def time_until_played(voice_state, index:int) -> str:
+    """Get the time until the song at a position in the queue will be
+    played, this is an O(log n) lookup on the queue.
+
+    Args:
+        voice_state (VoiceState): The voice state of the bot
+        index (int): The position of the song in the queue
+
+    Returns:
+        str: The time until the song will be played
+            (discord timestamp or why it is unknown)
+    """
+
+    current = voice_state.current
+    current_duration = current.info.duration if current else 0
+
+    if current and not current_duration:
+        log.debug("Current song is a livestream")
+        return "*Unknown because a livestream is playing*"
+
+    duration, livestreams = voice_state.queue.duration_before(index)
+    if livestreams:
+        log.debug("livesteam in queue, cant calculate duration")
+        return "*Unknown because a livestream is in the queue*"
+
+    est_time = datetime.now() + timedelta(
+        seconds=current_duration + duration
+    )
+    return f"<t:{int(est_time.timestamp())}:R>"
+
+
 class MusicQueueEmbed(discord.Embed):
     """Embed for showing the music queue"""
 
@@ -37,17 +68,14 @@ class NowPlayingEmbed(discord.Embed):
             colour=discord.Colour.blurple()
         )
 
-        # Shorthand for the source object
-        src = song.source
-
-        self.set_thumbnail(url=src.thumbnail)
+        self.set_thumbnail(url=song.info.thumbnail)
 
         self.description = (
-            f"[**{src.title}**]({src.url})"
+            f"[**{song.info.title}**]({song.info.url})"
 
-            f"\n\n**By** [{src.uploader}]({src.uploader_url})"
-            f"\n**Requested by:** {src.requester.mention}"
-            f"\n**Duration:** *{src.parsed_duration}*"
+            f"\n\n**By** [{song.info.uploader}]({song.info.uploader_url})"
+            f"\n**Requested by:** {song.requester.mention}"
+            f"\n**Duration:** *{song.info.parsed_duration}*"
         )
 
 
@@ -63,88 +91,67 @@ class AddedTrackEmbed(discord.Embed):
             colour=discord.Colour.blurple()
         )
 
-        self.set_thumbnail(url=song.source.thumbnail)
+        self.set_thumbnail(url=song.info.thumbnail)
 
         # Get the song's position in the queue
-        position = voice_state.queue.index(song) + 1 
+        index = voice_state.queue.index(song)
 
         # Get the estimated time the song will play
-        time_until_played = self._get_time_until_played(
-            song, voice_state
-        )
+        time_until = time_until_played(voice_state, index)
 
         # Set the embed's description
         self.description = (
-            f"[**{song.source.title}**]({song.source.url})"
+            f"[**{song.info.title}**]({song.info.url})"
 
-            f"\n\n**By** [{song.source.uploader}]({song.source.uploader_url})"
-            f"\n**Requested by:** {song.source.requester.mention}"
+            f"\n\n**By** [{song.info.uploader}]({song.info.uploader_url})"
+            f"\n**Requested by:** {song.requester.mention}"
 
-            f"\n\n**Duration:** *{song.source.parsed_duration}*"
-            f"\n**Position in queue:** {position}"
-            f"\n**Will play:** {time_until_played}"
+            f"\n\n**Duration:** *{song.info.parsed_duration}*"
+            f"\n**Position in queue:** {index + 1}"
+            f"\n**Will play:** {time_until}"
         )
 
-    def _get_time_until_played(self, song, voice_state) -> str:
-        """Get the time until the song will be played
-
-        Args:
-            song (Song): The song to get the time for
-            voice_state (VoiceState): The voice state of the bot
 
-        Returns:
-            str: The time until the song will be played
-                (discord timestamp or "Now Playing")
-        Raises:
-            ValueError: If the song is not in the queue
-            AssertionError: Should never be raised
-        """
+class MusicStatsEmbed(discord.Embed):
+    """Embed for showing the music player's internal statistics"""
 
-        log.debug("Getting time until song will be played")
+    def __init__(self, sections: dict[str, dict]):
 
-        # If the song is the first in the queue and there is a
-        # current song: The song will be played after the current.
-        if voice_state.queue[0] == song:
-            log.debug("Song is first in queue and there is a current song")
+        log.debug("Creating MusicStatsEmbed")
 
-            if voice_state.current.source.duration == 0:
-                log.debug("Current song is a livestream")
-                return "*Unknown because a livestream is playing*"
+        super().__init__(
+            title="Music Player Statistics",
+            colour=discord.Colour.blurple()
+        )
 
-            est_time = datetime.now() + timedelta(
-                seconds=voice_state.current.source.duration
+        for name, stats in sections.items():
+            self.add_field(
+                name=name,
+                value="\n".join(
+                    f"**{key}:** {value}" for key, value in stats.items()
+                ) or "*Nothing to show*",
+                inline=False
             )
-            return f"<t:{int(est_time.timestamp())}:R>"
-
-        # Get the duration of all songs in the queue before the
-        # passed song.
-        duration_sum = voice_state.current.source.duration
-
-        if not duration_sum:
-            log.debug("livesteam in queue, cant calculate duration")
-            return "*Unknown because a livestream is playing*"
-
-        for track in voice_state.queue:
-
-            # There is a livestream in the queue before the song.
-            # The duration of the song cannot be calculated.
-            if not track.source.duration and track != song:
-                log.debug("livesteam in queue, cant calculate duration")
-                return "*Unknown because a livestream is in the queue*"
-
-            # We found the song in the queue, we don't want to
-            # count the duration of any more songs now.
-            if track == song:
-                est_time = datetime.now() + timedelta(
-                    seconds=duration_sum
-                )
-                log.debug(f"Found song in queue, {est_time=}")
-                return f"<t:{int(est_time.timestamp())}:R>"
-
-            # Add the duration of the song to the duration sum
-            duration_sum += track.source.duration
-            log.debug("Added song duration to duration sum")
-
-        # If we get here, the song is not in the queue,
-        # this is a problem.
-        raise ValueError("Song not in queue")
+
+
+class PlaylistAddedEmbed(discord.Embed):
+    """Embed displayed while a playlist is being added to the queue"""
+
+    def __init__(self, title:str, url:str, requester, added:int, done:bool):
+
+        log.debug("Creating PlaylistAddedEmbed")
+
+        super().__init__(
+            title="Playlist Added to Queue" if done else "Adding Playlist to Queue",
+            colour=discord.Colour.blurple()
+        )
+
+        self.description = (
+            f"[**{title or 'Untitled playlist'}**]({url})"
+
+            f"\n\n**Requested by:** {requester.mention}"
+            f"\n**Tracks added:** {added}"
+        )
+
+        if not done:
+            self.set_footer(text="More tracks are on the way...")
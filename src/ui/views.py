@@ -9,6 +9,9 @@ from discord import (
     ButtonStyle
 )
 
+from exceptions import VoiceError
+from constants import MUSIC_SEEK_STEP_SECONDS
+
 
 log = logging.getLogger(__name__)
 
@@ -84,6 +87,14 @@ class MusicControlView(dui.View):
         self.voice_state = voice_state
         self.song = voice_state.current
 
+        # Only the seek buttons work so far, the rest of the layout is
+        # left out until they do
+        for item in (
+            self.pause_resume, self.mute, self.volume_down,
+            self.volume_up, self.loop, self.stop, self.shuffle
+        ):
+            self.remove_item(item)
+
     def ensure_current_song(self):
         """Ensures that the current song is the same as the one that the 
         view was created with"""
@@ -93,14 +104,31 @@ class MusicControlView(dui.View):
                 "controls for that song"
             )
 
+    async def seek_by(self, inter:Inter, seconds:float):
+        """Seek the current song by a number of seconds from where it
+        is up to"""
+
+        try:
+            self.ensure_current_song()
+        except ValueError as error:
+            return await inter.response.send_message(str(error), ephemeral=True)
+
+        await inter.response.defer()
+
+        try:
+            await self.voice_state.seek(self.voice_state.position + seconds)
+        except VoiceError as error:
+            await inter.followup.send(str(error), ephemeral=True)
+
     @dui.button(
         emoji="⏮️",
         style=ButtonStyle.secondary,
         row=0
     )
     async def rewind(self, inter:Inter, button:dui.Button):
-        self.ensure_current_song()
-        await inter.response.send_message("dummy")
+        """Seek back in the current song"""
+
+        await self.seek_by(inter, -MUSIC_SEEK_STEP_SECONDS)
 
     @dui.button(
         emoji="⏯️",
@@ -117,8 +145,9 @@ class MusicControlView(dui.View):
         row=0
     )
     async def forward(self, inter:Inter, button:dui.Button):
-        self.ensure_current_song()
-        await inter.response.send_message("dummy")
+        """Seek forward in the current song"""
+
+        await self.seek_by(inter, MUSIC_SEEK_STEP_SECONDS)
 
     @dui.button(
         emoji="🔇",
@@ -0,0 +1,6 @@
+"""The bot is run from src/, the tests import its modules the same way"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
@@ -0,0 +1,148 @@
+"""Saving played tracks to the audio cache from the frames being read,
+and the Ogg Opus files they are saved as."""
+
+import io
+import os
+import asyncio
+import threading
+
+import discord
+from discord.oggparse import OggStream
+
+from audio.disk_cache import AudioCache
+from audio.ogg import OggOpusWriter, ogg_crc, packet_samples
+
+
+def reference_crc(data:bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = (crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1
+            crc &= 0xFFFFFFFF
+    return crc
+
+def packets(count:int) -> list[bytes]:
+    # A 20ms CELT frame, with a body of any length
+    return [b"\xfc" + os.urandom(200 + i % 400) for i in range(count)]
+
+
+class FakeFFmpeg(discord.AudioSource):
+    """Hands out Opus packets like an ffmpeg source"""
+
+    def __init__(self, frames:list[bytes]):
+        self.frames = list(frames)
+        self.cleaned = False
+
+    def is_opus(self) -> bool:
+        return True
+
+    def read(self) -> bytes:
+        return self.frames.pop(0) if self.frames else b""
+
+    def cleanup(self) -> None:
+        self.cleaned = True
+
+
+def play(tee, frames:int=None) -> None:
+    """Read a source on another thread like the buffer does"""
+
+    def run():
+        for _ in range(frames) if frames is not None else iter(int, 1):
+            if not tee.read():
+                return
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+
+
+def test_ogg_crc_matches_the_reference():
+    for size in (0, 1, 27, 5000):
+        data = os.urandom(size)
+        assert ogg_crc(data) == reference_crc(data)
+
+def test_packet_samples():
+    assert packet_samples(b"\xfc") == 960  # CELT 20ms
+    assert packet_samples(b"\xf8") == 960  # 20ms, one frame
+    assert packet_samples(b"\xf9") == 1920  # two frames
+    assert packet_samples(b"\xeb\x03") == 720  # three 5ms frames
+    assert packet_samples(b"\x08") == 960  # SILK 20ms
+
+def test_writer_round_trips_packets():
+    frames = packets(700)
+    file = io.BytesIO()
+
+    writer = OggOpusWriter(file)
+    for frame in frames:
+        writer.write(frame)
+    writer.close()
+
+    file.seek(0)
+    read = list(OggStream(file).iter_packets())
+
+    assert read[0].startswith(b"OpusHead") and read[1].startswith(b"OpusTags")
+    assert read[2:] == frames
+    assert writer.samples == 700 * 960
+    assert writer.written == len(file.getvalue())
+
+def test_track_played_to_the_end_is_saved(tmp_path):
+    frames = packets(250)  # 5 seconds
+    cache = AudioCache(str(tmp_path))
+
+    async def main():
+        original = FakeFFmpeg(frames)
+        tee = cache.tee("abcdefghijk", 5, original)
+
+        play(tee)
+        await asyncio.sleep(0.1)
+
+        # Already saved or being saved, it isn't teed again
+        assert cache.tee("abcdefghijk", 5, original) is original
+
+        tee.cleanup()
+        return original
+
+    original = asyncio.run(main())
+    path = asyncio.run(cache.path("abcdefghijk"))
+
+    assert original.cleaned
+    assert path is not None and cache.stored == 1
+    assert asyncio.run(cache.verify("abcdefghijk"))
+
+    with open(path, "rb") as file:
+        assert list(OggStream(file).iter_packets())[2:] == frames
+
+def test_skipped_track_is_not_saved(tmp_path):
+    cache = AudioCache(str(tmp_path))
+
+    async def main():
+        tee = cache.tee("abcdefghijk", 5, FakeFFmpeg(packets(250)))
+        play(tee, frames=100)
+        tee.cleanup()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+
+    assert "abcdefghijk" not in cache
+    assert not list(tmp_path.glob("*.partial"))
+
+    # It can be saved the next time it plays
+    async def again():
+        return cache.tee("abcdefghijk", 5, FakeFFmpeg([]))
+
+    assert not isinstance(asyncio.run(again()), FakeFFmpeg)
+
+def test_stream_cut_short_is_not_saved(tmp_path):
+    cache = AudioCache(str(tmp_path))
+
+    async def main():
+        tee = cache.tee("abcdefghijk", 60, FakeFFmpeg(packets(250)))
+        play(tee)
+        await asyncio.sleep(0.1)
+        tee.cleanup()
+
+    asyncio.run(main())
+
+    assert "abcdefghijk" not in cache
+    assert not list(tmp_path.glob("*.partial"))
@@ -0,0 +1,208 @@
+"""Hedged resolution against local stand-in backends.
+
+Each backend runs a blocking function on a resolver pool of its own,
+like the youtube backends do, the functions just sleep instead of
+running youtube_dl.
+"""
+
+import time
+import asyncio
+import threading
+
+import pytest
+
+from audio.backends import Backend, ResolverRegistry
+from audio.resolver import ResolverPool
+from exceptions import ResolverTimeout, YTDLError
+from constants import MUSIC_HEDGE_MIN_SAMPLES
+
+
+class StandIn:
+    """A blocking resolve that answers after a delay, or raises"""
+
+    def __init__(self, delay:float, error:Exception=None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.finished = threading.Event()
+
+    def __call__(self, query:str) -> dict:
+        self.calls += 1
+        time.sleep(self.delay)
+        self.finished.set()
+
+        if self.error is not None:
+            raise self.error
+
+        return {"query": query, "delay": self.delay}
+
+
+def backend(name:str, func, *, workers:int=2, timeout:float=5) -> Backend:
+    return Backend(name, ResolverPool(workers, guild_limit=workers), func, timeout=timeout)
+
+def warm(primary:Backend, latency:float) -> None:
+    """Give a backend enough latency samples to hedge on its p95"""
+
+    primary._latencies.extend([latency] * MUSIC_HEDGE_MIN_SAMPLES)
+
+
+def test_slow_primary_is_hedged_and_the_hedge_wins():
+    async def main():
+        slow, fast = StandIn(1.0), StandIn(0.05)
+        registry = ResolverRegistry()
+        registry.register(primary := backend("slow", slow))
+        registry.register(backend("fast", fast))
+        warm(primary, 0.01)
+
+        started = time.perf_counter()
+        result = await registry.resolve(1, "query")
+        elapsed = time.perf_counter() - started
+        registry.shutdown()
+        return result, elapsed, registry
+
+    result, elapsed, registry = asyncio.run(main())
+
+    assert result["delay"] == 0.05
+    assert elapsed < 0.9  # hedged after the min delay, not after 1s
+    assert registry.hedges == 1
+    assert registry.hedge_wins == 1
+
+def test_fast_primary_is_not_hedged():
+    async def main():
+        fast, other = StandIn(0.01), StandIn(0.01)
+        registry = ResolverRegistry()
+        registry.register(backend("fast", fast))
+        registry.register(backend("other", other))
+
+        result = await registry.resolve(1, "query")
+        registry.shutdown()
+        return result, other.calls, registry.hedges
+
+    result, other_calls, hedges = asyncio.run(main())
+
+    assert result["query"] == "query"
+    assert other_calls == 0
+    assert hedges == 0
+
+def test_hedge_skips_a_backend_whose_workers_are_busy():
+    async def main():
+        slow, blocked = StandIn(0.8), StandIn(0.01)
+        registry = ResolverRegistry()
+        registry.register(primary := backend("slow", slow))
+        registry.register(busy := backend("busy", blocked, workers=1))
+        warm(primary, 0.01)
+
+        # Keep the second backend's only worker busy
+        hog = asyncio.ensure_future(busy.pool.submit(2, time.sleep, 2))
+        await asyncio.sleep(0.05)
+
+        result = await registry.resolve(1, "query")
+        hog.cancel()
+        registry.shutdown()
+        return result, blocked.calls, registry.hedges
+
+    result, blocked_calls, hedges = asyncio.run(main())
+
+    assert result["delay"] == 0.8
+    assert blocked_calls == 0
+    assert hedges == 0
+
+def test_losing_backend_keeps_its_worker_until_it_returns():
+    async def main():
+        slow, fast = StandIn(0.6), StandIn(0.05)
+        registry = ResolverRegistry()
+        registry.register(primary := backend("slow", slow, workers=1))
+        registry.register(backend("fast", fast))
+        warm(primary, 0.01)
+
+        await registry.resolve(1, "query")
+
+        # The slow extraction can't be interrupted, its worker is only
+        # free again once it has returned
+        busy_after_win = not primary.available
+        await asyncio.get_running_loop().run_in_executor(None, slow.finished.wait, 2)
+        await asyncio.sleep(0.05)
+        free_after_return = primary.available
+
+        registry.shutdown()
+        return busy_after_win, free_after_return
+
+    busy_after_win, free_after_return = asyncio.run(main())
+
+    assert busy_after_win
+    assert free_after_return
+
+def test_failing_backend_fails_over():
+    async def main():
+        broken, working = StandIn(0.01, RuntimeError("boom")), StandIn(0.01)
+        registry = ResolverRegistry()
+        registry.register(backend("broken", broken))
+        registry.register(backend("working", working))
+
+        result = await registry.resolve(1, "query")
+        registry.shutdown()
+        return result, registry.failovers, registry.hedge_wins
+
+    result, failovers, hedge_wins = asyncio.run(main())
+
+    assert result["query"] == "query"
+    assert failovers == 1
+    assert hedge_wins == 0
+
+def test_definitive_error_is_raised_without_failing_over():
+    async def main():
+        missing, other = StandIn(0.01, YTDLError("nothing")), StandIn(0.01)
+        registry = ResolverRegistry(definitive=(YTDLError,))
+        registry.register(backend("missing", missing))
+        registry.register(backend("other", other))
+
+        try:
+            with pytest.raises(YTDLError):
+                await registry.resolve(1, "query")
+        finally:
+            registry.shutdown()
+
+        return other.calls
+
+    assert asyncio.run(main()) == 0
+
+def test_every_backend_timing_out_raises_resolver_timeout():
+    async def main():
+        registry = ResolverRegistry()
+        registry.register(first := backend("first", StandIn(0.5), timeout=0.1))
+        registry.register(second := backend("second", StandIn(0.5), timeout=0.1))
+
+        try:
+            with pytest.raises(ResolverTimeout):
+                await registry.resolve(1, "query")
+        finally:
+            registry.shutdown()
+
+        return first.timeouts, second.timeouts
+
+    assert asyncio.run(main()) == (1, 1)
+
+def test_cancelled_caller_cancels_queued_jobs():
+    async def main():
+        slow = StandIn(0.3)
+        registry = ResolverRegistry()
+        registry.register(primary := backend("slow", slow, workers=1))
+
+        # The worker is busy, so the resolve is queued on the pool
+        hog = asyncio.ensure_future(primary.pool.submit(2, time.sleep, 0.3))
+        await asyncio.sleep(0.05)
+
+        task = asyncio.ensure_future(registry.resolve(1, "query"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        await hog
+        await asyncio.sleep(0.05)
+        registry.shutdown()
+        return slow.calls
+
+    # The queued job is dropped before it reaches a worker
+    assert asyncio.run(main()) == 0
@@ -0,0 +1,305 @@
+"""Spotify matching against a local stub catalog, and the web api
+client against a mocked spotify."""
+
+import time
+import random
+import asyncio
+import threading
+import functools
+
+import httpx
+import pytest
+
+from audio.spotify import (
+    SpotifyTrack,
+    SpotifyClient,
+    SpotifyMatcher,
+    MatchCache,
+    match_score,
+    spotify_link
+)
+from audio.resolver import ResolverPool
+from audio.track import TrackInfo
+from exceptions import SpotifyError, ResolverBusy, YTDLError
+from constants import MUSIC_SPOTIFY_MATCH_BATCH
+
+
+ARTISTS = ["Adele", "Muse", "Queen", "Drake", "Björk", "Coldplay", "Sia", "Lorde"]
+WORDS = "love night heart fire dream rain city light gold road storm river moon blue wild".split()
+
+
+class Catalog:
+    """Stands in for youtube search. Every track has its official
+    video among a lyric video, a cover and an unrelated video."""
+
+    def __init__(self, size:int, *, seed:int=1):
+        rng = random.Random(seed)
+        self.tracks = []
+        self.results = {}
+        self.searches = 0
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+        for i in range(size):
+            title = " ".join(rng.sample(WORDS, 2)).title() + f" {i}"
+            artist = rng.choice(ARTISTS)
+            duration = rng.randint(150, 300)
+            track = SpotifyTrack(f"{i:022d}", title, (artist,), duration, f"USRC{i:08d}")
+            self.tracks.append(track)
+
+            self.results[track.query] = [
+                self.entry(f"lyric{i}", f"{title} lyrics", duration + 20, "Lyrics Channel"),
+                self.entry(f"cover{i}", f"{title} (cover by someone)", duration + 40, "Covers"),
+                self.entry(f"official{i}", f"{artist} - {title} (Official Video)", duration + rng.randint(-4, 4), f"{artist}VEVO"),
+                self.entry(f"other{i}", "Something else entirely", duration, "Someone"),
+            ]
+
+    @staticmethod
+    def entry(video_id:str, title:str, duration:int, uploader:str) -> dict:
+        return {"id": video_id, "title": title, "duration": duration, "uploader": uploader}
+
+    def search(self, query:str) -> list[dict]:
+        """Blocking search, run on a resolver pool like the real one"""
+
+        with self._lock:
+            self.searches += 1
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+
+        time.sleep(0.02)
+
+        with self._lock:
+            self.running -= 1
+
+        if query not in self.results:
+            raise YTDLError(f"Couldn't find anything that matches `{query}`")
+
+        return self.results[query]
+
+
+def to_info(entry:dict) -> TrackInfo:
+    return TrackInfo(entry["title"], f"https://www.youtube.com/watch?v={entry['id']}", duration=entry["duration"])
+
+def matched_id(info:TrackInfo) -> str:
+    return info.url.rsplit("=", 1)[1]
+
+async def match_all(matcher:SpotifyMatcher, tracks:list, search) -> list:
+    pairs = []
+    async for batch in matcher.match(tracks, search):
+        pairs.extend(batch)
+    return pairs
+
+def pool_search(catalog:Catalog):
+    """Search through a pool sized like the bot's search pool"""
+
+    pool = ResolverPool(MUSIC_SPOTIFY_MATCH_BATCH, guild_limit=MUSIC_SPOTIFY_MATCH_BATCH)
+    return pool, functools.partial(pool.submit, 1, catalog.search, local=True)
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC?si=abc", ("track", "4uLU6hMCjMI75M1A2tKUQC")),
+    ("https://open.spotify.com/intl-de/album/4uLU6hMCjMI75M1A2tKUQC", ("album", "4uLU6hMCjMI75M1A2tKUQC")),
+    ("spotify:playlist:37i9dQZF1DXcBWIGoYBM5M", ("playlist", "37i9dQZF1DXcBWIGoYBM5M")),
+    ("https://open.spotify.com/artist/4uLU6hMCjMI75M1A2tKUQC", None),
+    ("https://www.youtube.com/watch?v=dQw4w9WgXcQ", None),
+    ("never gonna give you up", None),
+])
+def test_spotify_link(query, expected):
+    assert spotify_link(query) == expected
+
+def test_official_video_scores_highest():
+    catalog = Catalog(1)
+    track = catalog.tracks[0]
+    scores = {entry["id"]: match_score(track, entry) for entry in catalog.results[track.query]}
+
+    assert max(scores, key=scores.get) == "official0"
+    assert scores["lyric0"] < 0.6  # wrong length and no artist
+
+def test_matches_a_playlist_in_concurrent_batches(tmp_path):
+    catalog = Catalog(200)
+    matcher = SpotifyMatcher(MatchCache(str(tmp_path / "matches.sqlite3")), to_info)
+
+    async def main():
+        pool, search = pool_search(catalog)
+        started = time.perf_counter()
+        pairs = await match_all(matcher, catalog.tracks, search)
+        pool.shutdown()
+        return pairs, time.perf_counter() - started
+
+    pairs, elapsed = asyncio.run(main())
+
+    assert [track for track, _ in pairs] == catalog.tracks
+    assert all(matched_id(info) == f"official{i}" for i, (_, info) in enumerate(pairs))
+    assert catalog.searches == 200
+
+    # A whole batch searches at once, a single guild isn't held to
+    # the resolver pool's limit
+    assert catalog.peak == MUSIC_SPOTIFY_MATCH_BATCH
+    assert elapsed < 200 * 0.02 / 2
+
+def test_matches_are_remembered_by_isrc(tmp_path):
+    catalog = Catalog(30)
+    path = str(tmp_path / "matches.sqlite3")
+
+    async def main():
+        pool, search = pool_search(catalog)
+        await match_all(SpotifyMatcher(MatchCache(path), to_info), catalog.tracks, search)
+
+        # The same recordings on another release, after a restart
+        matcher = SpotifyMatcher(MatchCache(path), to_info)
+        releases = [
+            SpotifyTrack(f"{i:021d}x", track.title, track.artists, track.duration, track.isrc.lower())
+            for i, track in enumerate(catalog.tracks)
+        ]
+        pairs = await match_all(matcher, releases, search)
+        pool.shutdown()
+        return matcher, pairs
+
+    matcher, pairs = asyncio.run(main())
+
+    assert catalog.searches == 30
+    assert all(info is not None for _, info in pairs)
+    assert matcher.cache.hits == 30
+
+def test_unmatched_and_repeated_tracks(tmp_path):
+    catalog = Catalog(3)
+    matcher = SpotifyMatcher(MatchCache(str(tmp_path / "matches.sqlite3")), to_info)
+    unknown = SpotifyTrack("y" * 22, "Nope", ("Nobody",), 200)
+
+    async def main():
+        pool, search = pool_search(catalog)
+        pairs = await match_all(matcher, [unknown, catalog.tracks[0], unknown], search)
+        pool.shutdown()
+        return pairs
+
+    pairs = asyncio.run(main())
+
+    assert [info is None for _, info in pairs] == [True, False, True]
+    assert catalog.searches == 2  # the repeated track is searched once
+    assert matcher.unmatched == 1
+    assert len(matcher.cache) == 2  # by isrc and by spotify id
+
+def test_busy_resolver_is_raised(tmp_path):
+    matcher = SpotifyMatcher(MatchCache(str(tmp_path / "matches.sqlite3")), to_info)
+
+    async def busy(query):
+        raise ResolverBusy("full")
+
+    with pytest.raises(ResolverBusy):
+        asyncio.run(match_all(matcher, Catalog(1).tracks, busy))
+
+
+def spotify_track(i:int) -> dict:
+    return {
+        "id": f"{i:022d}",
+        "name": f"Song {i}",
+        "artists": [{"name": "Band"}],
+        "duration_ms": 200000,
+        "external_ids": {"isrc": f"ISRC{i}"},
+    }
+
+class MockSpotify:
+    """Answers the web api requests the client makes"""
+
+    def __init__(self, playlist_size:int=0):
+        self.playlist_size = playlist_size
+        self.requests = []
+        self.rate_limited = False
+
+    def __call__(self, request:httpx.Request) -> httpx.Response:
+        path = request.url.path
+        params = request.url.params
+        self.requests.append(path)
+
+        if path == "/api/token":
+            return httpx.Response(200, json={"access_token": "token", "expires_in": 3600})
+
+        assert request.headers["authorization"] == "Bearer token"
+
+        if path == "/v1/search" and not self.rate_limited:
+            self.rate_limited = True
+            return httpx.Response(429, headers={"Retry-After": "0"})
+
+        if path == "/v1/search":
+            return httpx.Response(200, json={"tracks": {"items": [spotify_track(7)]}})
+
+        if path.endswith("/tracks") and path.startswith("/v1/playlists/"):
+            offset = int(params["offset"])
+            end = min(offset + int(params["limit"]), self.playlist_size)
+            items = [{"track": spotify_track(i)} for i in range(offset, end)]
+            items += [{"track": None}, {"is_local": True, "track": {"id": None, "name": "Local"}}]
+            return httpx.Response(200, json={"items": items, "next": "more" if end < self.playlist_size else None})
+
+        if path.startswith("/v1/playlists/"):
+            return httpx.Response(200, json={"name": "Mix"})
+
+        if path.endswith("/tracks") and path.startswith("/v1/albums/"):
+            return httpx.Response(200, json={"items": [{"id": f"{i:022d}"} for i in range(3)], "next": None})
+
+        if path.startswith("/v1/albums/"):
+            return httpx.Response(200, json={"name": "Album"})
+
+        if path == "/v1/tracks":
+            return httpx.Response(200, json={"tracks": [spotify_track(int(i)) for i in params["ids"].split(",")]})
+
+        return httpx.Response(404)
+
+def client_for(tmp_path, transport) -> SpotifyClient:
+    credentials = tmp_path / "SPOTIFY"
+    credentials.write_text("client-id\nclient-secret\n")
+
+    client = SpotifyClient(str(credentials))
+    client._client = httpx.AsyncClient(base_url=client.API, transport=transport)
+    return client
+
+async def collect(pages) -> tuple[str, list]:
+    name = await anext(pages)
+    return name, [page async for page in pages]
+
+
+def test_playlist_is_paged_and_skips_local_tracks(tmp_path):
+    spotify = MockSpotify(playlist_size=230)
+    client = client_for(tmp_path, httpx.MockTransport(spotify))
+
+    name, pages = asyncio.run(collect(client.collection("playlist", "p" * 22)))
+
+    assert name == "Mix"
+    assert [len(page) for page in pages] == [100, 100, 30]
+    assert spotify.requests.count("/api/token") == 1
+
+def test_album_tracks_are_fetched_with_their_isrc(tmp_path):
+    client = client_for(tmp_path, httpx.MockTransport(MockSpotify()))
+
+    name, pages = asyncio.run(collect(client.collection("album", "a" * 22)))
+
+    assert name == "Album"
+    assert [track.isrc for track in pages[0]] == ["ISRC0", "ISRC1", "ISRC2"]
+
+def test_search_waits_out_a_rate_limit(tmp_path):
+    client = client_for(tmp_path, httpx.MockTransport(MockSpotify()))
+
+    track = asyncio.run(client.search("song 7"))
+
+    assert track.title == "Song 7"
+
+def test_missing_track_raises_spotify_error(tmp_path):
+    client = client_for(tmp_path, httpx.MockTransport(MockSpotify()))
+
+    with pytest.raises(SpotifyError):
+        asyncio.run(client.track("z" * 22))
+
+def test_network_failure_raises_spotify_error(tmp_path):
+    def unreachable(request):
+        raise httpx.ConnectError("connection refused", request=request)
+
+    client = client_for(tmp_path, httpx.MockTransport(unreachable))
+
+    with pytest.raises(SpotifyError):
+        asyncio.run(client.track("4uLU6hMCjMI75M1A2tKUQC"))
+
+def test_missing_credentials_raise_spotify_error(tmp_path):
+    client = SpotifyClient(str(tmp_path / "missing"))
+
+    with pytest.raises(SpotifyError):
+        asyncio.run(client.track("4uLU6hMCjMI75M1A2tKUQC"))